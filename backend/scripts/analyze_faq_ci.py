@@ -6,22 +6,45 @@ FAQ Analysis Script for CI/Local (Multi-DB Support)
 """
 
 import os
+import sys
 import json
+import asyncio
 import time
 import argparse
+import signal
 import re
-import sqlite3
+import random
+from types import SimpleNamespace
 from datetime import datetime, timedelta
-from openai import OpenAI
+from openai import AsyncOpenAI
 from tqdm import tqdm
+from llm_rate_limiter import AdaptiveRateLimiter, estimate_tokens
+from llm_cache import LLMResponseCache
+from llm_hedging import RequestHedger
+from llm_usage import UsageTracker, extract_usage, split_usage, merge_usage, usage_values, ensure_usage_columns
+from faq_prompts import PROMPT_VERSION, CATEGORIES, build_user_prompt, build_messages, build_repair_prompt
+from faq_output import (parse_classification, parse_batch_output, match_category, extract_json, OutputParseError,
+                        ParseStats, ensure_parse_stats_schema)
+from faq_preclassifier import PreClassifier, RULES_PROMPT_ID
+from faq_dedup import NearDuplicateIndex, DEDUP_PROMPT_ID, context_signature
+from faq_writer import BufferedWriter
+from faq_processed import (ensure_processed_schema, backfill_processed, content_hash, mark_processed,
+                           save_checkpoint, record_failure, clear_checkpoints, load_checkpoints,
+                           MAX_UTTERANCE_FAILURES)
+from faq_linkage import ensure_linkage_schema, update_linkage, LINK_TABLE
+from faq_db import Database, is_postgres_url, PSYCOPG2_AVAILABLE
+from faq_log_format import encode_input, ZSTD_AVAILABLE
+from faq_daemon import TranscriptWatcher, ensure_watch_index
+from faq_claims import WorkQueue, ensure_queue_schema, QUEUE_TABLE
+from faq_context import PromptSizeHistogram, looks_referential
+from faq_transcript import (CONTEXT_TOKEN_BUDGET, ESCALATION_CONTEXT_TURNS, format_timestamp, parse_transcript,
+                            iter_candidates, render_context, candidate_span, short_span, batch_span,
+                            candidate_prompt, batch_prompt)
+from faq_local_model import NGramModel, LocalClassifier, LOCAL_MODEL_PROMPT_ID
+from faq_budget import RunBudget, BudgetExhausted
 
-# 尝试导入 PostgreSQL 支持 (可选)
-try:
-    import psycopg2
-    from psycopg2.extras import RealDictCursor
-    PSYCOPG2_AVAILABLE = True
-except ImportError:
-    PSYCOPG2_AVAILABLE = False
+# PostgreSQL 支持为可选依赖 (psycopg2)
+if not PSYCOPG2_AVAILABLE:
     print("ℹ️  提示: psycopg2 未安装，将使用 SQLite 模式")
 
 def load_env_local():
@@ -45,31 +68,30 @@ HUNYUAN_API_KEY = os.getenv("HUNYUAN_API_KEY") or load_env_local()
 HUNYUAN_BASE_URL = "https://api.hunyuan.cloud.tencent.com/v1"
 
 # 配置
-CONTEXT_WINDOW = 20
-CATEGORIES = [
-    "价格咨询", "服务范围", "上门时间", "质保期",
-    "服务人员", "施工流程", "联系方式", "公司资质",
-    "材料品牌", "施工周期", "付款方式", "优惠活动",
-    "其他问题", "非问题"
-]
-
-def get_db_connection(db_url=None):
-    """获取数据库连接，自动检测类型"""
+LLM_MODEL = "hunyuan-lite"
+LLM_PARAMS = {"temperature": 0.1}  # 参与缓存 Key 计算，修改后旧缓存自动失效
+# 低延迟调用配置 (--call-profile fast) 的输出上限: {"category": "施工周期"} 约 15 Token，带 confidence 约 25 Token
+FAST_MAX_TOKENS = 32
+FAST_CONFIDENCE_MAX_TOKENS = 48
+# 本脚本写入日志的 prompt_id: LLM 分类 / 规则预分类 / 近似重复复用 / 本地模型
+FAQ_PROMPT_IDS = ["faq_v3_ci", RULES_PROMPT_ID, DEDUP_PROMPT_ID, LOCAL_MODEL_PROMPT_ID]
+# 常驻模式下近似去重索引的代表组上限，超过后清空重建 (避免内存随运行时间增长)
+DEDUP_MAX_GROUPS = 200000
+# 缓存查询在线程中另借的连接数 (连接池在分析循环、后台写入、租约心跳、常驻监听之外额外预留)
+CACHE_READ_CONNECTIONS = 2
+
+def get_db_connection(db_url=None, max_connections=4):
+    """创建数据库访问层 (带连接池)，自动检测类型"""
     if not db_url:
         # 默认使用本地 SQLite
         db_url = "team-calls.db"
     
-    if db_url.startswith("postgres://") or db_url.startswith("postgresql://"):
-        if not PSYCOPG2_AVAILABLE:
-            raise RuntimeError("PostgreSQL URL 需要安装 psycopg2-binary")
+    if is_postgres_url(db_url):
         print(f"🔗 连接 PostgreSQL...")
-        # 设置 60 秒超时，避免复杂查询被过早取消
-        conn = psycopg2.connect(db_url, sslmode='require', options='-c statement_timeout=60000')
-        return conn, 'postgres'
     else:
         # SQLite (文件路径)
         print(f"🔗 连接 SQLite: {db_url}")
-        return sqlite3.connect(db_url), 'sqlite'
+    return Database(db_url, max_connections)
 
 def ensure_schema(conn, db_type):
     """确保数据库表结构存在"""
@@ -113,29 +135,41 @@ def ensure_schema(conn, db_type):
                 # 忽略错误（可能是已经允许为空，或表不存在等其他情况）
                 # print(f"⚠️Schema 调整跳过: {e}")
 
-            # [自动修复] 确保 prompt_id = 'faq_v3_ci' 存在于 cfg_prompts 表中
-            try:
-                # 兼容 Prisma Schema: id, name, content, description, prompt_type, created_at, updated_at
-                cur.execute("""
-                    INSERT INTO cfg_prompts 
-                    (id, name, content, description, prompt_type, created_at, updated_at)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s)
-                    ON CONFLICT (id) DO NOTHING
-                """, (
-                    'faq_v3_ci', 
-                    'FAQ V3 Analysis (CI)', 
-                    'Actual prompt is dynamically built in script: analyze_faq_ci.py', 
-                    'GitHub Actions 自动 FAQ 提取 (V3 策略)', 
-                    'analysis', 
-                    datetime.now(), 
-                    datetime.now()
-                ))
-                conn.commit()
-                print("✅ 已确保 Prompt ID 'faq_v3_ci' 存在")
-                
-            except Exception as e:
-                conn.rollback()
-                print(f"⚠️ 无法注册 Prompt ID: {e}")
+            # [自动修复] 确保本脚本使用的 prompt_id 存在于 cfg_prompts 表中
+            prompts = [
+                ('faq_v3_ci', 'FAQ V3 Analysis (CI)',
+                 'Actual prompt is dynamically built in script: analyze_faq_ci.py',
+                 'GitHub Actions 自动 FAQ 提取 (V3 策略)'),
+                (RULES_PROMPT_ID, 'FAQ V3 Rule Pre-classifier',
+                 'Keyword rules in script: faq_preclassifier.py',
+                 '规则预分类 (未调用 LLM 的高置信度判定)'),
+                (DEDUP_PROMPT_ID, 'FAQ V3 Near-duplicate Reuse',
+                 'MinHash/LSH grouping in script: faq_dedup.py',
+                 '近似重复发言复用代表发言的分类结果'),
+                (LOCAL_MODEL_PROMPT_ID, 'FAQ V3 Local N-gram Classifier',
+                 'Hashed char n-gram logistic regression in script: faq_local_model.py',
+                 '本地模型判定 (由历史 LLM 日志训练，未调用 LLM 的高置信度判定)'),
+            ]
+            for prompt_id, name, content, description in prompts:
+                try:
+                    # 兼容 Prisma Schema: id, name, content, description, prompt_type, created_at, updated_at
+                    cur.execute("""
+                        INSERT INTO cfg_prompts 
+                        (id, name, content, description, prompt_type, created_at, updated_at)
+                        VALUES (%s, %s, %s, %s, %s, %s, %s)
+                        ON CONFLICT (id) DO NOTHING
+                    """, (
+                        prompt_id, name, content, description,
+                        'analysis', 
+                        datetime.now(), 
+                        datetime.now()
+                    ))
+                    conn.commit()
+                    print(f"✅ 已确保 Prompt ID '{prompt_id}' 存在")
+                    
+                except Exception as e:
+                    conn.rollback()
+                    print(f"⚠️ 无法注册 Prompt ID '{prompt_id}': {e}")
 
             conn.commit()
     else:  # SQLite
@@ -169,208 +203,982 @@ def ensure_schema(conn, db_type):
             )
         """)
         conn.commit()
+    
+    # Token 用量列 (prompt / completion / 前缀缓存命中)
+    ensure_usage_columns(conn, db_type)
+    # 已处理通话水位表 (增量模式反连接)
+    ensure_processed_schema(conn, db_type)
+    # 通话记录 → 通话关联表 (替代 audio_url 字符串 JOIN)
+    ensure_linkage_schema(conn, db_type)
+    # 多进程并行的工作队列与租约
+    ensure_queue_schema(conn, db_type)
+    # 输出解析统计 (按天 × Prompt 版本 × 请求类型)
+    ensure_parse_stats_schema(conn, db_type)
 
-def format_timestamp(ms):
-    """毫秒转 MM:SS"""
-    seconds = ms // 1000
-    return f"{seconds // 60:02d}:{seconds % 60:02d}"
+# 流式输出中已完整生成的 category 字段
+STREAM_CATEGORY_PATTERN = re.compile(r'"category"\s*:\s*"([^"]*)"')
 
-def is_valid_safety_check(text):
-    """启发式过滤噪音"""
-    if len(text) < 2:
-        return False
+def is_faq_category(category):
+    """V3 策略: 严格过滤，只保留明确的业务分类"""
+    return category in CATEGORIES and category not in ["非问题", "其他问题", "其他"]
+
+# 日志写入语句 (PostgreSQL 写法，由 faq_db 转换方言): 成功时 Upsert，失败时不覆盖已有记录
+# trace_id 按通话与发言时间固定，换一种方式重跑 (规则 / 去重 / 本地模型 / LLM) 时 prompt_id 与输入记录一并更新
+_LOG_INSERT = """
+    INSERT INTO log_prompt_execution 
+    (id, prompt_id, call_id, input_variables, raw_output, 
+     execution_time_ms, status, error_message, is_dry_run, created_at,
+     prompt_tokens, completion_tokens, cached_tokens)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+"""
+LOG_UPSERT_SQL = _LOG_INSERT + """
+    ON CONFLICT (id) DO UPDATE SET
+        prompt_id = EXCLUDED.prompt_id,
+        input_variables = EXCLUDED.input_variables,
+        raw_output = EXCLUDED.raw_output,
+        execution_time_ms = EXCLUDED.execution_time_ms,
+        status = EXCLUDED.status,
+        prompt_tokens = EXCLUDED.prompt_tokens,
+        completion_tokens = EXCLUDED.completion_tokens,
+        cached_tokens = EXCLUDED.cached_tokens
+"""
+LOG_INSERT_SQL = _LOG_INSERT + "    ON CONFLICT (id) DO NOTHING\n"
+
+def prompt_record(ctx, transcript_id, span, targets, prompt, batch=False, error=False, stage=None):
+    """
+    日志 input_variables 的紧凑记录: Prompt 版本 + 目标发言 + 上下文区间 (见 faq_log_format)
+    错误调用与按 full_prompt_rate 抽样的成功调用附带完整 user 消息
+    stage: 上下文升级模式的阶段 (1 = 短上下文，2 = 升级后的完整上下文)
+    """
+    full = error or random.random() < ctx.full_prompt_rate
+    return encode_input(transcript_id, span, targets, batch,
+                        prompt if full else None, ctx.log_compression, drop_filler=True, stage=stage,
+                        fast=ctx.fast and not batch)
+
+def log_execution(ctx, trace_id, call_id, input_variables, raw_output,
+                  execution_time, status, error_message="", usage=None, prompt_id="faq_v3_ci"):
+    """
+    记录 LLM 调用日志 (成功时 Upsert，失败时不覆盖已有的成功记录)
+    LLM 调用的 input_variables 为 prompt_record 生成的紧凑记录，固定的 system 消息由 PROMPT_VERSION 标识
+    写入由后台线程批量完成，这里只入队
+    """
+    sql = LOG_UPSERT_SQL if status == "success" else LOG_INSERT_SQL
+    # call_id 可能是 None/NULL (未匹配到 biz_calls)
+    ctx.writer.submit(sql, (
+        trace_id, prompt_id, call_id, input_variables, raw_output,
+        execution_time, status, error_message, 0, ctx.db.now()
+    ) + usage_values(usage))
+
+class AnalysisContext:
+    """一次分析运行共享的状态: LLM 客户端、并发/限流控制、缓存与数据库访问层"""
     
-    clean_text = re.sub(r'[。，！？、\.,;!?\s]', '', text).strip()
-    if len(clean_text) < 2:
+    def __init__(self, client, db, conn, cur, concurrency=8, limiter=None,
+                 cache=None, batch_size=1, usage=None, preclassifier=None, dedup=None, writer=None,
+                 full_prompt_rate=0.01, log_compression=None, work_queue=None,
+                 context_tokens=CONTEXT_TOKEN_BUDGET, prompt_sizes=None, escalate_threshold=None,
+                 escalation=None, local_model=None, call_profile="standard", stream=False,
+                 stream_stats=None, parse_stats=None, hedger=None, budget=None):
+        self.client = client
+        self.db = db
+        self.conn = conn
+        self.cur = cur
+        self.db_type = db.db_type
+        self.concurrency = max(1, concurrency)
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+        self.limiter = limiter or AdaptiveRateLimiter()
+        self.cache = cache
+        self.batch_size = max(1, batch_size)
+        self.usage = usage or UsageTracker()
+        self.preclassifier = preclassifier
+        self.dedup = dedup
+        self.writer = writer
+        self.full_prompt_rate = full_prompt_rate
+        self.log_compression = log_compression
+        self.work_queue = work_queue
+        self.context_tokens = context_tokens
+        self.prompt_sizes = prompt_sizes or PromptSizeHistogram()
+        # 上下文升级模式: 第一阶段 confidence 低于阈值时带完整上下文重问 (None = 关闭)
+        self.escalate_threshold = escalate_threshold
+        self.escalation = escalation if escalation is not None else new_escalation_stats()
+        self.local_model = local_model
+        # 单句请求的调用配置: fast 只输出 category、限制 max_tokens 并请求 JSON 模式 (接口拒绝时本次运行内关闭)
+        self.fast = call_profile == "fast"
+        self.json_mode = self.fast
+        self.stream = stream
+        self.stream_stats = stream_stats if stream_stats is not None else new_stream_stats()
+        self.parse_stats = parse_stats or ParseStats(PROMPT_VERSION)
+        # 对冲请求 (None = 关闭): 超过滚动 p95 耗时仍未返回时发出相同请求，先返回有效结果的一方胜出
+        self.hedger = hedger
+        # 运行预算与熔断 (默认不限制)
+        self.budget = budget or RunBudget()
+        self.resumed = 0
+
+def new_stream_stats():
+    return {"streamed": 0, "stopped_early": 0}
+
+def call_params(ctx, batch=False, confidence=False):
+    """
+    请求参数 (参与缓存 Key 计算)
+    fast 配置的单句请求限制 max_tokens 并请求 JSON 模式；批量请求输出数组，不适用 JSON 模式，保持原参数
+    """
+    if batch or not ctx.fast:
+        return dict(LLM_PARAMS)
+    params = dict(LLM_PARAMS, max_tokens=FAST_CONFIDENCE_MAX_TOKENS if confidence else FAST_MAX_TOKENS)
+    if ctx.json_mode:
+        params["response_format"] = {"type": "json_object"}
+    return params
+
+async def read_stream(stream, stats=None):
+    """
+    流式读取回复，解析出闭集内的 category 后立即断开 (不再等待其余输出)
+    返回与非流式响应相同结构的对象；提前断开时没有 usage，raw_output 只保留 category
+    """
+    text = ""
+    usage = None
+    stopped = False
+    async for chunk in stream:
+        usage = getattr(chunk, "usage", None) or usage
+        if not chunk.choices:
+            continue
+        text += chunk.choices[0].delta.content or ""
+        match = STREAM_CATEGORY_PATTERN.search(text)
+        category = match_category(match.group(1))[0] if match else None
+        if category is not None:
+            text = json.dumps({"category": category}, ensure_ascii=False)
+            stopped = True
+            break
+    close = getattr(stream, "close", None)
+    if close:
+        await close()
+    if stats is not None:
+        stats["streamed"] += 1
+        stats["stopped_early"] += stopped
+    return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=text))],
+                           usage=None if stopped else usage)
+
+async def request_completion(client, messages, params, stream=False, stats=None):
+    """发送一次请求 (stream=True 时流式读取并在得到 category 后提前结束)"""
+    if not stream:
+        return await client.chat.completions.create(model=LLM_MODEL, messages=messages, timeout=30, **params)
+    response = await client.chat.completions.create(model=LLM_MODEL, messages=messages, timeout=30,
+                                                    stream=True, **params)
+    return await read_stream(response, stats)
+
+def is_valid_response(response, expect=dict):
+    """对冲请求的胜出条件: 回复中有可解析的 JSON 对象 (批量为数组)"""
+    try:
+        extract_json(response.choices[0].message.content, expect)
+        return True
+    except OutputParseError:
         return False
-    
-    STOPWORDS = {
-        "喂", "喂喂", "哎", "你好", "嗯", "嗯嗯", "嗯啊",
-        "好", "好的", "好吧", "对", "对对", "对的", "行", "行的",
-        "啊", "哦", "噢", "呃", "额", "诶",
-        "是", "是的", "可以", "没问题",
-        "谢谢", "谢谢你", "再见", "拜拜", "不用了", "不需要",
-        "知道了", "明白", "了解", "收到"
+
+async def classify_utterance(ctx, messages, params=None, stream=False, expect=dict):
+    """
+    调用 LLM，semaphore 控制全局并发上限，limiter 负责限流与重试
+    对冲只作用于 limiter 取得额度之后的单次 API 请求 (排队与重试退避不计入对冲延迟)；
+    对冲请求另行取得限流额度，但不占用 semaphore (数量由对冲预算限制)
+    每次实际发出请求前 (含限流器重试与对冲请求) 检查并计入运行预算，预算用尽或已熔断时抛出 BudgetExhausted
+    """
+    params = dict(LLM_PARAMS) if params is None else params
+    tokens = sum(estimate_tokens(m["content"]) for m in messages)
+
+    def request():
+        return request_completion(ctx.client, messages, params, stream, ctx.stream_stats)
+
+    async def hedge_request():
+        ctx.budget.start_call()
+        await ctx.limiter.acquire_async(tokens)
+        return await request()
+
+    async def attempt():
+        try:
+            if ctx.hedger:
+                return await ctx.hedger.run(request, lambda r: is_valid_response(r, expect), hedge_request)
+            return await request()
+        finally:
+            report_progress(ctx)
+
+    try:
+        async with ctx.semaphore:
+            start_time = time.time()
+            # 预算检查在获取限流额度之前: 预算用尽的尝试不占用额度、不计入请求次数
+            response = await ctx.limiter.call_async(attempt, tokens=tokens, before=ctx.budget.start_call)
+            raw_output = response.choices[0].message.content.strip()
+            execution_time = int((time.time() - start_time) * 1000)
+    except BudgetExhausted:
+        raise
+    except Exception as e:
+        # 接口不支持 JSON 模式 (400) 时本次运行内关闭，改用 system 消息约束输出格式
+        if "response_format" not in params or getattr(e, "status_code", None) != 400:
+            ctx.budget.record_failure()
+            raise
+        if ctx.json_mode:
+            ctx.json_mode = False
+            print(f"⚠️ 接口不支持 JSON 模式，本次运行改为普通输出: {e}")
+        params = {k: v for k, v in params.items() if k != "response_format"}
+        return await classify_utterance(ctx, messages, params, stream, expect)
+    usage = extract_usage(response)
+    ctx.usage.add(usage)
+    ctx.budget.record_success(usage, tokens)
+    return raw_output, execution_time, usage
+
+async def cache_lookup(ctx, cache_key):
+    """在线程中用连接池的连接查询缓存 (PostgreSQL 往返不阻塞事件循环)"""
+    def fetch():
+        with ctx.db.connection() as conn:
+            return ctx.cache.fetch(cache_key, conn)
+    raw_output = await asyncio.to_thread(fetch)
+    ctx.cache.record(cache_key, raw_output)
+    return raw_output
+
+async def cached_completion(ctx, prompt, batch=False, confidence=False):
+    """
+    先查缓存 (相同 model + messages + 参数的结果可直接复用)，未命中再调用 LLM
+    返回 {"raw_output", "execution_time", "usage", "messages", "cache_key", "from_cache"}
+    """
+    ctx.prompt_sizes.add(estimate_tokens(prompt))
+    messages = build_messages(prompt, batch, confidence, fast=ctx.fast)
+    params = call_params(ctx, batch, confidence)
+    cache_key = ctx.cache.make_key(LLM_MODEL, messages, params) if ctx.cache else None
+    raw_output = await cache_lookup(ctx, cache_key) if ctx.cache else None
+    if raw_output is not None:
+        return {"raw_output": raw_output, "execution_time": 0, "usage": None, "messages": messages,
+                "cache_key": cache_key, "from_cache": True}
+    # 流式提前结束只用于只输出 category 的请求 (升级第一阶段还需要 confidence，批量需要完整数组)
+    stream = ctx.stream and not batch and not confidence
+    raw_output, execution_time, usage = await classify_utterance(ctx, messages, params, stream,
+                                                                 list if batch else dict)
+    return {"raw_output": raw_output, "execution_time": execution_time, "usage": usage, "messages": messages,
+            "cache_key": cache_key, "from_cache": False}
+
+def prompt_variant(ctx, batch=False, confidence=False):
+    """解析统计的请求类型 (system 消息不同的请求分开统计)"""
+    if batch:
+        return "batch"
+    return ("confidence" if confidence else "single") + (":fast" if ctx.fast else "")
+
+async def classified_completion(ctx, prompt, confidence=False):
+    """
+    调用 (或读缓存) 并解析单句分类输出，返回 completion (附加 "category" 与 "confidence")
+    回复经修复仍无法解析时做一次格式修复重试: 在原对话后追加该回复与格式要求 (前缀与原请求一致，
+    可命中前缀缓存)，限制 max_tokens；仍无法解析时抛出 OutputParseError
+    """
+    completion = await cached_completion(ctx, prompt, confidence=confidence)
+    variant = prompt_variant(ctx, confidence=confidence)
+    try:
+        category, confidence_value, repaired = parse_classification(completion["raw_output"])
+        if not completion["from_cache"]:
+            ctx.parse_stats.add(variant, "repaired" if repaired else "clean")
+    except OutputParseError:
+        ctx.parse_stats.add(variant, "unparsed")
+        messages = completion["messages"] + [
+            {"role": "assistant", "content": completion["raw_output"] or "(空)"},
+            {"role": "user", "content": build_repair_prompt(confidence)},
+        ]
+        params = dict(LLM_PARAMS, max_tokens=FAST_CONFIDENCE_MAX_TOKENS if confidence else FAST_MAX_TOKENS)
+        raw_output, execution_time, usage = await classify_utterance(ctx, messages, params)
+        try:
+            category, confidence_value, _ = parse_classification(raw_output)
+        except OutputParseError:
+            ctx.parse_stats.add(variant, "failed")
+            raise
+        ctx.parse_stats.add(variant, "recovered")
+        completion = dict(completion, raw_output=raw_output, usage=merge_usage(completion["usage"], usage),
+                          execution_time=completion["execution_time"] + execution_time)
+    completion["category"] = category
+    completion["confidence"] = confidence_value
+    return completion
+
+def remember(ctx, completion):
+    """只缓存可解析的结果，格式错误的输出下次重新调用"""
+    if ctx.cache and not completion["from_cache"]:
+        ctx.cache.put(completion["cache_key"], LLM_MODEL, completion["raw_output"], ctx.writer)
+
+def question_entry(text, timestamp, category):
+    """命中业务分类时生成问题条目，否则返回 None"""
+    if not is_faq_category(category):
+        return None
+    return {
+        "timestamp": timestamp,
+        "question": text,
+        "category": category,
+        "time_display": format_timestamp(timestamp)
     }
-    if clean_text in STOPWORDS:
-        return False
-        
-    digit_count = sum(1 for c in text if c.isdigit() or c in "零一二三四五六七八九幺")
-    if len(text) > 0 and (digit_count / len(text)) > 0.5:
-        return False
-        
-    return True
 
-def analyze_transcript(client, conn, cur, transcript_id, deal_id, call_id, content, db_type='postgres'):
-    """分析单个通话记录"""
-    extracted_questions = []
-    placeholder = '%s' if db_type == 'postgres' else '?'
+def report_progress(ctx):
+    """向工作队列报告分析进展 (长时间没有进展时心跳停止续期)"""
+    if ctx.work_queue:
+        ctx.work_queue.progress()
+
+def checkpoint_result(ctx, transcript_id, candidate, category):
+    """记录发言级断点 (中断后重跑不再分类该发言)，命中业务分类时返回问题条目"""
+    report_progress(ctx)
+    save_checkpoint(ctx.writer, transcript_id, PROMPT_VERSION, candidate["timestamp"], category)
+    return question_entry(candidate["text"], candidate["timestamp"], category)
+
+def checkpoint_failure(ctx, transcript_id, candidate):
+    """记录分类失败；未达到失败上限的发言在下次运行时重试"""
+    report_progress(ctx)
+    candidate["failed"] = True
+    candidate["failures"] = candidate.get("failures", 0) + 1
+    record_failure(ctx.writer, transcript_id, PROMPT_VERSION, candidate["timestamp"])
+
+def defer_candidate(candidate, trace_id):
+    """预算用尽或熔断: 发言留到下次运行 (不计入失败次数、不记录错误日志)"""
+    candidate["failed"] = True
+    candidate.setdefault("failures", 0)
+    settle_duplicates(candidate, None, trace_id)
+
+async def classify_short_context(ctx, transcript_id, call_id, lines, candidate, trace_id):
+    """
+    上下文升级模式第一阶段: 只带最近几句上下文，并要求模型给出 confidence
+    把握足够时直接采用 (日志记在 trace_id 上)，返回分类；
+    把握不足或输出无法解析时返回 None，第一阶段的结果记在 trace_id + "_s1" 上便于审计
+    """
+    text = candidate["text"]
+    span = short_span(candidate)
+    prompt = build_user_prompt(render_context(lines, *span), text)
+    ctx.escalation["short"] += 1
     
-    # 解析 content (可能是 JSON 字符串或已解析的对象)
     try:
-        if isinstance(content, str):
-            transcript_items = json.loads(content)
+        completion = await classified_completion(ctx, prompt, confidence=True)
+        category = completion["category"]
+        # confidence 缺失或无法识别时视为 0 (即需要升级)
+        confidence = completion["confidence"] or 0.0
+        remember(ctx, completion)
+    except BudgetExhausted:
+        raise
+    except Exception as e:
+        ctx.escalation["escalated"] += 1
+        record = prompt_record(ctx, transcript_id, span, text, prompt, error=True, stage=1)
+        log_execution(ctx, f"{trace_id}_s1", call_id, record, getattr(e, "raw_output", ""), 0, "error", str(e))
+        return None
+    
+    accepted = confidence >= ctx.escalate_threshold
+    record = prompt_record(ctx, transcript_id, span, text, prompt, stage=1)
+    log_execution(ctx, trace_id if accepted else f"{trace_id}_s1", call_id, record, completion["raw_output"],
+                  completion["execution_time"], "success", usage=completion["usage"])
+    if not accepted:
+        ctx.escalation["escalated"] += 1
+        return None
+    ctx.escalation["accepted"] += 1
+    return category
+
+def new_escalation_stats():
+    return {"short": 0, "accepted": 0, "escalated": 0, "referential": 0}
+
+def escalation_summary(stats):
+    if not stats["short"] and not stats["referential"]:
+        return "无"
+    rate = stats["accepted"] / stats["short"] if stats["short"] else 0
+    # 指代前文的比例过高时短上下文阶段形同虚设，需要检查 looks_referential 的规则
+    referential_rate = stats["referential"] / (stats["short"] + stats["referential"])
+    return (f"短上下文 {stats['short']} 次 (直接采用 {stats['accepted']}，{rate:.0%}) | "
+            f"升级 {stats['escalated']} 次 | 指代前文直接用完整上下文 {stats['referential']} 次 ({referential_rate:.0%})")
+
+async def analyze_utterance(ctx, transcript_id, call_id, lines, candidate):
+    """
+    分类单句客户发言并记录日志，命中业务分类时返回问题条目
+    上下文升级模式下先用短上下文分类，把握不足或发言指代前文时才带完整上下文
+    """
+    text, timestamp = candidate["text"], candidate["timestamp"]
+    trace_id = f"faq_trace_{transcript_id}_{timestamp}"
+    
+    stage = None
+    if ctx.escalate_threshold is not None:
+        if looks_referential(text):
+            ctx.escalation["referential"] += 1
         else:
-            transcript_items = content
-    except:
-        return []
+            try:
+                category = await classify_short_context(ctx, transcript_id, call_id, lines, candidate, trace_id)
+            except BudgetExhausted:
+                defer_candidate(candidate, trace_id)
+                return None
+            if category is not None:
+                settle_duplicates(candidate, category, trace_id)
+                return checkpoint_result(ctx, transcript_id, candidate, category)
+        stage = 2
     
-    context_buffer = []
+    prompt = candidate_prompt(lines, candidate)
+    span = candidate_span(candidate)
     
-    for item in transcript_items:
-        speaker = item.get("SpeakerId", "")
-        text = item.get("Text", "").strip()
-        timestamp = item.get("BeginTime", 0)
+    try:
+        completion = await classified_completion(ctx, prompt)
+        category = completion["category"]
         
-        if not text:
-            continue
-            
-        context_buffer.append({"speaker": speaker, "text": text})
-        if len(context_buffer) > CONTEXT_WINDOW:
-            context_buffer.pop(0)
+        # 统一使用 Upsert 逻辑记录日志
+        record = prompt_record(ctx, transcript_id, span, text, prompt, stage=stage)
+        log_execution(ctx, trace_id, call_id, record, completion["raw_output"],
+                      completion["execution_time"], "success", usage=completion["usage"])
+        print(f"    📝 已记录日志{' (缓存)' if completion['from_cache'] else ''}: {trace_id[:50]}...")
         
-        if speaker == "2" and len(text) >= 4 and is_valid_safety_check(text):
-            # 构建 Prompt
-            history_str = "\n".join([
-                f"{'销售' if c['speaker'] == '1' else '客户'}: {c['text']}"
-                for c in context_buffer[:-1]
+        remember(ctx, completion)
+        settle_duplicates(candidate, category, trace_id)
+        return checkpoint_result(ctx, transcript_id, candidate, category)
+    except BudgetExhausted:
+        defer_candidate(candidate, trace_id)
+    except Exception as e:
+        # 记录错误
+        checkpoint_failure(ctx, transcript_id, candidate)
+        settle_duplicates(candidate, None, trace_id)
+        # 无法解析的回复原样记录，便于排查
+        record = prompt_record(ctx, transcript_id, span, text, prompt, error=True, stage=stage)
+        log_execution(ctx, trace_id, call_id, record, getattr(e, "raw_output", ""),
+                      0, "error", str(e))
+    
+    return None
+
+async def analyze_batch(ctx, transcript_id, call_id, lines, group):
+    """
+    批量模式: 同一通话中连续 K 句客户发言共用一段上下文，一次请求分类
+    数组解析失败或缺少某句结果时，回退到逐句调用
+    """
+    prompt = batch_prompt(lines, group)
+    
+    try:
+        completion = await cached_completion(ctx, prompt, batch=True)
+        categories, repaired = parse_batch_output(completion["raw_output"], len(group))
+        if not completion["from_cache"]:
+            ctx.parse_stats.add("batch", "repaired" if repaired else "clean")
+        remember(ctx, completion)
+    except BudgetExhausted:
+        # 预算用尽或熔断: 不回退逐句调用，整组留到下次运行
+        for c in group:
+            defer_candidate(c, f"faq_trace_{transcript_id}_{c['timestamp']}")
+        return [None] * len(group)
+    except Exception as e:
+        if isinstance(e, OutputParseError):
+            ctx.parse_stats.add("batch", "unparsed")
+        print(f"    ⚠️ 批量结果解析失败，回退逐句调用: {e}")
+        categories = {}
+    
+    results = []
+    fallback = []
+    usages = split_usage(completion["usage"], len(categories)) if categories else []
+    span = batch_span(group)
+    targets = [c["text"] for c in group]
+    for i, c in enumerate(group):
+        if i not in categories:
+            fallback.append(c)
+            continue
+        # 每句仍单独记录日志 (trace_id 不变)，raw_output 只保留该句的分类结果
+        trace_id = f"faq_trace_{transcript_id}_{c['timestamp']}"
+        item_output = json.dumps({"index": i, "category": categories[i]}, ensure_ascii=False)
+        record = prompt_record(ctx, transcript_id, span, targets, prompt, batch=True)
+        log_execution(ctx, trace_id, call_id, record, item_output,
+                      completion["execution_time"], "success", usage=usages.pop(0))
+        settle_duplicates(c, categories[i], trace_id)
+        results.append(checkpoint_result(ctx, transcript_id, c, categories[i]))
+    
+    if fallback:
+        results += await asyncio.gather(*[
+            analyze_utterance(ctx, transcript_id, call_id, lines, c)
+            for c in fallback
+        ])
+        # 回退结果追加在末尾，按时间戳恢复原对话顺序
+        results.sort(key=lambda q: q["timestamp"] if q else 0)
+    
+    return results
+
+def apply_rules(ctx, transcript_id, call_id, candidates):
+    """
+    规则预分类: 高置信度的发言直接判定并记录日志 (prompt_id = faq_v3_rules)
+    返回 (规则命中的问题条目, 需要交给 LLM 的发言)
+    """
+    if not ctx.preclassifier:
+        return [], candidates
+    
+    decided = []
+    remaining = []
+    for c in candidates:
+        category = ctx.preclassifier.decide(c["text"])
+        if category is None:
+            remaining.append(c)
+            continue
+        trace_id = f"faq_trace_{transcript_id}_{c['timestamp']}"
+        raw_output = json.dumps({"category": category, "reason": "规则匹配"}, ensure_ascii=False)
+        log_execution(ctx, trace_id, call_id, c["text"], raw_output,
+                      0, "success", prompt_id=RULES_PROMPT_ID)
+        decided.append(question_entry(c["text"], c["timestamp"], category))
+    return decided, remaining
+
+def apply_local_model(ctx, transcript_id, call_id, candidates):
+    """
+    本地模型判定: 概率达到阈值的发言直接采用本地分类并记录日志 (prompt_id = faq_v3_local)
+    指代前文的发言只看文本无法判断，始终交给 LLM
+    返回 (本地模型判定的问题条目, 需要交给 LLM 的发言)
+    """
+    if not ctx.local_model:
+        return [], candidates
+    
+    decided = []
+    remaining = []
+    for c in candidates:
+        if looks_referential(c["text"]):
+            remaining.append(c)
+            continue
+        category, probability = ctx.local_model.decide(c["text"])
+        if category is None:
+            remaining.append(c)
+            continue
+        trace_id = f"faq_trace_{transcript_id}_{c['timestamp']}"
+        raw_output = json.dumps({"category": category, "confidence": round(probability, 4),
+                                 "model": ctx.local_model.version}, ensure_ascii=False)
+        log_execution(ctx, trace_id, call_id, c["text"], raw_output,
+                      0, "success", prompt_id=LOCAL_MODEL_PROMPT_ID)
+        decided.append(question_entry(c["text"], c["timestamp"], category))
+    return decided, remaining
+
+def claim_duplicates(ctx, lines, candidates):
+    """
+    近似重复去重: 在全局索引中查找同组代表发言
+    新发言登记为代表 (附带一个分类结果 Future)，已有代表的发言作为成员等待复用结果
+    返回 (成员 [(candidate, future)], 需要分类的代表发言)
+    """
+    if not ctx.dedup:
+        return [], candidates
+    
+    members = []
+    representatives = []
+    for c in candidates:
+        previous_line = lines[c["index"] - 1] if c["index"] > 0 else ""
+        context_sig = context_signature(c["text"], previous_line)
+        future, key = ctx.dedup.lookup(c["text"], context_sig)
+        if future is not None:
+            members.append((c, future))
+            continue
+        c["dedup_future"] = asyncio.get_running_loop().create_future()
+        ctx.dedup.add(key, c["dedup_future"], context_sig)
+        representatives.append(c)
+    return members, representatives
+
+def settle_duplicates(candidate, category, trace_id):
+    """代表发言分类完成后通知同组成员 (category 为 None 表示失败，成员各自调用 LLM)"""
+    future = candidate.get("dedup_future")
+    if future is not None and not future.done():
+        future.set_result((category, trace_id) if category else None)
+
+async def analyze_duplicate(ctx, transcript_id, call_id, lines, candidate, future):
+    """成员发言: 等待代表发言的分类结果并复用；代表失败时回退为自行调用 LLM"""
+    result = await future
+    if result is None:
+        return await analyze_utterance(ctx, transcript_id, call_id, lines, candidate)
+    
+    category, source_trace_id = result
+    trace_id = f"faq_trace_{transcript_id}_{candidate['timestamp']}"
+    raw_output = json.dumps({"category": category, "reason": f"近似重复: {source_trace_id}"}, ensure_ascii=False)
+    log_execution(ctx, trace_id, call_id, candidate["text"], raw_output,
+                  0, "success", prompt_id=DEDUP_PROMPT_ID)
+    return checkpoint_result(ctx, transcript_id, candidate, category)
+
+async def classify_candidates(ctx, transcript_id, call_id, lines, candidates):
+    """用 LLM 分类代表发言 (批量或逐句)，返回问题条目列表"""
+    try:
+        if ctx.batch_size > 1:
+            groups = [candidates[i:i + ctx.batch_size] for i in range(0, len(candidates), ctx.batch_size)]
+            batches = await asyncio.gather(*[
+                analyze_batch(ctx, transcript_id, call_id, lines, group) for group in groups
             ])
+            return [q for batch in batches for q in batch]
+        return await asyncio.gather(*[
+            analyze_utterance(ctx, transcript_id, call_id, lines, c)
+            for c in candidates
+        ])
+    finally:
+        # 保证等待中的成员不会因异常而永久挂起
+        for c in candidates:
+            settle_duplicates(c, None, None)
+
+def resume_candidates(ctx, checkpoint, candidates):
+    """
+    按发言级断点跳过上次运行已分类的发言 (直接使用记录的分类结果，不再调用 LLM 或写日志)
+    失败次数达到上限的发言不再重试，计为失败；其余发言继续分类
+    返回 (已有结果的问题条目, 需要继续分类的发言)
+    """
+    if not checkpoint:
+        return [], candidates
+    
+    restored = []
+    remaining = []
+    for c in candidates:
+        category, failures = checkpoint.get(c["timestamp"], (None, 0))
+        if category is not None:
+            restored.append(question_entry(c["text"], c["timestamp"], category))
+        elif failures >= MAX_UTTERANCE_FAILURES:
+            c["failed"] = True
+            c["failures"] = failures
+        else:
+            c["failures"] = failures
+            remaining.append(c)
+    ctx.resumed += len(candidates) - len(remaining)
+    return restored, remaining
+
+async def analyze_transcript(ctx, transcript_id, deal_id, call_id, content, checkpoint=None):
+    """
+    分析单个通话记录 (同一通话内的客户发言并发分类，结果保持原对话顺序)
+    checkpoint: 上次中断时记录的发言级断点 {timestamp: (category, failures)}
+    返回 (问题列表, 处理状态): 有发言分类失败但未达到失败上限时为 incomplete (下次运行继续)，
+    失败发言均已达到上限时为 partial
+    """
+    transcript_items = parse_transcript(content)
+    if transcript_items is None:
+        return [], "invalid"
+    
+    lines, candidates = iter_candidates(transcript_items, ctx.context_tokens)
+    all_candidates = candidates
+    restored, candidates = resume_candidates(ctx, checkpoint, candidates)
+    decided, candidates = apply_rules(ctx, transcript_id, call_id, candidates)
+    predicted, candidates = apply_local_model(ctx, transcript_id, call_id, candidates)
+    members, candidates = claim_duplicates(ctx, lines, candidates)
+    
+    classified, *duplicates = await asyncio.gather(
+        classify_candidates(ctx, transcript_id, call_id, lines, candidates),
+        *[analyze_duplicate(ctx, transcript_id, call_id, lines, c, future) for c, future in members]
+    )
+    
+    # 合并断点结果、规则判定、本地模型判定、LLM 结果与去重复用结果，按时间戳恢复原对话顺序
+    results = [q for q in restored + decided + predicted + list(classified) + duplicates if q]
+    results.sort(key=lambda q: q["timestamp"])
+    failed = [c for c in all_candidates if c.get("failed")]
+    if any(c["failures"] < MAX_UTTERANCE_FAILURES for c in failed):
+        return results, "incomplete"
+    return results, "partial" if failed else "success"
+
+QUESTION_UPSERT_SQL = """
+    INSERT INTO biz_faq_questions 
+    (id, deal_id, transcript_id, call_id, "timestamp", question, category, created_at)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+    ON CONFLICT (id) DO UPDATE SET
+        question = EXCLUDED.question,
+        category = EXCLUDED.category
+"""
+
+def save_questions(writer, tid, deal_id, call_id, questions):
+    """写入提取到的 FAQ 问题 (幂等 Upsert，经后台线程批量写入)"""
+    for q in questions:
+        writer.submit(QUESTION_UPSERT_SQL, (
+            f"faq_v3_{tid}_{q['timestamp']}", deal_id, tid, call_id,
+            q['timestamp'], q['question'], q['category'], writer.db.now()
+        ), tid)
+    return len(questions)
+
+def row_fields(row):
+    """读取 ID 查询结果行: (tid, deal_id, call_id)"""
+    return row['id'], row['deal_id'], row['call_id']
+
+class TranscriptLoader:
+    """
+    按需分块加载通话内容 (content 是整段 JSON，体积远大于其他字段)
+    首次取某个 ID 时连同其后的 chunk_size 个 ID 一次查询，取出后即释放，
+    内存中只保留正在分析和下一块待分析的内容，与 --limit 大小无关
+    同一块通话的发言级断点随内容一起查询
+    """
+
+    def __init__(self, db, cursor, ids, chunk_size=100):
+        self.db = db
+        self.cursor = cursor
+        self.ids = ids
+        self.chunk_size = max(1, chunk_size)
+        self.position = {tid: i for i, tid in enumerate(ids)}
+        self.loaded = {}
+        self.checkpoints = {}
+        self.next_index = 0
+        self.queries = 0
+
+    def pop(self, tid):
+        """返回通话内容 (记录已被删除时返回 None)"""
+        while tid not in self.loaded and self.next_index <= self.position[tid]:
+            self._load_next_chunk()
+        return self.loaded.pop(tid, None)
+
+    def pop_checkpoint(self, tid):
+        """返回通话的发言级断点 (需先 pop 内容)，没有时返回 None"""
+        return self.checkpoints.pop(tid, None)
+
+    def _load_next_chunk(self):
+        chunk = self.ids[self.next_index:self.next_index + self.chunk_size]
+        self.next_index += len(chunk)
+        placeholders = ", ".join(["%s"] * len(chunk))
+        self.db.execute(self.cursor, f"SELECT id, content FROM sync_transcripts WHERE id IN ({placeholders})", chunk)
+        self.queries += 1
+        for row in self.cursor.fetchall():
+            self.loaded[row['id']] = row['content']
+        self.checkpoints.update(load_checkpoints(self.db, self.cursor, chunk, PROMPT_VERSION))
+
+async def analyze_rows(ctx, rows, itersize=100):
+    """
+    分析一批待处理通话: 多个通话同时分析，所有 LLM 调用共享一个并发上限和限流器
+    rows 只包含 (id, deal_id, call_id)，通话内容由 TranscriptLoader 每 itersize 条分块加载
+    读查询使用 ctx.conn (从连接池借出)，写入经 ctx.writer 的后台线程 (另借一个池连接)
+    """
+    loader = TranscriptLoader(ctx.db, ctx.cur, [row_fields(row)[0] for row in rows], itersize)
+    # 同时在分析中的通话数不超过一个分块，先创建的任务先拿到名额，内容按顺序分块加载
+    # 设置了运行预算时不超过并发上限的 2 倍，准入检查在通话真正开始分析前进行
+    window_size = min(loader.chunk_size, 2 * ctx.concurrency) if ctx.budget.limited else loader.chunk_size
+    window = asyncio.Semaphore(window_size)
+    
+    async def process_row(row):
+        async with window:
+            return await analyze_row(row)
+    
+    async def analyze_row(row):
+        tid, deal_id, call_id = row_fields(row)
+        if not ctx.budget.admit():
+            # 预算放不下: 不领取内容、不写水位，工作队列的租约在退出时释放
+            return 0
+        try:
+            return await handle_transcript(tid, deal_id, call_id)
+        finally:
+            # 该通话的写入到此为止: 若其中有行写入失败，水位等后续写入已被写入线程放弃
+            ctx.writer.end_group(tid)
+    
+    async def handle_transcript(tid, deal_id, call_id):
+        report_progress(ctx)
+        content = loader.pop(tid)
+        checkpoint = loader.pop_checkpoint(tid)
+        if content is None:
+            print(f"  ⚠️ Transcript {tid[:20]}... 内容已不存在，跳过")
+            if ctx.work_queue:
+                ctx.work_queue.complete(ctx.writer, tid)
+            return 0
+        with ctx.budget.transcript():
+            questions, status = await analyze_transcript(ctx, tid, deal_id, call_id, content, checkpoint)
+        ctx.budget.finish(status)
+        print(f"  📞 Transcript {tid[:20]}...: 提取 {len(questions)} 个问题")
+        saved = save_questions(ctx.writer, tid, deal_id, call_id, questions)
+        if status == "incomplete":
+            # 不写水位: 下次运行按断点只重试失败的发言
+            print(f"  ⏸️ Transcript {tid[:20]}... 有发言分类失败，下次运行继续")
+            if ctx.work_queue:
+                ctx.work_queue.retry(ctx.writer, tid)
+            return saved
+        # 水位最后写入: 写入线程按提交顺序落库，崩溃时不会出现"已处理但日志缺失"
+        mark_processed(ctx.writer, tid, PROMPT_VERSION, content_hash(content), status)
+        clear_checkpoints(ctx.writer, tid, PROMPT_VERSION)
+        if ctx.work_queue:
+            ctx.work_queue.complete(ctx.writer, tid)
+        return saved
+    
+    total_new = 0
+    tasks = [asyncio.ensure_future(process_row(row)) for row in rows]
+    for task in tqdm(asyncio.as_completed(tasks), total=len(tasks), desc="分析中", ncols=80):
+        total_new += await task
+    
+    print(f"📥 内容加载: {len(rows)} 条通话，分 {loader.queries} 次查询")
+    if ctx.resumed:
+        print(f"⏩ 断点续传: 累计跳过 {ctx.resumed} 句已处理的发言")
+    return total_new
+
+async def run_analysis(build_context, rows, itersize=100):
+    """单次运行: 分析 rows 后关闭 LLM 客户端"""
+    ctx = build_context()
+    try:
+        return await analyze_rows(ctx, rows, itersize)
+    finally:
+        await ctx.client.close()
+
+async def run_daemon(build_context, fetch, watcher, args):
+    """
+    常驻模式: 客户端、连接池、缓存与去重索引保持常驻，持续处理小批量新通话
+    先处理完积压 (每轮 --limit 条)，之后只查询 created_at 不早于上一轮水位的通话，
+    每 --full-scan-every 轮做一次不带水位的全量检查 (兜底 created_at 被回填的记录)
+    SIGTERM / SIGINT 时处理完当前批次后退出
+    """
+    ctx = build_context()
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop.set)
+    watcher.start()
+    
+    since = None
+    last_mark = None
+    polls = 0
+    total_new = 0
+    try:
+        while not stop.is_set() and not ctx.budget.check():
+            mark = watcher.latest()
+            if polls == 0 or mark != last_mark:
+                # 有新通话落库时才增量补齐关联表
+                update_linkage(ctx.conn, ctx.db_type)
+            last_mark = mark
+            full_scan = since is None or (args.full_scan_every and polls % args.full_scan_every == 0)
+            rows = fetch(None if full_scan else since)
+            # 结束读事务，避免 PostgreSQL 连接长时间 idle in transaction
+            ctx.conn.commit()
+            polls += 1
             
-            prompt = f"""你是一个客服对话分类助手。你的任务是判断客户发言是否为提问，并从以下分类中选择一个。
-
-## 可选分类（必须从中选择）：
-1. 价格咨询 - 询问费用、报价、价格、多少钱、贵不贵
-2. 服务范围 - 询问能否处理某类问题、是否提供某项服务、能不能做
-3. 上门时间 - 询问什么时候能来、多久到、预约时间、今天/明天可以吗
-4. 质保期 - 询问保修期限、质保多久、售后保障
-5. 服务人员 - 询问师傅资质、是否外包、技术人员信息
-6. 施工流程 - 询问怎么做、施工步骤、工艺方法、要做什么
-7. 联系方式 - 询问电话、微信、如何联系、留个号码
-8. 公司资质 - 询问公司规模、资质证书、是否正规、什么公司
-9. 材料品牌 - 询问使用什么材料、品牌、材料质量
-10. 施工周期 - 询问要做多久、工期、几天能完工
-11. 付款方式 - 询问怎么付款、能否分期、什么时候付
-12. 优惠活动 - 询问有没有优惠、折扣、活动
-13. 其他问题 - 是提问，但不属于以上任何分类（将被系统丢弃，请谨慎选择）
-14. 非问题 - 不是提问（陈述、回应、语气词、拒绝、报号码）
-
-## 对话上下文：
-{history_str}
-
-## 当前客户发言：
-"{text}"
-
-## 输出要求：
-- 只输出 JSON 格式
-- category 必须是上面 14 个分类之一
-- 格式: {{"category": "分类名", "reason": "简短理由"}}"""
-
-            # 调用 LLM
-            trace_id = f"faq_trace_{transcript_id}_{timestamp}"
-            start_time = time.time()
+            if rows:
+                print(f"📬 [{datetime.now():%H:%M:%S}] 新通话 {len(rows)} 条")
+                total_new += await analyze_rows(ctx, rows, args.itersize)
+                # 下一轮查询前确保水位已落库，避免重复处理
+                await asyncio.to_thread(ctx.writer.flush)
+                if ctx.cache:
+                    ctx.cache.flush()
+                if ctx.dedup and len(ctx.dedup.exact) > DEDUP_MAX_GROUPS:
+                    ctx.dedup.reset()
+                if len(rows) >= args.limit:
+                    # 还有积压，立即进入下一轮
+                    continue
             
-            try:
-                response = client.chat.completions.create(
-                    model="hunyuan-lite",
-                    messages=[{"role": "user", "content": prompt}],
-                    temperature=0.1,
-                    timeout=30
-                )
-                raw_output = response.choices[0].message.content.strip()
-                execution_time = int((time.time() - start_time) * 1000)
-                
-                # 统一使用 Upsert 逻辑记录日志
-                if db_type == 'postgres':
-                    sql = """
-                        INSERT INTO log_prompt_execution 
-                        (id, prompt_id, call_id, input_variables, raw_output, 
-                         execution_time_ms, status, error_message, is_dry_run, created_at)
-                        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                        ON CONFLICT (id) DO UPDATE SET
-                            raw_output = EXCLUDED.raw_output,
-                            execution_time_ms = EXCLUDED.execution_time_ms,
-                            status = EXCLUDED.status
-                    """
-                    cur.execute(sql, (
-                        trace_id, "faq_v3_ci", call_id, prompt, raw_output, 
-                        execution_time, "success", "", 0, datetime.now()
-                    ))
-                else:  # SQLite
-                    sql = """
-                        INSERT OR REPLACE INTO log_prompt_execution 
-                        (id, prompt_id, call_id, input_variables, raw_output, 
-                         execution_time_ms, status, error_message, is_dry_run, created_at)
-                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                    """
-                    cur.execute(sql, (
-                        trace_id, "faq_v3_ci", call_id, prompt, raw_output, 
-                        execution_time, "success", "", 0, datetime.now().isoformat()
-                    ))
-                conn.commit()
-                print(f"    📝 已记录日志: {trace_id[:50]}...")
-                
-                # 解析结果
-                result = json.loads(raw_output)
-                category = result.get("category", "")
-                
-                # 清洗 category: 去除可能的序号前缀 (如 "11. 付款方式" → "付款方式")
-                category = re.sub(r'^\d+\.\s*', '', category).strip()
-                
-                # V3 策略: 严格过滤
-                if category in CATEGORIES and category not in ["非问题", "其他问题", "其他"]:
-                    extracted_questions.append({
-                        "timestamp": timestamp,
-                        "question": text,
-                        "category": category,
-                        "time_display": format_timestamp(timestamp)
-                    })
-                    
-            except Exception as e:
-                # 记录错误
-                if db_type == 'postgres':
-                    sql = """
-                        INSERT INTO log_prompt_execution 
-                        (id, prompt_id, call_id, input_variables, raw_output, 
-                         execution_time_ms, status, error_message, is_dry_run, created_at)
-                        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                        ON CONFLICT (id) DO NOTHING
-                    """
-                    cur.execute(sql, (
-                        trace_id, "faq_v3_ci", call_id, prompt, "",  # 使用 call_id（可能是 None/NULL）
-                        0, "error", str(e), 0, datetime.now()
-                    ))
-                else:  # SQLite
-                    sql = """
-                        INSERT OR REPLACE INTO log_prompt_execution 
-                        (id, prompt_id, call_id, input_variables, raw_output, 
-                         execution_time_ms, status, error_message, is_dry_run, created_at)
-                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                    """
-                    cur.execute(sql, (
-                        trace_id, "faq_v3_ci", call_id, prompt, "",  # 使用 call_id（可能是 None）
-                        0, "error", str(e), 0, datetime.now().isoformat()
-                    ))
-                conn.commit()
+            if full_scan and since is None:
+                print(f"⏳ 积压已处理完，开始监听新通话 (轮询间隔 {args.poll_interval}s"
+                      f"{'，LISTEN/NOTIFY' if watcher.listen else ''})")
+            # 积压处理完后: 水位之前的通话都已处理或不符合条件
+            since = mark if mark is not None else since
+            await watcher.wait(args.poll_interval, stop)
+    finally:
+        watcher.close()
+        await ctx.client.close()
+    print(f"🛑 常驻模式退出: 共轮询 {polls} 次 | NOTIFY {watcher.notifications} 次")
+    return total_new
+
+def pending_filter(db, args, since=None):
+    """
+    待分析通话的 FROM / WHERE 子句与参数 (直接查询与工作队列入队共用)
+    长度过滤在数据库端完成；增量模式与水位表做反连接，排除当前 Prompt 版本已处理的通话 (走主键索引)
+    since: 只查询 created_at >= since 的通话 (常驻模式的新通话水位)
+    """
+    if db.db_type == 'postgres':
+        length_check = "LENGTH(t.content::text) > 100"
+    else:
+        length_check = "LENGTH(t.content) > 100"
     
-    return extracted_questions
+    join_sql = ""
+    conditions = ""
+    params = []
+    if not args.force:
+        join_sql = """
+        LEFT JOIN biz_faq_processed p ON p.transcript_id = t.id AND p.prompt_version = %s"""
+        conditions += "\n          AND p.transcript_id IS NULL"
+        params.append(PROMPT_VERSION)
+    if since is not None:
+        conditions += "\n          AND t.created_at >= %s"
+        params.append(since)
+    if args.days > 0:
+        if db.db_type == 'postgres':
+            conditions += "\n          AND t.created_at > %s"
+            params.append(datetime.now() - timedelta(days=args.days))
+        else:
+            conditions += f"\n          AND t.created_at > datetime('now', '-{args.days} days')"
+    
+    where_sql = f"""
+        WHERE t.content IS NOT NULL 
+          AND {length_check}{conditions}"""
+    return join_sql, where_sql, params
+
+def fetch_pending(db, conn, args, since=None):
+    """
+    查询待分析通话: 只取 ID 等小字段 (最多 --limit 行)，一次读入内存；
+    体积大的通话内容不在这里读取，由 TranscriptLoader 在分析时每 --itersize 条分块加载
+    """
+    join_sql, where_sql, params = pending_filter(db, args, since)
+    sql = f"""
+        SELECT t.id, t.deal_id, l.call_id
+        FROM sync_transcripts t
+        LEFT JOIN {LINK_TABLE} l ON l.transcript_id = t.id{join_sql}{where_sql}
+        ORDER BY t.created_at DESC LIMIT %s
+    """
+    cur = db.cursor(conn, dict_rows=True)
+    db.execute(cur, sql, (*params, args.limit))
+    rows = cur.fetchall()
+    cur.close()
+    return rows
+
+def claim_pending(db, conn, work_queue, args, since=None):
+    """
+    工作队列模式: 把最新的 --limit 条未入队通话写入队列，再领取最多 --limit 条
+    (包括其他进程租约已过期的通话)，返回领取到的 (id, deal_id, call_id)
+    多个进程同时运行时各自领取不同的通话
+    """
+    join_sql, where_sql, params = pending_filter(db, args, since)
+    candidates = f"""
+        SELECT t.id
+        FROM sync_transcripts t{join_sql}{where_sql}
+          AND NOT EXISTS (
+                SELECT 1 FROM {QUEUE_TABLE} q
+                WHERE q.transcript_id = t.id AND q.prompt_version = %s
+          )
+        ORDER BY t.created_at DESC LIMIT %s
+    """
+    work_queue.enqueue(conn, candidates, (*params, PROMPT_VERSION, args.limit))
+    ids = work_queue.claim(conn, args.limit)
+    
+    rows = []
+    cur = db.cursor(conn, dict_rows=True)
+    for i in range(0, len(ids), args.itersize):
+        chunk = ids[i:i + args.itersize]
+        placeholders = ", ".join(["%s"] * len(chunk))
+        db.execute(cur, f"""
+            SELECT t.id, t.deal_id, l.call_id
+            FROM sync_transcripts t
+            LEFT JOIN {LINK_TABLE} l ON l.transcript_id = t.id
+            WHERE t.id IN ({placeholders})
+        """, chunk)
+        rows.extend(cur.fetchall())
+    cur.close()
+    # 领取后通话记录被删除的，直接移出队列
+    found = {row_fields(row)[0] for row in rows}
+    work_queue.discard(conn, [tid for tid in ids if tid not in found])
+    return rows
 
 def main():
     parser = argparse.ArgumentParser(description="FAQ 分析 (本地/CI)")
     parser.add_argument("--limit", type=int, default=10, help="处理记录数 (默认 10, 用于本地测试)")
     parser.add_argument("--days", type=int, default=0, help="仅分析最近 N 天的数据 (0=全部)")
     parser.add_argument("--force", action="store_true", help="强制重新分析 (幂等更新)")
+    parser.add_argument("--concurrency", type=int, default=8, help="LLM 并发请求上限 (默认 8, 1=串行)")
+    parser.add_argument("--rps", type=float, default=5.0, help="初始请求速率 req/s (AIMD 自动调整, 默认 5)")
+    parser.add_argument("--tpm", type=int, default=0, help="每分钟 Token 预算 (0=不限制)")
+    parser.add_argument("--context-tokens", type=int, default=CONTEXT_TOKEN_BUDGET, help=f"上下文 Token 预算 (默认 {CONTEXT_TOKEN_BUDGET}，超出时从最早的发言裁剪)")
+    parser.add_argument("--escalate", action="store_true", help="上下文升级模式: 先用最近几句上下文分类，把握不足时再带完整上下文 (逐句模式)")
+    parser.add_argument("--escalate-threshold", type=float, default=0.8, help="上下文升级模式直接采用第一阶段结果的 confidence 下限 (默认 0.8)")
+    parser.add_argument("--batch-size", type=int, default=1, help="每次请求批量分类的连续客户发言数 K (默认 1=逐句)")
+    parser.add_argument("--no-rules", action="store_true", help="禁用规则预分类 (所有发言都调用 LLM)")
+    parser.add_argument("--no-dedup", action="store_true", help="禁用近似重复发言去重")
+    parser.add_argument("--dedup-threshold", type=float, default=0.8, help="近似重复判定的 Jaccard 相似度阈值 (默认 0.8)")
+    parser.add_argument("--no-cache", action="store_true", help="禁用 LLM 响应缓存 (强制调用 API)")
+    parser.add_argument("--cache-max-entries", type=int, default=200000, help="缓存最大条数 (LRU 淘汰, 0=不限)")
+    parser.add_argument("--cache-max-days", type=int, default=30, help="缓存最长保留天数 (0=不限)")
+    parser.add_argument("--itersize", type=int, default=100, help="通话内容分块加载的每批条数 (默认 100，ID 列表一次读取)")
+    parser.add_argument("--flush-size", type=int, default=200, help="后台写入每批行数 (默认 200)")
+    parser.add_argument("--flush-interval", type=float, default=2.0, help="后台写入最长间隔秒数 (默认 2)")
+    parser.add_argument("--full-prompt-rate", type=float, default=0.01, help="成功调用保存完整 Prompt 的抽样比例 (默认 0.01，错误调用总是保存)")
+    parser.add_argument("--log-compression", choices=["none", "zstd"], default="none", help="日志中完整 Prompt 的压缩方式 (zstd 需要安装 zstandard)")
+    parser.add_argument("--daemon", action="store_true", help="常驻模式: 持续轮询并分析新通话 (--limit 为每批条数)")
+    parser.add_argument("--poll-interval", type=float, default=10.0, help="常驻模式轮询间隔秒数 (默认 10)")
+    parser.add_argument("--listen", action="store_true", help="常驻模式使用 PostgreSQL LISTEN/NOTIFY 即时唤醒 (需直连或 Session 模式)")
+    parser.add_argument("--full-scan-every", type=int, default=60, help="常驻模式每 N 轮做一次不带水位的全量检查 (默认 60, 0=不做)")
+    parser.add_argument("--call-profile", choices=["standard", "fast"], default="standard",
+                        help="单句请求的调用配置: standard 输出 category + reason；fast 只输出 category、限制 max_tokens 并请求 JSON 模式")
+    parser.add_argument("--stream", action="store_true", help="单句请求流式读取，解析出 category 后立即结束 (提前结束的调用没有 Token 用量)")
+    parser.add_argument("--max-seconds", type=int, default=0, help="运行时长预算秒数 (0=不限)，预计超出时不再开始新通话，处理完进行中的通话后退出")
+    parser.add_argument("--max-calls", type=int, default=0, help="本次运行的 API 调用次数预算 (0=不限)")
+    parser.add_argument("--max-tokens", type=int, default=0, help="本次运行的 Token 总预算 (输入 + 输出, 0=不限)")
+    parser.add_argument("--max-failures", type=int, default=20, help="连续多少次调用失败后熔断停止 (默认 20, 0=不熔断)")
+    parser.add_argument("--hedge", action="store_true", help="对冲请求: 调用超过滚动 P95 耗时仍未返回时发出重复请求，先返回的有效结果胜出")
+    parser.add_argument("--hedge-max-rate", type=float, default=0.1, help="对冲请求数占调用数的上限 (额外花费上限, 默认 0.1)")
+    parser.add_argument("--hedge-min-delay", type=float, default=1.0, help="对冲延迟下限秒数 (默认 1)")
+    parser.add_argument("--local-model", help="本地 n-gram 模型 (模型文件路径或 latest，由 faq_local_model.py 训练)")
+    parser.add_argument("--local-threshold", type=float, default=0.9, help="本地模型直接判定所需的最低概率 (默认 0.9)")
+    parser.add_argument("--lease-seconds", type=int, default=300, help="工作队列租约时长秒数 (默认 300，进程失联超过该时长后由其他进程接手)")
     args = parser.parse_args()
     
     if not HUNYUAN_API_KEY:
         print("❌ 错误: 需要设置 HUNYUAN_API_KEY 环境变量")
         return
+    if args.daemon and args.force:
+        print("❌ 错误: 常驻模式依赖处理水位，不能与 --force 同时使用")
+        return
     
-    print(f"🚀 开始 FAQ 分析")
-    print(f"📊 限制: {args.limit} 条 | 时间范围: {'最近 ' + str(args.days) + ' 天' if args.days > 0 else '全部'}")
+    print(f"🚀 开始 FAQ 分析{' (常驻模式)' if args.daemon else ''}")
+    print(f"📊 {'每批' if args.daemon else '限制'}: {args.limit} 条 | 时间范围: {'最近 ' + str(args.days) + ' 天' if args.days > 0 else '全部'}")
     
-    # 连接数据库
+    # 连接数据库 (连接池: 分析循环与后台写入线程各借一个连接，缓存查询在线程中另借连接)
     try:
-        conn, db_type = get_db_connection(DATABASE_URL)
+        db = get_db_connection(DATABASE_URL, max_connections=4 + CACHE_READ_CONNECTIONS)
+        conn = db.getconn()
+        db_type = db.db_type
         print(f"✅ 数据库连接成功 ({db_type.upper()})")
     except Exception as e:
         print(f"❌ 数据库连接失败: {e}")
@@ -379,130 +1187,159 @@ def main():
     # 初始化表结构
     ensure_schema(conn, db_type)
     
-    # 查询待分析数据
-    if db_type == 'postgres':
-        from psycopg2.extras import RealDictCursor
-        cur_factory = RealDictCursor
-        placeholder = '%s'
-        length_check = "LENGTH(t.content::text) > 100"
-    else:
-        cur_factory = None
-        placeholder = '?'
-        length_check = "LENGTH(t.content) > 100"
+    cursor = db.cursor(conn, dict_rows=True)
     
-    cursor = conn.cursor() if db_type == 'sqlite' else conn.cursor(cursor_factory=cur_factory)
+    # 增量补齐关联表 (只处理新通话与未匹配记录)，主查询按 transcript_id 主键关联
+    added, relinked = update_linkage(conn, db_type)
+    if added or relinked:
+        print(f"🔗 关联表更新: 新增 {added} 条 | 补齐 call {relinked} 条")
     
-    # 增量处理逻辑：先查询已处理的 transcript_id，再排除
-    processed_transcript_ids = set()
     if not args.force:
-        print(f"🔄 增量模式: 查询已处理的记录...")
-        if db_type == 'postgres':
-            # 提取已处理的 transcript_id（从 log 表的 id 中解析）
-            cursor.execute("""
-                SELECT DISTINCT 
-                    SUBSTRING(id FROM 'faq_trace_([^_]+)_') as transcript_id
-                FROM log_prompt_execution 
-                WHERE id LIKE 'faq_trace_%' 
-                  AND prompt_id = 'faq_v3_ci'
-            """)
-            processed_transcript_ids = {row['transcript_id'] for row in cursor.fetchall() if row['transcript_id']}
-        else:
-            cursor.execute("""
-                SELECT DISTINCT 
-                    SUBSTR(id, 11, INSTR(SUBSTR(id, 11), '_') - 1) as transcript_id
-                FROM log_prompt_execution 
-                WHERE id LIKE 'faq_trace_%'
-            """)
-            processed_transcript_ids = {row[0] for row in cursor.fetchall() if row[0]}
-        print(f"   已处理记录数: {len(processed_transcript_ids)}")
+        print(f"🔄 增量模式: 排除已处理的记录 (版本 {PROMPT_VERSION})...")
+        migrated = backfill_processed(conn, db_type, PROMPT_VERSION, FAQ_PROMPT_IDS)
+        if migrated:
+            print(f"   已从历史日志迁移水位: {migrated} 条")
     else:
-        print(f"⚠️ 强制模式 (--force): 将重新处理所有记录")
-
-    # 简化主查询（不再使用 NOT EXISTS 子查询）
-    sql = f"""
-        SELECT t.id, t.deal_id, t.content, c.id as call_id
-        FROM sync_transcripts t
-        LEFT JOIN biz_calls c ON t.audio_url = c.audio_url
-        WHERE t.content IS NOT NULL 
-          AND {length_check}
-    """
+        print(f"⚠️ 强制模式 (--force): 将重新处理所有记录 (不经过工作队列，请勿与其他分析进程并行)")
     
-    if args.days > 0:
-        cutoff = datetime.now() - timedelta(days=args.days)
-        if db_type == 'postgres':
-            cursor.execute(sql + " AND t.created_at > %s ORDER BY t.created_at DESC LIMIT %s", (cutoff, args.limit * 3))
-        else:
-            cursor.execute(sql + f" AND t.created_at > datetime('now', '-{args.days} days') ORDER BY t.created_at DESC LIMIT ?", (args.limit * 3,))
-    else:
-        if db_type == 'postgres':
-            cursor.execute(sql + " ORDER BY t.created_at DESC LIMIT %s", (args.limit * 3,))
-        else:
-            cursor.execute(sql + " ORDER BY t.created_at DESC LIMIT ?", (args.limit * 3,))
+    # 增量模式经工作队列领取通话，多个进程可同时运行
+    work_queue = None if args.force else WorkQueue(db, PROMPT_VERSION, args.lease_seconds)
+    if work_queue:
+        print(f"🔒 工作队列: worker {work_queue.worker_id} | 租约 {work_queue.lease_seconds}s")
     
-    rows = cursor.fetchall()
+    def fetch(since=None):
+        if work_queue:
+            return claim_pending(db, conn, work_queue, args, since)
+        return fetch_pending(db, conn, args, since)
     
-    # 在 Python 中过滤掉已处理的记录（比 SQL NOT EXISTS 快得多）
-    if processed_transcript_ids:
-        if db_type == 'postgres':
-            rows = [r for r in rows if r['id'] not in processed_transcript_ids]
-        else:
-            rows = [r for r in rows if r[0] not in processed_transcript_ids]
-        print(f"   过滤后剩余: {len(rows)} 条未处理记录")
+    if args.daemon:
+        ensure_watch_index(conn, db_type)
+        rows = []
+    else:
+        rows = fetch()
+        if len(rows) == 0:
+            print("ℹ️  没有新的待分析记录（所有数据已处理或无符合条件的数据）")
+            print("💡 提示: 使用 --force 可重新分析已处理过的记录")
+            cursor.close()
+            db.putconn(conn)
+            db.close()
+            return
+        print(f"✅ 将处理 {len(rows)} 条记录")
     
-    # 只取 limit 条
-    rows = rows[:args.limit]
+    print(f"⚡ 并发上限: {args.concurrency} | 初始速率: {args.rps} req/s | TPM: {args.tpm or '不限'}")
+    limiter = AdaptiveRateLimiter(rps=args.rps, tpm=args.tpm)
     
-    if len(rows) == 0:
-        print("ℹ️  没有新的待分析记录（所有数据已处理或无符合条件的数据）")
-        print("💡 提示: 使用 --force 可重新分析已处理过的记录")
-        cursor.close()
-        conn.close()
-        return
+    cache = None
+    if not args.no_cache:
+        cache = LLMResponseCache(conn, db_type, args.cache_max_entries, args.cache_max_days)
+        cache.ensure_schema()
+        evicted = cache.evict()
+        if evicted:
+            print(f"🧹 缓存淘汰: {evicted} 条")
     
-    print(f"✅ 将处理 {len(rows)} 条记录")
+    log_compression = None if args.log_compression == "none" else args.log_compression
+    if log_compression == "zstd" and not ZSTD_AVAILABLE:
+        print("⚠️ 未安装 zstandard，日志中的完整 Prompt 将不压缩保存")
+        log_compression = None
     
-    client = OpenAI(api_key=HUNYUAN_API_KEY, base_url=HUNYUAN_BASE_URL)
-    total_new = 0
+    if args.batch_size > 1:
+        print(f"📦 批量模式: 每次请求分类 {args.batch_size} 句客户发言")
+    usage = UsageTracker()
+    prompt_sizes = PromptSizeHistogram()
+    escalation = new_escalation_stats()
+    parse_stats = ParseStats(PROMPT_VERSION)
+    if args.escalate:
+        print(f"🪜 上下文升级模式: 先带最近 {ESCALATION_CONTEXT_TURNS} 句上下文，confidence < {args.escalate_threshold} 时带完整上下文重问"
+              f"{' (批量请求不升级，仅回退的逐句调用生效)' if args.batch_size > 1 else ''}")
+    stream_stats = new_stream_stats()
+    if args.call_profile == "fast" or args.stream:
+        print(f"⚡ 调用配置: {args.call_profile}{' (流式，得到 category 即结束)' if args.stream else ''}")
+    budget = RunBudget(args.max_seconds, args.max_calls, args.max_tokens, args.max_failures)
+    if budget.limited:
+        print(f"⏳ 运行预算: 时长 {f'{args.max_seconds}s' if args.max_seconds else '不限'} | 调用 {args.max_calls or '不限'} | "
+              f"Token {args.max_tokens or '不限'} (超出前停止开始新的通话，处理完进行中的通话后退出)")
+    hedger = None
+    if args.hedge:
+        # 多个 AnalysisContext (守护模式每批一个) 共用同一个对冲器: 耗时窗口与预算按整次运行计算
+        hedger = RequestHedger(args.hedge_max_rate, min_delay=args.hedge_min_delay)
+        print(f"🏁 对冲请求: 超过滚动 P95 耗时 (至少 {args.hedge_min_delay}s) 时发出重复请求，"
+              f"对冲请求数不超过调用数的 {args.hedge_max_rate:.0%}")
+    preclassifier = None if args.no_rules else PreClassifier()
+    local_model = None
+    if args.local_model:
+        try:
+            local_model = LocalClassifier(NGramModel.load(args.local_model), args.local_threshold)
+            report = local_model.model.meta.get("report") or {}
+            print(f"🧠 本地模型: {local_model.version} | 留出集与 LLM 一致率 {report.get('agreement', 0):.1%} | 阈值 {args.local_threshold}")
+        except (OSError, ValueError) as e:
+            # 模型缺失或损坏时全部交给 LLM，不影响分析
+            print(f"⚠️ 本地模型加载失败，全部发言交给 LLM: {e}")
+    dedup = None if args.no_dedup else NearDuplicateIndex(args.dedup_threshold)
+    # 日志与 FAQ 结果由后台线程批量写库 (从连接池另借连接)，CI 取消 (SIGTERM) 时同样先写完缓冲再退出
+    writer = BufferedWriter(db, args.flush_size, args.flush_interval)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(128 + signum))
+    
+    def build_context():
+        # 重试交给 limiter 统一处理 (带 AIMD 降速)，关闭 SDK 内置重试
+        client = AsyncOpenAI(api_key=HUNYUAN_API_KEY, base_url=HUNYUAN_BASE_URL, max_retries=0)
+        return AnalysisContext(client, db, conn, cursor, args.concurrency, limiter, cache, args.batch_size,
+                               usage, preclassifier, dedup, writer, args.full_prompt_rate, log_compression,
+                               work_queue, args.context_tokens, prompt_sizes,
+                               args.escalate_threshold if args.escalate else None, escalation, local_model,
+                               args.call_profile, args.stream, stream_stats, parse_stats, hedger, budget)
     
-    for row in tqdm(rows, desc="分析中", ncols=80):
-        if db_type == 'postgres':
-            tid, deal_id, content, call_id = row['id'], row['deal_id'], row['content'], row['call_id']
+    try:
+        if work_queue:
+            # 租约心跳: 分析期间定期续期，进程退出后其他进程可在租约过期后接手
+            work_queue.start()
+        if args.daemon:
+            watcher = TranscriptWatcher(db, conn, args.listen)
+            total_new = asyncio.run(run_daemon(build_context, fetch, watcher, args))
         else:
-            tid, deal_id, content, call_id = row[0], row[1], row[2], row[3]
-        
-        questions = analyze_transcript(client, conn, cursor, tid, deal_id, call_id, content, db_type)
-        print(f"  📞 Transcript {tid[:20]}...: 提取 {len(questions)} 个问题")
-        
-        for q in questions:
-            if db_type == 'postgres':
-                cursor.execute("""
-                    INSERT INTO biz_faq_questions 
-                    (id, deal_id, transcript_id, call_id, "timestamp", question, category, created_at)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-                    ON CONFLICT (id) DO UPDATE SET
-                        question = EXCLUDED.question,
-                        category = EXCLUDED.category
-                """, (
-                    f"faq_v3_{tid}_{q['timestamp']}", deal_id, tid, call_id,
-                    q['timestamp'], q['question'], q['category'], datetime.now()
-                ))
-            else:  # SQLite
-                cursor.execute("""
-                    INSERT OR REPLACE INTO biz_faq_questions 
-                    (id, deal_id, transcript_id, call_id, timestamp, question, category, created_at)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-                """, (
-                    f"faq_v3_{tid}_{q['timestamp']}", deal_id, tid, call_id,
-                    q['timestamp'], q['question'], q['category'], datetime.now().isoformat()
-                ))
-            total_new += 1
-    
-    conn.commit()
-    cursor.close()
-    conn.close()
+            total_new = asyncio.run(run_analysis(build_context, rows, args.itersize))
+    finally:
+        writer.close()
+        try:
+            parse_stats.save(conn, db.placeholder)
+        except Exception as e:
+            conn.rollback()
+            print(f"⚠️ 解析统计写入失败: {e}")
+        if work_queue:
+            # 已完成的队列行已由写入线程删除，剩余的 (被取消或失败) 立即释放给其他进程
+            work_queue.stop()
+            work_queue.release(conn)
+        if cache:
+            cache.flush()
+        conn.commit()
+        cursor.close()
+        db.putconn(conn)
+        db.close()
     
     print("-" * 50)
     print(f"🎉 分析完成! 新增/更新 FAQ: {total_new} 条")
+    print(f"🗄️ 批量写入: {writer.summary()}")
+    if work_queue:
+        print(f"🔒 工作队列: {work_queue.summary()}")
+    print(f"🚦 限流统计: {limiter.summary()}")
+    print(f"🔢 Token 用量: {usage.summary()}")
+    print(f"📏 Prompt 大小分布 (估算 Token): {prompt_sizes.summary()}")
+    if args.escalate:
+        print(f"🪜 上下文升级: {escalation_summary(escalation)}")
+    print(f"🧾 输出解析: {parse_stats.summary()}")
+    if args.stream:
+        print(f"⚡ 流式请求: {stream_stats['streamed']} 次，得到 category 后提前结束 {stream_stats['stopped_early']} 次")
+    if hedger:
+        print(f"🏁 对冲请求: {hedger.summary()}")
+    if budget.enabled:
+        print(f"⏳ 运行预算: {budget.summary()}")
+    if preclassifier:
+        print(f"🧩 规则预分类: {preclassifier.summary()}")
+    if local_model:
+        print(f"🧠 本地模型: {local_model.summary()}")
+    if dedup:
+        print(f"♻️ 近似去重: {dedup.summary()}")
+    if cache:
+        print(f"💾 缓存统计: {cache.summary()}")
 
 if __name__ == "__main__":
     main()
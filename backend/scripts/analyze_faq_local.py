@@ -8,18 +8,33 @@ FAQ 深度分析脚本 (Phase 2 Upgrade)
 3. 关联通话记录 (call_id) 用于后续评分透视。
 """
 
-import sqlite3
 import json
 import os
 import time
 from openai import OpenAI
 from tqdm import tqdm
 from datetime import datetime
+from llm_rate_limiter import AdaptiveRateLimiter, estimate_tokens
+from llm_cache import LLMResponseCache
+from llm_usage import UsageTracker, extract_usage, usage_values, ensure_usage_columns
+from faq_prompts import PROMPT_VERSION, CATEGORIES, build_user_prompt, build_messages, build_repair_prompt
+from faq_output import parse_classification, parse_category, OutputParseError, ParseStats, ensure_parse_stats_schema
+from faq_db import connect_sqlite, TransactionBatcher
+from faq_context import ContextWindow, PromptSizeHistogram
 
 # 配置
 DB_PATH = "team-calls.db"
 SAMPLE_SIZE = 500  # 生产环境可调大
-CONTEXT_WINDOW = 20 # 上下文保留最近N句 (防止 Token 爆炸，虽说 Lite 免费但也有长度限制)
+CONTEXT_TOKEN_BUDGET = 400  # 上下文 Token 预算 (超出时从最早的发言裁剪，语气词等填充发言不计入)
+RATE_LIMIT_RPS = 5.0  # 初始请求速率 (AIMD 自动调整)
+RATE_LIMIT_TPM = 0    # 每分钟 Token 预算 (0=不限制)
+LLM_MODEL = "hunyuan-lite"
+LLM_PARAMS = {"temperature": 0.1}  # 参与缓存 Key 计算
+CALL_PROFILE = "standard"   # "fast": 只输出 category (不生成 reason)，限制 max_tokens，单次调用耗时更短
+FAST_MAX_TOKENS = 32        # fast 配置与格式修复重试的 max_tokens
+CACHE_MAX_ENTRIES = 200000  # 响应缓存最大条数 (LRU 淘汰)
+CACHE_MAX_DAYS = 30         # 响应缓存最长保留天数
+COMMIT_EVERY = 200          # 每 N 句发言提交一次事务 (WAL + synchronous=NORMAL 下不再逐行 fsync)
 
 def load_env_local():
     """读取 .env.local 文件中的环境变量"""
@@ -39,16 +54,10 @@ def load_env_local():
 HUNYUAN_API_KEY = load_env_local()
 HUNYUAN_BASE_URL = "https://api.hunyuan.cloud.tencent.com/v1"
 
-# 分类列表 (14个封闭式分类)
-CATEGORIES = [
-    "价格咨询", "服务范围", "上门时间", "质保期",
-    "服务人员", "施工流程", "联系方式", "公司资质",
-    "材料品牌", "施工周期", "付款方式", "优惠活动",
-    "其他问题", "非问题"
-]
 
 def get_client():
-    return OpenAI(api_key=HUNYUAN_API_KEY, base_url=HUNYUAN_BASE_URL)
+    # 重试交给限流器统一处理，关闭 SDK 内置重试
+    return OpenAI(api_key=HUNYUAN_API_KEY, base_url=HUNYUAN_BASE_URL, max_retries=0)
 
 def format_timestamp(ms):
     """将毫秒转换为 MM:SS 格式，用于日志显示"""
@@ -87,10 +96,54 @@ def is_valid_safety_check(text):
         
     return True
 
-def analyze_transcript_single_turn(client, conn, cursor, transcript_id, deal_id, call_id, content_json):
+def call_params(profile=CALL_PROFILE):
+    """按调用配置构建请求参数 (参与缓存 Key 计算)，不修改 LLM_PARAMS"""
+    if profile == "fast":
+        return dict(LLM_PARAMS, max_tokens=FAST_MAX_TOKENS)
+    return dict(LLM_PARAMS)
+
+def classify_output(client, limiter, usage_tracker, parse_stats, messages, res_text, from_cache):
+    """
+    解析分类输出 (代码块、说明文字、序号前缀、近似分类名由 faq_output 统一修复)
+    仍无法解析时做一次格式修复重试 (追加上一条回复与格式要求，限制 max_tokens)
+    返回 (闭集内的分类或 None, 最终回复)
+    """
+    variant = "single:fast" if CALL_PROFILE == "fast" else "single"
+    try:
+        category, _, repaired = parse_classification(res_text)
+        if not from_cache:
+            parse_stats.add(variant, "repaired" if repaired else "clean")
+        return category, res_text
+    except OutputParseError:
+        parse_stats.add(variant, "unparsed")
+    
+    repair_messages = messages + [
+        {"role": "assistant", "content": res_text or "(空)"},
+        {"role": "user", "content": build_repair_prompt()},
+    ]
+    completion = limiter.call(
+        lambda: client.chat.completions.create(
+            model=LLM_MODEL,
+            messages=repair_messages,
+            timeout=30,
+            **dict(LLM_PARAMS, max_tokens=FAST_MAX_TOKENS)
+        ),
+        tokens=sum(estimate_tokens(m["content"]) for m in repair_messages)
+    )
+    usage_tracker.add(extract_usage(completion))
+    res_text = completion.choices[0].message.content.strip()
+    try:
+        category = parse_category(res_text)
+    except OutputParseError:
+        parse_stats.add(variant, "failed")
+        return None, res_text
+    parse_stats.add(variant, "recovered")
+    return category, res_text
+
+def analyze_transcript_single_turn(client, limiter, cache, usage_tracker, prompt_sizes, parse_stats, batcher, cursor, transcript_id, deal_id, call_id, content_json):
     """
     核心逻辑: 全量上下文 + 逐句分析
-    新增: 将每次 LLM 调用即时记录到 log_prompt_execution
+    新增: 将每次 LLM 调用记录到 log_prompt_execution (每 COMMIT_EVERY 句批量提交)
     """
     extracted_questions = []
     
@@ -99,8 +152,8 @@ def analyze_transcript_single_turn(client, conn, cursor, transcript_id, deal_id,
     except:
         return []
 
-    # 上下文缓冲区
-    context_buffer = [] 
+    # 上下文缓冲区 (按 Token 预算裁剪的 deque)
+    context_buffer = ContextWindow(CONTEXT_TOKEN_BUDGET)
     
     # 遍历对话
     for item in transcript_items:
@@ -108,62 +161,55 @@ def analyze_transcript_single_turn(client, conn, cursor, transcript_id, deal_id,
         speaker = item.get("SpeakerId") # "1"=销售, "2"=客户
         timestamp = item.get("BeginTime", 0)
         
-        # 1. 更新上下文 (无论谁说的，都加入历史)
+        # 1. 更新上下文 (无论谁说的，都加入历史；语气词、报号码等填充发言不加入)
         role_label = "销售" if speaker == "1" else "客户"
-        context_buffer.append(f"{role_label}: {text}")
-        
-        # 保持上下文窗口大小
-        if len(context_buffer) > CONTEXT_WINDOW:
-            context_buffer.pop(0)
+        if is_valid_safety_check(text):
+            context_buffer.push(timestamp, f"{role_label}: {text}")
             
         # 2. 只有【客户】说的话，且长度合格，才进行推理
         if speaker == "2" and len(text) > 1 and is_valid_safety_check(text):
             
             # 构建 Prompt (V3: 结构化闭集 + 强力过滤)
             # 策略: 使用详细定义的分类来提升召回率(如上门时间)，但代码层直接丢弃 '其他问题' 以保证质量
-            history_str = "\n".join(context_buffer)
-            prompt = f"""你是一个客服对话分类助手。你的任务是判断客户发言是否为提问，并从以下分类中选择一个。
-
-## 可选分类（必须从中选择）：
-1. 价格咨询 - 询问费用、报价、价格、多少钱、贵不贵
-2. 服务范围 - 询问能否处理某类问题、是否提供某项服务、能不能做
-3. 上门时间 - 询问什么时候能来、多久到、预约时间、今天/明天可以吗
-4. 质保期 - 询问保修期限、质保多久、售后保障
-5. 服务人员 - 询问师傅资质、是否外包、技术人员信息
-6. 施工流程 - 询问怎么做、施工步骤、工艺方法、要做什么
-7. 联系方式 - 询问电话、微信、如何联系、留个号码
-8. 公司资质 - 询问公司规模、资质证书、是否正规、什么公司
-9. 材料品牌 - 询问使用什么材料、品牌、材料质量
-10. 施工周期 - 询问要做多久、工期、几天能完工
-11. 付款方式 - 询问怎么付款、能否分期、什么时候付
-12. 优惠活动 - 询问有没有优惠、折扣、活动
-13. 其他问题 - 是提问，但不属于以上任何分类（将被系统丢弃，请谨慎选择）
-14. 非问题 - 不是提问（陈述、回应、语气词、拒绝、报号码）
-
-## 对话上下文：
-{history_str}
-
-## 当前客户发言：
-"{text}"
-
-## 输出要求：
-- 只输出 JSON 格式
-- category 必须是上面 14 个分类之一
-- 格式: {{"category": "分类名", "reason": "简短理由"}}"""
+            # 分类定义放在固定的 system 消息中 (利于前缀缓存)，这里只构建变化的 user 消息
+            history_str = "\n".join(context_buffer.lines())
+            prompt = build_user_prompt(history_str, text)
+            prompt_sizes.add(estimate_tokens(prompt))
 
             try:
-                # 调用 Lite 模型
-                start_time = time.time()
-                # print(f"    📡 调用 API: {text[:20]}...", end="", flush=True) # 减少刷屏
-                completion = client.chat.completions.create(
-                    model="hunyuan-lite",
-                    messages=[{"role": "user", "content": prompt}],
-                    temperature=0.1,
-                    timeout=30  # 30秒超时
-                )
-                execution_time_ms = int((time.time() - start_time) * 1000)
-                res_text = completion.choices[0].message.content.strip()
-                print(f" ✓ {execution_time_ms}ms")
+                messages = build_messages(prompt, fast=CALL_PROFILE == "fast")
+                params = call_params()
+                usage = None
+                # 先查缓存 (重跑时相同 Prompt 无需再次调用 API)
+                cache_key = cache.make_key(LLM_MODEL, messages, params)
+                res_text = cache.get(cache_key)
+                from_cache = res_text is not None
+                if from_cache:
+                    execution_time_ms = 0
+                    print(f" ✓ 缓存")
+                else:
+                    # 调用 Lite 模型
+                    start_time = time.time()
+                    # print(f"    📡 调用 API: {text[:20]}...", end="", flush=True) # 减少刷屏
+                    # 限流 + 429/超时自动退避重试
+                    completion = limiter.call(
+                        lambda: client.chat.completions.create(
+                            model=LLM_MODEL,
+                            messages=messages,
+                            timeout=30,  # 30秒超时
+                            **params
+                        ),
+                        tokens=sum(estimate_tokens(m["content"]) for m in messages)
+                    )
+                    execution_time_ms = int((time.time() - start_time) * 1000)
+                    res_text = completion.choices[0].message.content.strip()
+                    usage = extract_usage(completion)
+                    usage_tracker.add(usage)
+                    print(f" ✓ {execution_time_ms}ms")
+                
+                # 解析输出 (无法解析时做一次格式修复重试)
+                category, res_text = classify_output(client, limiter, usage_tracker, parse_stats,
+                                                     messages, res_text, from_cache)
                 
                 # ========== LLM Trace Logging ==========
                 trace_id = f"faq_trace_{transcript_id}_{timestamp}"
@@ -171,31 +217,30 @@ def analyze_transcript_single_turn(client, conn, cursor, transcript_id, deal_id,
                     cursor.execute("""
                         INSERT OR REPLACE INTO log_prompt_execution 
                         (id, prompt_id, call_id, input_variables, raw_output, parsed_output, 
-                         execution_time_ms, status, is_dry_run, created_at)
-                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                         execution_time_ms, status, is_dry_run, created_at,
+                         prompt_tokens, completion_tokens, cached_tokens)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
                     """, (
                         trace_id,
                         "faq_classification",  # prompt_id 标识用途
                         call_id or "",
-                        prompt,                 # input_variables 存完整 prompt
+                        prompt,                 # input_variables 存 user 消息 (system 消息固定)
                         res_text,               # raw_output 存原始返回
                         "",                     # parsed_output 稍后填充
                         execution_time_ms,
                         "success",
                         0,
                         datetime.now().isoformat()
-                    ))
-                    conn.commit()  # 即时提交，保证日志不丢失
+                    ) + usage_values(usage))
+                    batcher.tick()
                 except Exception as trace_err:
                     pass  # 日志失败不影响主流程
                 # ========================================
                 
-                # 简单解析 JSON
-                clean_json = res_text.replace("```json", "").replace("```", "").strip()
-                if clean_json.startswith("{") and clean_json.endswith("}"):
-                    data = json.loads(clean_json)
-                    category = data.get("category", "非问题")
-                    # reason = data.get("reason", "")
+                if category is not None:
+                    # 只缓存可解析的结果
+                    if not from_cache:
+                        cache.put(cache_key, LLM_MODEL, res_text)
                     
                     # 命中有效分类 (过滤掉 '非问题' 和 '其他问题' 以及旧的 '其他')
                     if category in CATEGORIES and category not in ["非问题", "其他问题", "其他"]:
@@ -233,6 +278,7 @@ def analyze_transcript_single_turn(client, conn, cursor, transcript_id, deal_id,
                         0,
                         datetime.now().isoformat()
                     ))
+                    batcher.tick()
                 except:
                     pass
                 
@@ -246,8 +292,10 @@ def main():
         print("❌ 错误: 未设置 HUNYUAN_API_KEY (.env.local)")
         return
 
-    conn = sqlite3.connect(DB_PATH)
+    # WAL + 调优 PRAGMA: 分析写入期间看板仍可读取
+    conn = connect_sqlite(DB_PATH)
     cursor = conn.cursor()
+    batcher = TransactionBatcher(conn, COMMIT_EVERY)
     
     # 1. 抓取数据 (关联 biz_calls 获取 call_id)
     # 优先分析那些还没有被关联 call_id 的 FAQ (如果是增量更新的话)，
@@ -265,6 +313,15 @@ def main():
     print(f"✅ 获取到 {len(rows)} 条待分析记录")
     
     client = get_client()
+    limiter = AdaptiveRateLimiter(rps=RATE_LIMIT_RPS, tpm=RATE_LIMIT_TPM)
+    cache = LLMResponseCache(conn, 'sqlite', CACHE_MAX_ENTRIES, CACHE_MAX_DAYS, autocommit=False)
+    cache.ensure_schema()
+    cache.evict()
+    ensure_usage_columns(conn, 'sqlite')
+    usage_tracker = UsageTracker()
+    prompt_sizes = PromptSizeHistogram()
+    ensure_parse_stats_schema(conn, 'sqlite')
+    parse_stats = ParseStats(PROMPT_VERSION)
     total_new_questions = 0
     
     # 2. 循环分析
@@ -272,7 +329,7 @@ def main():
         tid, deal_id, content_json, call_id = row
         
         # 即使 c.id 是 NULL (没匹配上)，也分析，只是 call_id 为空
-        questions = analyze_transcript_single_turn(client, conn, cursor, tid, deal_id, call_id, content_json)
+        questions = analyze_transcript_single_turn(client, limiter, cache, usage_tracker, prompt_sizes, parse_stats, batcher, cursor, tid, deal_id, call_id, content_json)
         
         if questions:
             for q in questions:
@@ -292,12 +349,20 @@ def main():
                     datetime.now().isoformat()
                 ))
                 total_new_questions += 1
+            batcher.tick(len(questions))
                 
-    conn.commit()
+    cache.flush()
+    parse_stats.save(conn, "?")
+    batcher.commit()
     conn.close()
     
     print("-" * 50)
     print(f"🎉 分析完成! 新增 FAQ 问题: {total_new_questions} 条")
+    print(f"🚦 限流统计: {limiter.summary()}")
+    print(f"💾 缓存统计: {cache.summary()}")
+    print(f"🔢 Token 用量: {usage_tracker.summary()}")
+    print(f"📏 Prompt 大小分布 (估算 Token): {prompt_sizes.summary()}")
+    print(f"🧾 输出解析: {parse_stats.summary()}")
     print(f"💡 数据已包含 timestamp 和 call_id，支持点击跳转与评分透视。")
 
 if __name__ == "__main__":
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+运行预算与熔断 (Run Budget)
+--limit 很大时一次运行可能超过 CI 任务时限，被强制终止时缓冲中的结果会丢失；API 持续报错时也会一直重试下去。
+- 预算: 运行时长 (秒)、API 调用次数、Token 总量，0 = 不限制
+- 准入: 开始新通话前，按已完成通话的平均消耗估算 (进行中的通话按平均值扣除已用部分)，
+  剩余预算放不下时不再开始新通话
+- 硬上限: 任一预算用尽或熔断后不再发起新的 LLM 调用，进行中的请求照常完成 (drain)，
+  未分类的发言按断点在下次运行继续 (不计入发言失败次数)
+- 熔断: 连续 max_failures 次调用失败 (限流器重试用尽) 后停止
+"""
+
+import time
+import contextvars
+from contextlib import contextmanager
+
+# 当前通话的消耗 (asyncio 任务创建时复制上下文，同一通话内并发的调用共享同一个 dict)
+_TRANSCRIPT_SPEND = contextvars.ContextVar("faq_transcript_spend", default=None)
+
+class BudgetExhausted(RuntimeError):
+    """预算用尽或熔断后拒绝新的 LLM 调用"""
+
+class RunBudget:
+    """
+    max_seconds / max_calls / max_tokens: 运行时长、API 调用次数、Token 总量上限 (0 = 不限制)
+    max_failures: 连续失败多少次后熔断 (0 = 不熔断)
+    """
+
+    def __init__(self, max_seconds=0, max_calls=0, max_tokens=0, max_failures=0):
+        self.max_seconds = max_seconds
+        self.max_calls = max_calls
+        self.max_tokens = max_tokens
+        self.max_failures = max_failures
+        self.started = time.monotonic()
+        self.calls = 0
+        self.tokens = 0
+        self.consecutive_failures = 0
+        self.failures = 0
+        # closed: 不再开始新通话；exhausted: 不再发起新调用
+        self.closed = False
+        self.exhausted = False
+        self.stop_reason = None
+        self.in_flight = []
+        self.finished = {"count": 0, "seconds": 0.0, "calls": 0, "tokens": 0}
+        self.stats = {"completed": 0, "incomplete": 0, "skipped": 0}
+
+    @property
+    def limited(self):
+        """是否设置了时长 / 调用 / Token 预算"""
+        return bool(self.max_seconds or self.max_calls or self.max_tokens)
+
+    @property
+    def enabled(self):
+        return self.limited or bool(self.max_failures)
+
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    def _stop(self, reason, hard):
+        if hard and not self.exhausted:
+            self.exhausted = True
+            self.stop_reason = f"{self.stop_reason}；{reason}" if self.closed else reason
+            print(f"⏹️ {reason}，不再发起新的 LLM 调用 (进行中的请求完成后结束)")
+        elif not self.closed:
+            self.stop_reason = reason
+            print(f"⏹️ {reason}，不再开始新的通话 (进行中的通话处理完后结束)")
+        self.closed = True
+
+    def check(self):
+        """检查硬上限，返回是否已停止准入 (常驻模式每轮查询前调用)"""
+        if self.max_seconds and self.elapsed() >= self.max_seconds:
+            self._stop(f"运行时长达到 {self.max_seconds}s", hard=True)
+        elif self.max_calls and self.calls >= self.max_calls:
+            self._stop(f"API 调用达到 {self.max_calls} 次", hard=True)
+        elif self.max_tokens and self.tokens >= self.max_tokens:
+            self._stop(f"Token 用量达到 {self.max_tokens}", hard=True)
+        return self.closed
+
+    def admit(self):
+        """开始新通话前调用: 剩余预算预计放得下时返回 True，否则停止准入并返回 False"""
+        self.check()
+        if not self.closed and self.finished["count"]:
+            n = self.finished["count"]
+            avg_seconds = self.finished["seconds"] / n
+            if self.max_seconds and self.elapsed() + avg_seconds > self.max_seconds:
+                self._stop(f"剩余时间不足一个通话的平均耗时 ({avg_seconds:.1f}s)", hard=False)
+            for key, limit, used in (("calls", self.max_calls, self.calls), ("tokens", self.max_tokens, self.tokens)):
+                if self.closed or not limit:
+                    continue
+                avg = self.finished[key] / n
+                # 进行中的通话预计还要消耗 (平均值 - 已用)，加上新通话的平均值
+                reserved = sum(max(0.0, avg - spend[key]) for spend in self.in_flight) + avg
+                if used + reserved > limit:
+                    self._stop(f"剩余{'调用次数' if key == 'calls' else ' Token'}预计不足以处理新的通话", hard=False)
+        if self.closed:
+            self.stats["skipped"] += 1
+            return False
+        return True
+
+    @contextmanager
+    def transcript(self):
+        """包住一个通话的分析: 记录该通话的耗时与消耗 (用于准入估算)"""
+        spend = {"calls": 0, "tokens": 0}
+        token = _TRANSCRIPT_SPEND.set(spend)
+        self.in_flight.append(spend)
+        start = time.monotonic()
+        try:
+            yield spend
+        finally:
+            _TRANSCRIPT_SPEND.reset(token)
+            self.in_flight.remove(spend)
+            # 被硬上限打断的通话消耗偏低，不参与平均值
+            if not self.exhausted:
+                self.finished["count"] += 1
+                self.finished["seconds"] += time.monotonic() - start
+                self.finished["calls"] += spend["calls"]
+                self.finished["tokens"] += spend["tokens"]
+
+    def finish(self, status):
+        """记录通话结果 (incomplete = 有发言留到下次运行)"""
+        self.stats["incomplete" if status == "incomplete" else "completed"] += 1
+
+    def start_call(self):
+        """每次实际发出 API 请求前调用 (限流器的重试、对冲请求同样计数)，预算用尽或已熔断时抛出 BudgetExhausted"""
+        self.check()
+        if self.exhausted:
+            raise BudgetExhausted(self.stop_reason)
+        self.calls += 1
+        spend = _TRANSCRIPT_SPEND.get()
+        if spend is not None:
+            spend["calls"] += 1
+
+    def record_success(self, usage=None, estimated_tokens=0):
+        """调用成功: 累计 Token (没有用量时按估算的输入 Token)，重置连续失败计数"""
+        self.consecutive_failures = 0
+        tokens = ((usage.get("prompt_tokens") or 0) + (usage.get("completion_tokens") or 0)) if usage else 0
+        tokens = tokens or estimated_tokens
+        self.tokens += tokens
+        spend = _TRANSCRIPT_SPEND.get()
+        if spend is not None:
+            spend["tokens"] += tokens
+
+    def record_failure(self):
+        """调用失败 (限流器重试用尽): 连续失败达到 max_failures 时熔断"""
+        self.failures += 1
+        self.consecutive_failures += 1
+        if self.max_failures and self.consecutive_failures >= self.max_failures:
+            self._stop(f"连续 {self.consecutive_failures} 次调用失败 (熔断)", hard=True)
+
+    def summary(self):
+        def limit(value, unit=""):
+            return f"{value}{unit}" if value else "不限"
+        s = self.stats
+        return (f"耗时 {self.elapsed():.0f}s/{limit(self.max_seconds, 's')} | 调用 {self.calls}/{limit(self.max_calls)} | "
+                f"Token {self.tokens}/{limit(self.max_tokens)} | 调用失败 {self.failures} 次 | "
+                f"通话: 完成 {s['completed']} | 未完成 (下次续跑) {s['incomplete']} | 未开始 {s['skipped']} | "
+                f"停止原因: {self.stop_reason or '无 (全部处理完)'}")
@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+"""
+通话分析工作队列 (biz_faq_work_queue) 与租约
+多个 analyze_faq_ci.py 进程 (可在不同机器上) 同时运行时各自领取不同的通话，不会重复调用 LLM:
+- 入队: 待分析通话 (未处理、未入队) 按 --limit 条写入队列，主键 (transcript_id, prompt_version) 保证不重复
+- 领取: 租约为空或已过期的队列行标记为本进程 (worker_id) 并设置租约到期时间
+  PostgreSQL: SELECT ... FOR UPDATE SKIP LOCKED，并发领取时跳过其他进程正在锁定的行
+  SQLite: BEGIN IMMEDIATE 取得写锁后查询并更新 (队列表即锁表)，其他进程最多等待 busy_timeout
+- 心跳: 后台线程定期延长本进程持有的租约；进程崩溃后租约过期，由其他进程重新领取
+  分析循环通过 progress() 报告进展，超过一个租约时长没有进展 (卡死) 时停止续期，租约同样会过期
+- 完成: 通话写入处理水位后删除队列行 (经后台写入线程，排在水位之后落库)
+- 退出: 释放尚未处理的租约，其他进程无需等待过期
+领取次数达到 MAX_ATTEMPTS 的通话 (多次导致进程崩溃或超时) 不再领取，需人工排查
+"""
+
+import os
+import time
+import uuid
+import socket
+import threading
+from datetime import datetime, timedelta
+from faq_processed import PROCESSED_TABLE
+
+QUEUE_TABLE = "biz_faq_work_queue"
+MAX_ATTEMPTS = 3
+
+def ensure_queue_schema(conn, db_type):
+    """创建工作队列表，lease_until 为空表示未被领取"""
+    cur = conn.cursor()
+    if db_type == 'postgres':
+        cur.execute(f"""
+            CREATE TABLE IF NOT EXISTS {QUEUE_TABLE} (
+                transcript_id TEXT NOT NULL,
+                prompt_version TEXT NOT NULL,
+                enqueued_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+                worker_id TEXT,
+                claimed_at TIMESTAMP WITH TIME ZONE,
+                heartbeat_at TIMESTAMP WITH TIME ZONE,
+                lease_until TIMESTAMP WITH TIME ZONE,
+                attempts INTEGER DEFAULT 0,
+                PRIMARY KEY (transcript_id, prompt_version)
+            )
+        """)
+    else:
+        cur.execute(f"""
+            CREATE TABLE IF NOT EXISTS {QUEUE_TABLE} (
+                transcript_id TEXT NOT NULL,
+                prompt_version TEXT NOT NULL,
+                enqueued_at TEXT,
+                worker_id TEXT,
+                claimed_at TEXT,
+                heartbeat_at TEXT,
+                lease_until TEXT,
+                attempts INTEGER DEFAULT 0,
+                PRIMARY KEY (transcript_id, prompt_version)
+            )
+        """)
+    cur.execute(f"CREATE INDEX IF NOT EXISTS idx_{QUEUE_TABLE}_worker ON {QUEUE_TABLE} (worker_id)")
+    conn.commit()
+    cur.close()
+
+def default_worker_id():
+    """主机名-进程号-随机后缀 (同一台机器上的多个进程也能区分)"""
+    return f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+
+COMPLETE_SQL = f"DELETE FROM {QUEUE_TABLE} WHERE transcript_id = %s AND prompt_version = %s"
+# 正常结束的未完成通话不计入领取次数 (发言失败次数由断点表单独限制)
+RETRY_SQL = f"""
+    UPDATE {QUEUE_TABLE}
+    SET worker_id = NULL, lease_until = NULL, attempts = attempts - 1
+    WHERE transcript_id = %s AND prompt_version = %s
+"""
+
+class WorkQueue:
+    """
+    db: faq_db.Database；心跳线程每次从连接池借出连接
+    lease_seconds: 租约时长，心跳间隔为其 1/3；超过该时长没有 progress() 时心跳不再续期
+    时间: PostgreSQL 用数据库 NOW() (多台机器不受本地时钟偏差影响)，SQLite 用本机时间
+    """
+
+    def __init__(self, db, prompt_version, lease_seconds=300, worker_id=None):
+        self.db = db
+        self.prompt_version = prompt_version
+        self.lease_seconds = max(30, lease_seconds)
+        self.worker_id = worker_id or default_worker_id()
+        self.stats = {"enqueued": 0, "claimed": 0, "completed": 0, "retried": 0, "released": 0, "heartbeats": 0, "stalled": 0}
+        # 最近一次进展 (time.monotonic)；领取视为进展，分析循环每完成一步调用 progress()
+        self.last_progress = time.monotonic()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _lease_until(self):
+        """SQLite 写入的租约到期时间 (与 db.now() 同为 ISO 字符串，可直接比较)"""
+        return (datetime.now() + timedelta(seconds=self.lease_seconds)).isoformat()
+
+    def enqueue(self, conn, candidates_sql, params=()):
+        """
+        把候选通话写入队列 (已在队列中的跳过)，返回新入队条数
+        candidates_sql: 返回 id 列的 SELECT (按 PostgreSQL 写法，应排除已入队的通话并带 LIMIT)
+        """
+        cur = conn.cursor()
+        # SQLite 的 INSERT ... SELECT 后接 ON CONFLICT 时需要 WHERE 子句消除语法歧义
+        self.db.execute(cur, f"""
+            INSERT INTO {QUEUE_TABLE} (transcript_id, prompt_version, enqueued_at, attempts)
+            SELECT c.id, %s, %s, 0 FROM ({candidates_sql}) c
+            WHERE TRUE
+            ON CONFLICT (transcript_id, prompt_version) DO NOTHING
+        """, (self.prompt_version, self.db.now(), *params))
+        count = max(cur.rowcount, 0)
+        conn.commit()
+        cur.close()
+        self.stats["enqueued"] += count
+        return count
+
+    def purge_processed(self, conn):
+        """删除已有处理水位的队列行 (--force 运行或删除前崩溃留下的)"""
+        cur = conn.cursor()
+        self.db.execute(cur, f"""
+            DELETE FROM {QUEUE_TABLE}
+            WHERE prompt_version = %s
+              AND EXISTS (
+                    SELECT 1 FROM {PROCESSED_TABLE} p
+                    WHERE p.transcript_id = {QUEUE_TABLE}.transcript_id
+                      AND p.prompt_version = {QUEUE_TABLE}.prompt_version
+              )
+        """, (self.prompt_version,))
+        conn.commit()
+        cur.close()
+
+    def claim(self, conn, limit):
+        """领取最多 limit 条未被领取或租约已过期的通话，返回 transcript_id 列表"""
+        self.purge_processed(conn)
+        cur = conn.cursor()
+        if self.db.db_type == 'postgres':
+            cur.execute(f"""
+                UPDATE {QUEUE_TABLE} q
+                SET worker_id = %s,
+                    claimed_at = NOW(),
+                    heartbeat_at = NOW(),
+                    lease_until = NOW() + %s * INTERVAL '1 second',
+                    attempts = q.attempts + 1
+                FROM (
+                    SELECT transcript_id FROM {QUEUE_TABLE}
+                    WHERE prompt_version = %s
+                      AND (lease_until IS NULL OR lease_until < NOW())
+                      AND attempts < %s
+                    ORDER BY enqueued_at, transcript_id
+                    LIMIT %s
+                    FOR UPDATE SKIP LOCKED
+                ) c
+                WHERE q.transcript_id = c.transcript_id AND q.prompt_version = %s
+                RETURNING q.transcript_id
+            """, (self.worker_id, self.lease_seconds, self.prompt_version, MAX_ATTEMPTS, limit, self.prompt_version))
+            ids = [row[0] for row in cur.fetchall()]
+            conn.commit()
+        else:
+            # 结束隐式事务后显式取得写锁，查询与更新之间其他进程无法领取
+            conn.commit()
+            cur.execute("BEGIN IMMEDIATE")
+            try:
+                now = self.db.now()
+                cur.execute(f"""
+                    SELECT transcript_id FROM {QUEUE_TABLE}
+                    WHERE prompt_version = ?
+                      AND (lease_until IS NULL OR lease_until < ?)
+                      AND attempts < ?
+                    ORDER BY enqueued_at, transcript_id
+                    LIMIT ?
+                """, (self.prompt_version, now, MAX_ATTEMPTS, limit))
+                ids = [row[0] for row in cur.fetchall()]
+                lease_until = self._lease_until()
+                cur.executemany(f"""
+                    UPDATE {QUEUE_TABLE}
+                    SET worker_id = ?, claimed_at = ?, heartbeat_at = ?, lease_until = ?, attempts = attempts + 1
+                    WHERE transcript_id = ? AND prompt_version = ?
+                """, [(self.worker_id, now, now, lease_until, tid, self.prompt_version) for tid in ids])
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+        cur.close()
+        self.stats["claimed"] += len(ids)
+        if ids:
+            self.progress()
+        return ids
+
+    def progress(self):
+        """分析循环报告进展 (开始分析通话、完成一次 API 请求、记录发言结果)"""
+        self.last_progress = time.monotonic()
+
+    def stalled(self):
+        """超过一个租约时长没有进展: 分析循环可能已卡死"""
+        return time.monotonic() - self.last_progress > self.lease_seconds
+
+    def heartbeat(self, conn):
+        """延长本进程持有的全部租约，返回延长的行数；分析循环卡死时不续期，返回 0"""
+        if self.stalled():
+            # 不续期: 租约到期后由其他进程接手，进展恢复后继续为仍持有的行续期
+            if self.stats["stalled"] == 0:
+                print(f"⚠️ 超过 {self.lease_seconds}s 没有分析进展，停止租约续期")
+            self.stats["stalled"] += 1
+            return 0
+        cur = conn.cursor()
+        if self.db.db_type == 'postgres':
+            cur.execute(f"""
+                UPDATE {QUEUE_TABLE}
+                SET lease_until = NOW() + %s * INTERVAL '1 second', heartbeat_at = NOW()
+                WHERE worker_id = %s AND prompt_version = %s
+            """, (self.lease_seconds, self.worker_id, self.prompt_version))
+        else:
+            cur.execute(f"""
+                UPDATE {QUEUE_TABLE}
+                SET lease_until = ?, heartbeat_at = ?
+                WHERE worker_id = ? AND prompt_version = ?
+            """, (self._lease_until(), self.db.now(), self.worker_id, self.prompt_version))
+        count = max(cur.rowcount, 0)
+        conn.commit()
+        cur.close()
+        self.stats["heartbeats"] += 1
+        return count
+
+    def complete(self, writer, transcript_id):
+        """通话处理完成: 删除队列行 (在 mark_processed 之后提交，按顺序落库)"""
+        writer.submit(COMPLETE_SQL, (transcript_id, self.prompt_version), transcript_id)
+        self.stats["completed"] += 1
+
+    def retry(self, writer, transcript_id):
+        """通话未完成 (有发言待重试): 释放租约，之后的领取可以再次处理"""
+        writer.submit(RETRY_SQL, (transcript_id, self.prompt_version), transcript_id)
+        self.stats["retried"] += 1
+
+    def discard(self, conn, transcript_ids):
+        """删除已领取但通话记录已不存在的队列行"""
+        if not transcript_ids:
+            return
+        cur = conn.cursor()
+        self.db.executemany(cur, COMPLETE_SQL, [(tid, self.prompt_version) for tid in transcript_ids])
+        conn.commit()
+        cur.close()
+
+    def release(self, conn):
+        """释放本进程尚未完成的租约 (正常退出不计入领取次数)，返回释放行数"""
+        cur = conn.cursor()
+        self.db.execute(cur, f"""
+            UPDATE {QUEUE_TABLE}
+            SET worker_id = NULL, lease_until = NULL, attempts = attempts - 1
+            WHERE worker_id = %s AND prompt_version = %s
+        """, (self.worker_id, self.prompt_version))
+        count = max(cur.rowcount, 0)
+        conn.commit()
+        cur.close()
+        self.stats["released"] += count
+        return count
+
+    def start(self):
+        """启动心跳线程 (可重复调用)"""
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="faq-lease-heartbeat", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """停止心跳线程"""
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+    def _run(self):
+        interval = self.lease_seconds / 3
+        while not self._stop.wait(interval):
+            try:
+                conn = self.db.getconn()
+            except Exception as e:
+                print(f"⚠️ 租约心跳失败 (无法获取连接): {e}")
+                continue
+            try:
+                self.heartbeat(conn)
+            except Exception as e:
+                conn.rollback()
+                print(f"⚠️ 租约心跳失败: {e}")
+            finally:
+                self.db.putconn(conn)
+
+    def summary(self):
+        s = self.stats
+        return (f"入队 {s['enqueued']} | 领取 {s['claimed']} | 完成 {s['completed']} | "
+                f"待重试 {s['retried']} | 释放 {s['released']} | 心跳 {s['heartbeats']} 次 | "
+                f"停止续期 {s['stalled']} 次 | worker {self.worker_id}")
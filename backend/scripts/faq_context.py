@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+按 Token 预算截取的对话上下文
+原来的上下文固定保留最近 20 句: 一段销售长篇介绍会让 Prompt 暴涨，而 20 句 "嗯" 又没有任何信息量。
+这里改为:
+- 语气词、寒暄、报号码等填充发言 (与客户发言的噪音过滤规则相同) 不进入上下文
+- 其余发言按顺序进入 deque，累计 Token 超过预算时从最早的发言开始裁剪 (至少保留最近一句)
+- 每次运行统计 user 消息大小的分布，便于调整预算
+上下文升级模式 (--escalate) 先只带最近几句上下文分类，指代前文的发言 (looks_referential) 直接使用完整上下文
+"""
+
+import re
+from collections import deque
+from llm_rate_limiter import estimate_tokens
+
+# 指代前文的说法: "那怎么弄呢"、"这个多少钱"、"刚才说的那个" 这类发言离开上下文无法判断
+# 只认句首的指示代词 ("你们那个材料"、"我这边" 中的 那个/这边 多为口头禅) 与明确回指前文的说法
+LEADING_DEMONSTRATIVE = re.compile(r"^[那这](个|样|种|些|么|款|块|次)|^那(怎么|为什么|还|就|要|得|你们|我)|^它")
+BACK_REFERENCE = re.compile(r"(刚才|刚刚|上面|前面|之前|你)(说|讲|提)的")
+# 省略主语的短追问: "多久呢"、"然后呢"、"为什么啊"、"贵吗" ("能开发票吗" 这类完整的问句不算)
+ELLIPTICAL_QUESTION = re.compile(r"^(然后|还有|为什么|怎么说|怎么办|是吗|真的)|呢$|^.{1,2}[吗嘛]$")
+REFERENTIAL_MAX_CHARS = 5
+
+def looks_referential(text):
+    """发言是否很可能指代前文 (句首指示代词、回指前文，或很短的省略式追问)"""
+    clean_text = re.sub(r'[。，！？、\.,;!?\s啊呀哈]+$', '', re.sub(r'[。，！？、\.,;!?\s]', '', text))
+    if LEADING_DEMONSTRATIVE.search(clean_text) or BACK_REFERENCE.search(clean_text):
+        return True
+    return len(clean_text) <= REFERENTIAL_MAX_CHARS and bool(ELLIPTICAL_QUESTION.search(clean_text))
+
+class ContextWindow:
+    """
+    滑动上下文窗口: push 对话行，超出 budget (估算 Token) 时从最早的行开始丢弃
+    记录每行在渲染后对话中的位置，start() 即上下文区间的起点
+    """
+
+    def __init__(self, budget=400):
+        self.budget = max(1, budget)
+        self.turns = deque()
+        self.tokens = 0
+
+    def push(self, index, line):
+        tokens = estimate_tokens(line)
+        self.turns.append((index, line, tokens))
+        self.tokens += tokens
+        while len(self.turns) > 1 and self.tokens > self.budget:
+            self.tokens -= self.turns.popleft()[2]
+
+    def start(self, default):
+        """窗口中最早一行的位置 (窗口为空时返回 default)"""
+        return self.turns[0][0] if self.turns else default
+
+    def recent_start(self, turns, default):
+        """最近 turns 行中最早一行的位置 (turns=0 或窗口为空时返回 default)"""
+        if turns <= 0 or not self.turns:
+            return default
+        return self.turns[-min(turns, len(self.turns))][0]
+
+    def lines(self):
+        return [line for _, line, _ in self.turns]
+
+class PromptSizeHistogram:
+    """user 消息大小 (估算 Token) 的分布统计"""
+
+    BOUNDS = (100, 200, 400, 800, 1600)
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BOUNDS) + 1)
+        self.total = 0
+        self.largest = 0
+
+    def add(self, tokens):
+        for i, bound in enumerate(self.BOUNDS):
+            if tokens < bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.total += tokens
+        self.largest = max(self.largest, tokens)
+
+    def summary(self):
+        calls = sum(self.counts)
+        if not calls:
+            return "无"
+        labels = [f"<{b}" for b in self.BOUNDS] + [f"≥{self.BOUNDS[-1]}"]
+        buckets = " ".join(f"{label}:{count}" for label, count in zip(labels, self.counts) if count)
+        return f"{buckets} | 平均 {self.total / calls:.0f} | 最大 {self.largest}"
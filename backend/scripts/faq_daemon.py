@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+常驻模式 (analyze_faq_ci.py --daemon) 的新通话检测
+- 水位: 每轮读取 MAX(sync_transcripts.created_at) (created_at 索引，O(1))，
+  积压处理完之后只查询 created_at >= 上一轮水位 的新通话，不再扫描全表
+- LISTEN/NOTIFY (仅 PostgreSQL，--listen): 在 sync_transcripts 上安装语句级触发器，
+  新通话写入时立即唤醒轮询；需要直连或 Session 模式连接池 (Transaction 模式不支持 LISTEN)
+- SQLite 只用定时轮询，便于本地测试
+"""
+
+import asyncio
+
+NOTIFY_CHANNEL = "faq_new_transcript"
+
+def ensure_watch_index(conn, db_type):
+    """sync_transcripts.created_at 索引 (水位查询与增量过滤使用)"""
+    cur = conn.cursor()
+    try:
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_sync_transcripts_created_at ON sync_transcripts (created_at)")
+        conn.commit()
+    except Exception as e:
+        # 大表首次建索引可能超过 statement_timeout，不影响正确性，只是水位查询变慢
+        conn.rollback()
+        print(f"⚠️ 无法创建 sync_transcripts.created_at 索引: {e}")
+    cur.close()
+
+def install_notify_trigger(conn):
+    """PostgreSQL: 新通话写入后 NOTIFY (语句级触发，批量同步时每条语句只通知一次)"""
+    cur = conn.cursor()
+    cur.execute(f"""
+        CREATE OR REPLACE FUNCTION faq_notify_new_transcript() RETURNS trigger AS $$
+        BEGIN
+            PERFORM pg_notify('{NOTIFY_CHANNEL}', '');
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+    """)
+    cur.execute("DROP TRIGGER IF EXISTS faq_notify_new_transcript ON sync_transcripts")
+    cur.execute("""
+        CREATE TRIGGER faq_notify_new_transcript
+        AFTER INSERT ON sync_transcripts
+        FOR EACH STATEMENT EXECUTE FUNCTION faq_notify_new_transcript()
+    """)
+    conn.commit()
+    cur.close()
+
+class TranscriptWatcher:
+    """
+    db: faq_db.Database；listen=True 时 (仅 PostgreSQL) 从连接池借出一个 autocommit 连接 LISTEN
+    start() 需在事件循环中调用
+    """
+
+    def __init__(self, db, conn, listen=False):
+        self.db = db
+        self.conn = conn
+        self.listen = listen and db.db_type == 'postgres'
+        self.listen_conn = None
+        self.wakeup = None
+        self.notifications = 0
+
+    def start(self):
+        self.wakeup = asyncio.Event()
+        if not self.listen:
+            return
+        install_notify_trigger(self.conn)
+        self.listen_conn = self.db.getconn()
+        self.listen_conn.autocommit = True
+        cur = self.listen_conn.cursor()
+        cur.execute(f"LISTEN {NOTIFY_CHANNEL}")
+        cur.close()
+        asyncio.get_running_loop().add_reader(self.listen_conn.fileno(), self._on_readable)
+
+    def _on_readable(self):
+        self.listen_conn.poll()
+        if self.listen_conn.notifies:
+            self.notifications += len(self.listen_conn.notifies)
+            self.listen_conn.notifies.clear()
+            self.wakeup.set()
+
+    def latest(self):
+        """当前最新的 created_at (空表返回 None)"""
+        cur = self.conn.cursor()
+        cur.execute("SELECT MAX(created_at) FROM sync_transcripts")
+        row = cur.fetchone()
+        cur.close()
+        return row[0] if row else None
+
+    async def wait(self, timeout, stop):
+        """等待下一轮: 超时、收到 NOTIFY 或 stop 被设置时返回"""
+        waiters = [asyncio.ensure_future(self.wakeup.wait()), asyncio.ensure_future(stop.wait())]
+        try:
+            await asyncio.wait(waiters, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for w in waiters:
+                w.cancel()
+        self.wakeup.clear()
+
+    def close(self):
+        if self.listen_conn is None:
+            return
+        asyncio.get_running_loop().remove_reader(self.listen_conn.fileno())
+        self.listen_conn.autocommit = False
+        self.db.putconn(self.listen_conn)
+        self.listen_conn = None
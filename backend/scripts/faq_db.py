@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+"""
+数据库访问层 (PostgreSQL / SQLite)
+- 连接池: PostgreSQL 用 psycopg2 ThreadedConnectionPool，SQLite 用同等语义的连接队列，
+  取连接时超出上限会阻塞等待，分析循环、缓存和后台写入线程共用一个池，不再各自新建连接
+- 方言转换缓存: SQL 统一按 PostgreSQL 写法 (%s 占位符、ON CONFLICT ... EXCLUDED)，
+  首次使用时转换为当前方言 (SQLite 为 ? 占位符) 并按文本缓存，只省去重复的字符串替换；
+  不是服务端预编译，PostgreSQL 每次仍发送完整语句。SQLite 连接自身按语句文本缓存编译结果
+  (cached_statements)，相同文本的语句在同一连接上不会重复解析
+- 批量操作: PostgreSQL 用 execute_batch 合并往返，SQLite 用 executemany，整批一个事务
+- 本地 SQLite 调优: WAL 日志 (分析写入时 Next.js 看板仍可并发读取)、synchronous=NORMAL、
+  更大的页缓存与 mmap，配合批量事务，本地全量实验的写入不再受每次 fsync 限制
+SQLite 的 UPSERT 语法需要 3.24+
+"""
+
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+
+try:
+    import psycopg2
+    from psycopg2.pool import ThreadedConnectionPool
+    from psycopg2.extras import RealDictCursor, execute_batch
+    PSYCOPG2_AVAILABLE = True
+except ImportError:
+    PSYCOPG2_AVAILABLE = False
+
+# 与 CI 任务一致: 60 秒语句超时，避免复杂查询被过早取消
+PG_OPTIONS = "-c statement_timeout=60000"
+
+# 本地高吞吐模式: WAL 下 synchronous=NORMAL 只在检查点时 fsync，断电最多丢失最近的已提交事务，不会损坏数据库
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "cache_size": -65536,       # 负数单位为 KiB，即 64 MiB 页缓存
+    "mmap_size": 268435456,     # 256 MiB 内存映射读取
+    "temp_store": "MEMORY",
+    "busy_timeout": 5000,       # 与看板等其他连接争用写锁时最多等待 5 秒
+}
+
+def is_postgres_url(db_url):
+    return db_url.startswith("postgres://") or db_url.startswith("postgresql://")
+
+def connect_sqlite(path, tuned=True, **kwargs):
+    """打开 SQLite 连接，tuned 时应用 SQLITE_PRAGMAS (WAL 模式写入数据库文件，之后所有连接生效)"""
+    conn = sqlite3.connect(path, **kwargs)
+    if tuned:
+        for name, value in SQLITE_PRAGMAS.items():
+            conn.execute(f"PRAGMA {name} = {value}")
+    return conn
+
+class TransactionBatcher:
+    """每累计 every 次写入提交一次事务 (本地逐句写日志时避免每行一次 fsync)"""
+
+    def __init__(self, conn, every=200):
+        self.conn = conn
+        self.every = max(1, every)
+        self.pending = 0
+        self.commits = 0
+
+    def tick(self, count=1):
+        self.pending += count
+        if self.pending >= self.every:
+            self.commit()
+
+    def commit(self):
+        self.conn.commit()
+        self.pending = 0
+        self.commits += 1
+
+class Database:
+    """
+    db_url: PostgreSQL URL 或 SQLite 文件路径
+    max_connections: 连接池上限 (同时借出的连接数)
+    sqlite_tuned: SQLite 连接是否应用 SQLITE_PRAGMAS
+    """
+
+    def __init__(self, db_url, max_connections=4, sqlite_tuned=True):
+        self.db_url = db_url
+        self.sqlite_tuned = sqlite_tuned
+        self.db_type = 'postgres' if is_postgres_url(db_url) else 'sqlite'
+        self.placeholder = '%s' if self.db_type == 'postgres' else '?'
+        self.max_connections = max(1, max_connections)
+        self._slots = threading.BoundedSemaphore(self.max_connections)
+        self._dialect_sql = {}
+        self._closed = False
+        if self.db_type == 'postgres':
+            if not PSYCOPG2_AVAILABLE:
+                raise RuntimeError("PostgreSQL URL 需要安装 psycopg2-binary")
+            self._pool = ThreadedConnectionPool(1, self.max_connections, db_url,
+                                                sslmode='require', options=PG_OPTIONS)
+        else:
+            self._idle = queue.LifoQueue()
+            self._idle.put(self._connect_sqlite())
+
+    def _connect_sqlite(self):
+        # 连接可能由后台写入线程借用，关闭同线程检查；同一时刻只有借出者在使用
+        conn = connect_sqlite(self.db_url, self.sqlite_tuned, check_same_thread=False, cached_statements=256)
+        # sqlite3.Row 同时支持下标和列名访问，与 RealDictCursor 的读取方式一致
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def getconn(self):
+        """借出一个连接 (池满时阻塞)，用完必须 putconn 归还"""
+        if self._closed:
+            raise RuntimeError("Database 已关闭")
+        self._slots.acquire()
+        try:
+            if self.db_type == 'postgres':
+                return self._pool.getconn()
+            try:
+                return self._idle.get_nowait()
+            except queue.Empty:
+                return self._connect_sqlite()
+        except Exception:
+            self._slots.release()
+            raise
+
+    def putconn(self, conn):
+        """归还连接 (未提交的事务会被回滚)"""
+        try:
+            if self.db_type == 'postgres':
+                self._pool.putconn(conn)
+            elif self._closed:
+                conn.close()
+            else:
+                conn.rollback()
+                self._idle.put(conn)
+        finally:
+            self._slots.release()
+
+    @contextmanager
+    def connection(self):
+        """借出连接，正常退出时提交，异常时回滚"""
+        conn = self.getconn()
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            self.putconn(conn)
+
+    def cursor(self, conn, dict_rows=False, name=None):
+        """
+        创建游标: dict_rows 时 PostgreSQL 返回 RealDictCursor (SQLite 的行本身可按列名读取)
+        name 仅对 PostgreSQL 生效，创建命名 (服务端) 游标用于流式读取
+        """
+        if self.db_type == 'sqlite':
+            return conn.cursor()
+        factory = RealDictCursor if dict_rows else None
+        if name:
+            return conn.cursor(name=name, cursor_factory=factory)
+        return conn.cursor(cursor_factory=factory)
+
+    def translate(self, sql):
+        """把 PostgreSQL 写法的 SQL 转换为当前方言 (按文本缓存转换结果，不做预编译)"""
+        cached = self._dialect_sql.get(sql)
+        if cached is None:
+            cached = sql
+            if self.db_type == 'sqlite':
+                cached = sql.replace("%%", "\0").replace("%s", "?").replace("\0", "%")
+            self._dialect_sql[sql] = cached
+        return cached
+
+    def execute(self, cur, sql, params=()):
+        cur.execute(self.translate(sql), params)
+        return cur
+
+    def executemany(self, cur, sql, rows, page_size=200):
+        """批量执行同一条语句 (由调用方提交事务)"""
+        if self.db_type == 'postgres':
+            execute_batch(cur, self.translate(sql), rows, page_size=page_size)
+        else:
+            cur.executemany(self.translate(sql), rows)
+
+    def now(self):
+        """当前时间的写入值: PostgreSQL 为 datetime，SQLite 为 ISO 字符串"""
+        now = datetime.now()
+        return now if self.db_type == 'postgres' else now.isoformat()
+
+    def close(self):
+        """关闭池中所有空闲连接 (借出中的连接在归还时关闭)"""
+        if self._closed:
+            return
+        self._closed = True
+        if self.db_type == 'postgres':
+            self._pool.closeall()
+            return
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
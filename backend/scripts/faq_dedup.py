@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+近似重复发言去重 (MinHash + LSH)
+客户的说法在不同通话中高度重复 ("那你们保修几年啊" 有无数变体)，
+对规范化后的文本按字符 n-gram 计算 MinHash 签名，用 LSH 分桶快速找到近似重复，
+同一组 (且上下文签名相同) 只需分类一次代表发言，其余成员直接复用结果
+"""
+
+import re
+import zlib
+import random
+import unicodedata
+
+DEDUP_PROMPT_ID = "faq_v3_dedup"
+
+# 口语填充词: 不影响语义，规范化时去除
+FILLERS = ["就是说", "那个", "然后", "嗯", "啊", "呀", "哦", "噢", "呃", "额", "诶", "哎", "嘛", "哈"]
+FILLER_PATTERN = re.compile("|".join(map(re.escape, FILLERS)))
+# 句首承接词 ("那你们..."、"所以...") 同样不影响语义
+LEADING_PATTERN = re.compile(r"^(那么|那|所以|就是)")
+PUNCT_PATTERN = re.compile(r"[\s\W_]+", re.UNICODE)
+
+# 指代/省略型发言 ("贵吗？"、"那怎么弄呢") 的含义依赖上文，去重时需要带上上下文签名
+REFERENTIAL_PATTERN = re.compile(r"它|这个|那个|这样|那样|这种|那种|刚才|上面|你说的")
+MIN_STANDALONE_LENGTH = 6
+
+MERSENNE_PRIME = (1 << 61) - 1
+
+def normalize_text(text):
+    """规范化: 全角转半角 (NFKC)、去标点空白、去口语填充词和句首承接词"""
+    text = unicodedata.normalize("NFKC", text).lower()
+    text = FILLER_PATTERN.sub("", text)
+    text = PUNCT_PATTERN.sub("", text)
+    return LEADING_PATTERN.sub("", text)
+
+def context_signature(text, previous_line):
+    """
+    上下文签名: 独立成句的发言与上下文无关 (签名为空)，
+    指代或过短的发言以规范化后的上一句作为签名，避免不同语境的 "贵吗" 被合并
+    """
+    if len(normalize_text(text)) >= MIN_STANDALONE_LENGTH and not REFERENTIAL_PATTERN.search(text):
+        return ""
+    return normalize_text(previous_line or "")
+
+def shingles(text, n=2):
+    """字符 n-gram 集合 (文本短于 n 时整体作为一个 shingle)"""
+    if len(text) <= n:
+        return {text}
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+class MinHasher:
+    """固定种子的 MinHash，签名长度 = bands × rows"""
+
+    def __init__(self, bands=16, rows=4, seed=42):
+        self.bands = bands
+        self.rows = rows
+        rng = random.Random(seed)
+        self.params = [(rng.randrange(1, MERSENNE_PRIME), rng.randrange(0, MERSENNE_PRIME))
+                       for _ in range(bands * rows)]
+
+    def signature(self, grams):
+        hashes = [zlib.crc32(g.encode("utf-8")) for g in grams]
+        return tuple(min((a * h + b) % MERSENNE_PRIME for h in hashes) for a, b in self.params)
+
+    def band_keys(self, signature):
+        r = self.rows
+        return [(i, hash(signature[i * r:(i + 1) * r])) for i in range(self.bands)]
+
+    @staticmethod
+    def similarity(sig_a, sig_b):
+        """由签名估计 Jaccard 相似度"""
+        return sum(1 for a, b in zip(sig_a, sig_b) if a == b) / len(sig_a)
+
+class NearDuplicateIndex:
+    """
+    运行期内的近似重复索引
+    lookup() 找到相似度达到阈值、且上下文签名相同的代表条目，add() 登记新的代表
+    条目内容由调用方决定 (例如代表发言的分类结果 Future)
+    """
+
+    def __init__(self, threshold=0.8, bands=16, rows=4):
+        self.threshold = threshold
+        self.hasher = MinHasher(bands, rows)
+        self.exact = {}
+        self.buckets = {}
+        self.stats = {"lookups": 0, "exact_hits": 0, "near_hits": 0, "groups": 0}
+
+    def _key(self, text):
+        norm = normalize_text(text)
+        signature = self.hasher.signature(shingles(norm)) if len(norm) >= 2 else None
+        return norm, signature
+
+    def lookup(self, text, context_sig=""):
+        """返回 (entry 或 None, key)，key 用于随后的 add()"""
+        self.stats["lookups"] += 1
+        norm, signature = key = self._key(text)
+        entry = self.exact.get((context_sig, norm))
+        if entry is not None:
+            self.stats["exact_hits"] += 1
+            return entry, key
+        if signature is None:
+            return None, key
+
+        best, best_sim = None, 0.0
+        seen = set()
+        for band in self.hasher.band_keys(signature):
+            for candidate_sig, candidate in self.buckets.get((context_sig, band), []):
+                if id(candidate) in seen:
+                    continue
+                seen.add(id(candidate))
+                sim = MinHasher.similarity(signature, candidate_sig)
+                if sim >= self.threshold and sim > best_sim:
+                    best, best_sim = candidate, sim
+        if best is not None:
+            self.stats["near_hits"] += 1
+        return best, key
+
+    def add(self, key, entry, context_sig=""):
+        """登记新的代表条目"""
+        norm, signature = key
+        self.stats["groups"] += 1
+        self.exact[(context_sig, norm)] = entry
+        if signature is not None:
+            for band in self.hasher.band_keys(signature):
+                self.buckets.setdefault((context_sig, band), []).append((signature, entry))
+
+    def reset(self):
+        """清空索引 (保留统计)，常驻进程定期调用以限制内存"""
+        self.exact = {}
+        self.buckets = {}
+
+    def summary(self):
+        s = self.stats
+        hits = s["exact_hits"] + s["near_hits"]
+        rate = hits / s["lookups"] * 100 if s["lookups"] else 0
+        return (f"去重复用 {hits}/{s['lookups']} 句 ({rate:.1f}%) | 完全相同 {s['exact_hits']} | "
+                f"近似 {s['near_hits']} | 代表组 {s['groups']}")
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""
+通话记录 → 通话关联表 (biz_transcript_call_link)
+sync_transcripts 与 biz_calls 只能通过 audio_url 长字符串关联，且 biz_calls.audio_url 没有索引，
+每次运行做 LEFT JOIN 的耗时随两张表一起增长，容易触发 statement_timeout。
+这里把关联结果预先算好存表 (主键 transcript_id)，分析查询只按主键关联:
+- PostgreSQL: biz_calls 上建 md5(audio_url) 表达式索引，新通话按哈希走索引查找对应的 call
+- SQLite: 直接在 biz_calls.audio_url 上建索引 (本地库不存在超时问题)
+每次分析前增量补齐新通话与尚未匹配到 call 的记录；首次全量回填可单独运行本脚本
+
+使用方式:
+  python scripts/faq_linkage.py              # 增量补齐 (首次运行即全量回填)
+  python scripts/faq_linkage.py --rebuild    # 清空后重建 (audio_url 被修改过时使用)
+"""
+
+import hashlib
+import argparse
+
+LINK_TABLE = "biz_transcript_call_link"
+
+def _md5(value):
+    return hashlib.md5(value.encode("utf-8")).hexdigest() if value is not None else None
+
+def ensure_linkage_schema(conn, db_type):
+    """创建关联表与 biz_calls 上的 audio_url 查找索引"""
+    cur = conn.cursor()
+    if db_type == 'postgres':
+        cur.execute(f"""
+            CREATE TABLE IF NOT EXISTS {LINK_TABLE} (
+                transcript_id TEXT PRIMARY KEY,
+                call_id TEXT,
+                audio_url_hash TEXT,
+                linked_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+            )
+        """)
+        conn.commit()
+        try:
+            cur.execute("CREATE INDEX IF NOT EXISTS idx_biz_calls_audio_url_md5 ON biz_calls (md5(audio_url))")
+            conn.commit()
+        except Exception as e:
+            # 大表首次建索引可能超过 statement_timeout，改为单独运行本脚本 (不设超时) 完成
+            conn.rollback()
+            print(f"⚠️ 无法创建 biz_calls.audio_url 哈希索引，请运行 scripts/faq_linkage.py: {e}")
+    else:
+        cur.execute(f"""
+            CREATE TABLE IF NOT EXISTS {LINK_TABLE} (
+                transcript_id TEXT PRIMARY KEY,
+                call_id TEXT,
+                audio_url_hash TEXT,
+                linked_at TEXT DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_biz_calls_audio_url ON biz_calls (audio_url)")
+        conn.commit()
+    cur.close()
+
+def _link_new(cur, db_type, batch_size):
+    """为尚未建立关联的通话写入一批关联行，返回写入行数"""
+    if db_type == 'postgres':
+        cur.execute(f"""
+            INSERT INTO {LINK_TABLE} (transcript_id, call_id, audio_url_hash, linked_at)
+            SELECT t.id,
+                   (SELECT c.id FROM biz_calls c
+                    WHERE md5(c.audio_url) = md5(t.audio_url)
+                    ORDER BY c.id LIMIT 1),
+                   md5(t.audio_url),
+                   NOW()
+            FROM sync_transcripts t
+            WHERE NOT EXISTS (SELECT 1 FROM {LINK_TABLE} l WHERE l.transcript_id = t.id)
+            LIMIT %s
+            ON CONFLICT (transcript_id) DO NOTHING
+        """, (batch_size,))
+    else:
+        cur.execute(f"""
+            INSERT OR IGNORE INTO {LINK_TABLE} (transcript_id, call_id, audio_url_hash, linked_at)
+            SELECT t.id,
+                   (SELECT c.id FROM biz_calls c
+                    WHERE c.audio_url = t.audio_url
+                    ORDER BY c.id LIMIT 1),
+                   faq_md5(t.audio_url),
+                   datetime('now')
+            FROM sync_transcripts t
+            WHERE NOT EXISTS (SELECT 1 FROM {LINK_TABLE} l WHERE l.transcript_id = t.id)
+            LIMIT ?
+        """, (batch_size,))
+    return max(cur.rowcount, 0)
+
+def _relink_unmatched(cur, db_type):
+    """通话先于 call 同步时关联为空，call 入库后补上，返回更新行数"""
+    if db_type == 'postgres':
+        cur.execute(f"""
+            UPDATE {LINK_TABLE} l
+            SET call_id = c.id, linked_at = NOW()
+            FROM biz_calls c
+            WHERE l.call_id IS NULL
+              AND l.audio_url_hash IS NOT NULL
+              AND md5(c.audio_url) = l.audio_url_hash
+        """)
+    else:
+        cur.execute(f"""
+            UPDATE {LINK_TABLE}
+            SET call_id = (
+                    SELECT c.id FROM sync_transcripts t
+                    JOIN biz_calls c ON c.audio_url = t.audio_url
+                    WHERE t.id = {LINK_TABLE}.transcript_id
+                    ORDER BY c.id LIMIT 1
+                ),
+                linked_at = datetime('now')
+            WHERE call_id IS NULL
+              AND audio_url_hash IS NOT NULL
+              AND EXISTS (
+                    SELECT 1 FROM sync_transcripts t
+                    JOIN biz_calls c ON c.audio_url = t.audio_url
+                    WHERE t.id = {LINK_TABLE}.transcript_id
+              )
+        """)
+    return max(cur.rowcount, 0)
+
+def update_linkage(conn, db_type, batch_size=5000):
+    """
+    增量维护关联表: 新通话按批写入 (每批一个事务，单条语句不会因表大而超时)，
+    再补齐之前未匹配到 call 的记录。返回 (新增, 补齐)
+    """
+    if db_type == 'sqlite':
+        conn.create_function("faq_md5", 1, _md5)
+    cur = conn.cursor()
+    added = 0
+    while True:
+        count = _link_new(cur, db_type, batch_size)
+        conn.commit()
+        added += count
+        if count < batch_size:
+            break
+    relinked = _relink_unmatched(cur, db_type)
+    conn.commit()
+    cur.close()
+    return added, relinked
+
+def rebuild_linkage(conn):
+    """清空关联表 (之后由 update_linkage 全量重建)"""
+    cur = conn.cursor()
+    cur.execute(f"DELETE FROM {LINK_TABLE}")
+    conn.commit()
+    cur.close()
+
+def main():
+    from analyze_faq_ci import DATABASE_URL, get_db_connection
+
+    parser = argparse.ArgumentParser(description="回填/增量维护 通话记录 → 通话 关联表")
+    parser.add_argument("--batch-size", type=int, default=5000, help="每批关联的通话数 (默认 5000)")
+    parser.add_argument("--rebuild", action="store_true", help="清空后全量重建")
+    args = parser.parse_args()
+
+    db = get_db_connection(DATABASE_URL, max_connections=1)
+    db_type = db.db_type
+    with db.connection() as conn:
+        if db_type == 'postgres':
+            # 一次性维护任务: 建索引与全量回填不受 CI 的 60 秒语句超时限制
+            cur = conn.cursor()
+            cur.execute("SET statement_timeout = 0")
+            cur.close()
+        ensure_linkage_schema(conn, db_type)
+        if args.rebuild:
+            rebuild_linkage(conn)
+            print(f"🧹 已清空 {LINK_TABLE}")
+        added, relinked = update_linkage(conn, db_type, max(1, args.batch_size))
+    db.close()
+    print(f"🔗 关联表已更新: 新增 {added} 条 | 补齐 call {relinked} 条")
+
+if __name__ == "__main__":
+    main()
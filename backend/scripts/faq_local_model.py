@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+"""
+本地字符 n-gram 分类器 (从历史 LLM 日志训练)
+log_prompt_execution 中已有大量 LLM 标注: input_variables 记录客户发言，raw_output 记录分类 JSON。
+训练命令把这些发言按字符 1~3-gram 哈希到固定维度的稀疏特征，训练多分类逻辑回归 (纯 Python SGD，
+特征稀疏、每句只有几十个非零维，不需要 NumPy / GPU)，模型带版本号保存在磁盘上。
+分析时作为级联的一层: 概率达到阈值的发言直接采用本地结果 (prompt_id = faq_v3_local)，
+其余 (以及指代前文的发言) 仍交给 hunyuan-lite。
+训练集按发言文本哈希固定划分出 10% 留出集，报告本地模型与 LLM 结果的一致率 (按置信度阈值分档)
+
+使用方式:
+  python scripts/faq_local_model.py                  # 训练并保存新版本 (models/LATEST 指向最新版本)
+  python scripts/faq_local_model.py --epochs 8 --min-examples 1000
+"""
+
+import os
+import re
+import json
+import gzip
+import math
+import zlib
+import random
+import argparse
+import unicodedata
+from datetime import datetime
+from faq_prompts import PROMPT_VERSION, CATEGORIES
+from faq_output import extract_json, parse_category, OutputParseError
+from faq_log_format import decode_input
+
+LOCAL_MODEL_PROMPT_ID = "faq_v3_local"
+MODEL_FORMAT = 1
+MODEL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "models")
+FEATURE_BUCKETS = 1 << 18
+NGRAM_RANGE = (1, 3)
+HOLDOUT_PERCENT = 10
+REPORT_THRESHOLDS = (0.5, 0.7, 0.8, 0.9, 0.95)
+
+# 训练数据来源: LLM 分类日志 (CI 与本地脚本)；规则、去重与本地模型自身的日志不参与训练
+TRAINING_PROMPT_IDS = ("faq_v3_ci", "faq_classification")
+# 旧格式日志 input_variables 为完整 user 消息，从中取出当前客户发言
+LEGACY_TARGET_PATTERN = re.compile(r'## 当前客户发言：\s*"(.*)"\s*$', re.S)
+
+def normalize(text):
+    """全角转半角、小写、去空白 (保留标点: 问号是有效特征)"""
+    return re.sub(r"\s+", "", unicodedata.normalize("NFKC", text).lower())
+
+def features(text):
+    """字符 n-gram 哈希特征 {bucket: 权重}，按 L2 归一化"""
+    padded = f"^{normalize(text)}$"
+    counts = {}
+    for n in range(NGRAM_RANGE[0], NGRAM_RANGE[1] + 1):
+        for i in range(len(padded) - n + 1):
+            bucket = zlib.crc32(padded[i:i + n].encode("utf-8")) % FEATURE_BUCKETS
+            counts[bucket] = counts.get(bucket, 0) + 1
+    norm = math.sqrt(sum(v * v for v in counts.values())) or 1.0
+    return {k: v / norm for k, v in counts.items()}
+
+def softmax(scores):
+    top = max(scores)
+    exps = [math.exp(s - top) for s in scores]
+    total = sum(exps)
+    return [e / total for e in exps]
+
+class NGramModel:
+    """稀疏多分类逻辑回归: weights 只保存训练中出现过的特征桶"""
+
+    def __init__(self, categories, weights=None, bias=None, meta=None):
+        self.categories = list(categories)
+        self.weights = weights or {}
+        self.bias = bias or [0.0] * len(self.categories)
+        self.meta = meta or {}
+
+    @property
+    def version(self):
+        return self.meta.get("version", "unversioned")
+
+    def probabilities(self, feats):
+        scores = list(self.bias)
+        for bucket, value in feats.items():
+            row = self.weights.get(bucket)
+            if row is not None:
+                for k, w in enumerate(row):
+                    scores[k] += w * value
+        return softmax(scores)
+
+    def predict(self, text):
+        """返回 (分类, 概率)"""
+        probs = self.probabilities(features(text))
+        best = max(range(len(probs)), key=probs.__getitem__)
+        return self.categories[best], probs[best]
+
+    def fit(self, examples, epochs=6, learning_rate=0.5, l2=1e-6, seed=42):
+        """examples: [(文本, 分类)]，SGD 逐样本更新 (学习率按轮次衰减)"""
+        index = {c: i for i, c in enumerate(self.categories)}
+        data = [(features(text), index[label]) for text, label in examples]
+        rng = random.Random(seed)
+        size = len(self.categories)
+        for epoch in range(epochs):
+            rng.shuffle(data)
+            rate = learning_rate / (1 + epoch)
+            shrink = 1 - rate * l2
+            for feats, label in data:
+                probs = self.probabilities(feats)
+                grads = [p - (1.0 if k == label else 0.0) for k, p in enumerate(probs)]
+                for k in range(size):
+                    self.bias[k] -= rate * grads[k]
+                for bucket, value in feats.items():
+                    row = self.weights.get(bucket)
+                    if row is None:
+                        row = self.weights[bucket] = [0.0] * size
+                    for k in range(size):
+                        row[k] = row[k] * shrink - rate * grads[k] * value
+        return self
+
+    def save(self, model_dir=MODEL_DIR):
+        """保存为 <version>.json.gz，并把 LATEST 指向该版本，返回文件路径"""
+        os.makedirs(model_dir, exist_ok=True)
+        weights = {str(b): [round(w, 5) for w in row] for b, row in self.weights.items()
+                   if max(abs(w) for w in row) >= 1e-4}
+        payload = {"format": MODEL_FORMAT, "meta": self.meta, "categories": self.categories,
+                   "buckets": FEATURE_BUCKETS, "ngram": list(NGRAM_RANGE),
+                   "bias": self.bias, "weights": weights}
+        path = os.path.join(model_dir, f"{self.version}.json.gz")
+        with gzip.open(path, "wt", encoding="utf-8") as f:
+            json.dump(payload, f, ensure_ascii=False, separators=(",", ":"))
+        with open(os.path.join(model_dir, "LATEST"), "w", encoding="utf-8") as f:
+            f.write(os.path.basename(path))
+        return path
+
+    @classmethod
+    def load(cls, path="latest", model_dir=MODEL_DIR):
+        """path 为模型文件或 "latest" (读取 model_dir/LATEST)"""
+        if path == "latest":
+            with open(os.path.join(model_dir, "LATEST"), "r", encoding="utf-8") as f:
+                path = os.path.join(model_dir, f.read().strip())
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            payload = json.load(f)
+        if (payload.get("format") != MODEL_FORMAT or payload.get("buckets") != FEATURE_BUCKETS
+                or tuple(payload.get("ngram", ())) != NGRAM_RANGE):
+            raise ValueError(f"模型格式与当前特征配置不一致: {path}")
+        weights = {int(b): row for b, row in payload["weights"].items()}
+        return cls(payload["categories"], weights, payload["bias"], payload.get("meta"))
+
+class LocalClassifier:
+    """级联中的本地模型层，decide() 在概率达到 threshold 时返回分类，否则返回 None (交给 LLM)"""
+
+    def __init__(self, model, threshold=0.9):
+        self.model = model
+        self.threshold = threshold
+        self.stats = {"total": 0, "decided": 0}
+
+    @property
+    def version(self):
+        return self.model.version
+
+    def decide(self, text):
+        """返回 (分类或 None, 概率)"""
+        self.stats["total"] += 1
+        category, probability = self.model.predict(text)
+        if probability < self.threshold:
+            return None, probability
+        self.stats["decided"] += 1
+        return category, probability
+
+    def summary(self):
+        total = self.stats["total"]
+        rate = self.stats["decided"] / total * 100 if total else 0
+        return (f"{self.version} 判定 {self.stats['decided']}/{total} 句 "
+                f"({rate:.1f}% 免调用 LLM, 阈值 {self.threshold})")
+
+def training_example(input_variables, raw_output):
+    """从一条 LLM 日志中取出 (客户发言, 分类)，无法解析或分类不在闭集中时返回 None"""
+    try:
+        record = decode_input(input_variables)
+        output, _ = extract_json(raw_output)
+    except (ValueError, RuntimeError):
+        return None
+    if "targets" in record:
+        try:
+            text = record["targets"][int(output.get("index"))]
+        except (TypeError, ValueError, IndexError):
+            return None
+    elif "target" in record:
+        text = record["target"]
+    else:
+        match = LEGACY_TARGET_PATTERN.search(record.get("prompt") or "")
+        if not match:
+            return None
+        text = match.group(1)
+    try:
+        category = parse_category(raw_output)
+    except OutputParseError:
+        return None
+    if not text:
+        return None
+    return text, category
+
+def load_examples(db, conn, itersize=1000):
+    """流式读取成功的 LLM 日志 (不含上下文升级第一阶段的 _s1 记录)，同一发言只保留最近一次标注"""
+    cur = db.cursor(conn, name="faq_local_model_examples")
+    if db.db_type == 'postgres':
+        cur.itersize = itersize
+    placeholders = ", ".join(["%s"] * len(TRAINING_PROMPT_IDS))
+    db.execute(cur, f"""
+        SELECT id, input_variables, raw_output FROM log_prompt_execution
+        WHERE status = 'success' AND prompt_id IN ({placeholders})
+        ORDER BY created_at
+    """, TRAINING_PROMPT_IDS)
+    examples = {}
+    for trace_id, input_variables, raw_output in cur:
+        if trace_id.endswith("_s1"):
+            continue
+        example = training_example(input_variables, raw_output)
+        if example:
+            examples[normalize(example[0])] = example
+    cur.close()
+    return list(examples.values())
+
+def is_holdout(text):
+    return zlib.crc32(normalize(text).encode("utf-8")) % 100 < HOLDOUT_PERCENT
+
+def agreement_report(model, holdout):
+    """留出集上与 LLM 结果的一致率: 全部样本，以及各置信度阈值下的覆盖率与一致率"""
+    predictions = [(model.predict(text), label) for text, label in holdout]
+    total = len(predictions)
+    report = {"holdout": total,
+              "agreement": sum(p == label for (p, _), label in predictions) / total if total else 0.0,
+              "thresholds": {}}
+    for threshold in REPORT_THRESHOLDS:
+        covered = [(p, label) for (p, prob), label in predictions if prob >= threshold]
+        report["thresholds"][str(threshold)] = {
+            "coverage": len(covered) / total if total else 0.0,
+            "agreement": sum(p == label for p, label in covered) / len(covered) if covered else 0.0,
+        }
+    return report
+
+def main():
+    from analyze_faq_ci import DATABASE_URL, get_db_connection
+
+    parser = argparse.ArgumentParser(description="从 LLM 日志训练本地字符 n-gram 分类器")
+    parser.add_argument("--epochs", type=int, default=6, help="训练轮数 (默认 6)")
+    parser.add_argument("--min-examples", type=int, default=500, help="样本数少于该值时不训练 (默认 500)")
+    parser.add_argument("--model-dir", default=MODEL_DIR, help="模型目录 (默认 scripts/models)")
+    args = parser.parse_args()
+
+    db = get_db_connection(DATABASE_URL, max_connections=1)
+    with db.connection() as conn:
+        examples = load_examples(db, conn)
+    db.close()
+    print(f"📚 LLM 标注样本: {len(examples)} 条 (按发言去重)")
+    if len(examples) < args.min_examples:
+        print(f"ℹ️  样本不足 {args.min_examples} 条，跳过训练")
+        return
+
+    train = [e for e in examples if not is_holdout(e[0])]
+    holdout = [e for e in examples if is_holdout(e[0])]
+    version = f"faq_ngram_{datetime.now():%Y%m%d%H%M%S}"
+    model = NGramModel(CATEGORIES).fit(train, epochs=args.epochs)
+    report = agreement_report(model, holdout)
+    model.meta = {"version": version, "prompt_version": PROMPT_VERSION, "trained_at": datetime.now().isoformat(),
+                  "train": len(train), "epochs": args.epochs, "report": report}
+    path = model.save(args.model_dir)
+
+    print(f"✅ 模型已保存: {path}")
+    print(f"🎯 留出集 {report['holdout']} 条，与 LLM 一致率 {report['agreement']:.1%}")
+    for threshold, row in report["thresholds"].items():
+        print(f"   概率 ≥ {threshold}: 覆盖 {row['coverage']:.1%} | 一致率 {row['agreement']:.1%}")
+
+if __name__ == "__main__":
+    main()
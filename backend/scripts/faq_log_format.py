@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+紧凑的 Prompt 执行日志格式 (log_prompt_execution.input_variables)
+完整的 user 消息包含最多 20 句对话上下文，同一通话的相邻发言之间几乎完全重复，回填时日志表增长到 GB 级。
+这里只记录可以重建 Prompt 的最小信息:
+  {"fmt": 1, "v": Prompt 版本, "tid": 通话 ID, "ctx": [上下文起始行, 结束行), "target": 目标发言}
+  批量模式为 "targets": [...]；"df": 1 表示上下文区间内的填充发言 (语气词等) 未进入 Prompt；
+  上下文升级模式另有 "stage": 1 (短上下文，system 消息要求输出 confidence) 或 2 (升级后的完整上下文)；
+  "fast": 1 表示低延迟调用配置 (system 消息只要求输出 category)
+完整 user 消息只在错误调用和按比例抽样的成功调用中保存 ("prompt")，可选 zstd 压缩 ("prompt_zstd", base64)。
+需要查看完整 Prompt 时用 load_full_prompt() 从 sync_transcripts 重建
+
+使用方式:
+  python scripts/faq_log_format.py faq_trace_<transcript_id>_<timestamp>
+"""
+
+import sys
+import json
+import base64
+from faq_prompts import PROMPT_VERSION, build_user_prompt, build_batch_user_prompt, build_messages
+from faq_transcript import parse_transcript, iter_candidates, render_context
+
+# zstd 压缩为可选依赖 (zstandard)
+try:
+    import zstandard
+    ZSTD_AVAILABLE = True
+except ImportError:
+    ZSTD_AVAILABLE = False
+
+LOG_FORMAT = 1
+
+def _compress(text):
+    return base64.b64encode(zstandard.ZstdCompressor(level=9).compress(text.encode("utf-8"))).decode("ascii")
+
+def _decompress(value):
+    return zstandard.ZstdDecompressor().decompress(base64.b64decode(value)).decode("utf-8")
+
+def encode_input(transcript_id, span, targets, batch=False, prompt=None, compression=None, drop_filler=False,
+                 stage=None, fast=False):
+    """
+    生成紧凑的 input_variables
+    span: 上下文在渲染后对话行中的区间 (start, end)，targets: 目标发言 (批量模式为列表)
+    prompt: 需要完整保存时传入 user 消息；compression='zstd' 时压缩保存
+    drop_filler: 上下文是否去掉了填充发言 (重建时按同一规则过滤)
+    stage: 上下文升级模式的阶段 (1 = 短上下文 + confidence，2 = 升级后的完整上下文)
+    fast: 使用低延迟调用配置的 system 消息 (不输出 reason)
+    """
+    record = {"fmt": LOG_FORMAT, "v": PROMPT_VERSION, "tid": transcript_id, "ctx": list(span)}
+    if drop_filler:
+        record["df"] = 1
+    if stage:
+        record["stage"] = stage
+    if fast:
+        record["fast"] = 1
+    if batch:
+        record["targets"] = list(targets)
+    else:
+        record["target"] = targets
+    if prompt is not None:
+        if compression == 'zstd' and ZSTD_AVAILABLE:
+            record["prompt_zstd"] = _compress(prompt)
+        else:
+            record["prompt"] = prompt
+    return json.dumps(record, ensure_ascii=False, separators=(",", ":"))
+
+def decode_input(value):
+    """
+    解析 input_variables，返回 dict
+    旧格式 (完整 user 消息文本) 或规则/去重日志 (发言原文) 返回 {"prompt": 原文}
+    """
+    try:
+        record = json.loads(value)
+    except (TypeError, ValueError):
+        return {"prompt": value}
+    if not isinstance(record, dict) or record.get("fmt") != LOG_FORMAT:
+        return {"prompt": value}
+    if "prompt_zstd" in record:
+        if not ZSTD_AVAILABLE:
+            raise RuntimeError("该日志的完整 Prompt 经 zstd 压缩，需要安装 zstandard")
+        record["prompt"] = _decompress(record.pop("prompt_zstd"))
+    return record
+
+def reconstruct_prompt(record, lines):
+    """按记录中的上下文区间与目标发言重建 user 消息 (lines 为该通话渲染后的对话行)"""
+    if "prompt" in record:
+        return record["prompt"]
+    start, end = record["ctx"]
+    if record.get("df"):
+        # 填充发言的判定规则与分析时相同 (faq_transcript)
+        history_str = render_context(lines, start, end)
+    else:
+        history_str = "\n".join(lines[start:end])
+    if "targets" in record:
+        return build_batch_user_prompt(history_str, record["targets"])
+    return build_user_prompt(history_str, record["target"])
+
+def load_full_prompt(conn, placeholder, trace_id):
+    """
+    读取一条日志并重建完整请求消息 (system + user)，日志不存在时返回 None
+    system 消息按当前 PROMPT_VERSION 生成，记录版本不同时会给出提示
+    """
+    cur = conn.cursor()
+    cur.execute(f"SELECT input_variables FROM log_prompt_execution WHERE id = {placeholder}", (trace_id,))
+    row = cur.fetchone()
+    if row is None:
+        # 超过保留期的日志已移入归档表 (见 faq_log_retention)
+        try:
+            cur.execute(f"SELECT input_variables FROM log_prompt_execution_archive WHERE id = {placeholder}", (trace_id,))
+            row = cur.fetchone()
+        except Exception:
+            conn.rollback()
+    if row is None:
+        cur.close()
+        return None
+    record = decode_input(row[0])
+
+    lines = []
+    if "prompt" not in record:
+        cur.execute(f"SELECT content FROM sync_transcripts WHERE id = {placeholder}", (record["tid"],))
+        content = cur.fetchone()
+        if content is None:
+            cur.close()
+            raise LookupError(f"通话 {record['tid']} 已不存在，无法重建 Prompt")
+        lines, _ = iter_candidates(parse_transcript(content[0]) or [])
+    cur.close()
+
+    if record.get("v", PROMPT_VERSION) != PROMPT_VERSION:
+        print(f"⚠️ 日志版本 {record['v']} 与当前 system 消息版本 {PROMPT_VERSION} 不同")
+    return build_messages(reconstruct_prompt(record, lines), batch="targets" in record,
+                          confidence=record.get("stage") == 1, fast=bool(record.get("fast")))
+
+def main():
+    from analyze_faq_ci import DATABASE_URL, get_db_connection
+
+    if len(sys.argv) != 2:
+        print("用法: python scripts/faq_log_format.py <trace_id>")
+        return
+    db = get_db_connection(DATABASE_URL, max_connections=1)
+    with db.connection() as conn:
+        messages = load_full_prompt(conn, db.placeholder, sys.argv[1])
+    db.close()
+    if messages is None:
+        print(f"❌ 未找到日志: {sys.argv[1]}")
+        return
+    for m in messages:
+        print(f"===== {m['role']} =====")
+        print(m["content"])
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,313 @@
+#!/usr/bin/env python3
+"""
+log_prompt_execution 保留策略: 日汇总 + 归档 + 过期
+每条分类发言一行日志，表会无限增长。按天处理超过 --hot-days 的记录:
+1. 汇总到 log_prompt_execution_daily (每天 × prompt_id: 调用数、错误率、p50/p95 耗时、Token 用量)，
+   看板统计直接读汇总表，不再扫描原始日志
+2. 原始行移入归档表 log_prompt_execution_archive:
+   - PostgreSQL: 按月 RANGE 分区 (log_prompt_execution_archive_YYYYMM)，过期时整个分区 DROP
+   - SQLite: 普通归档表，过期时按天 DELETE
+   两者主键都是 (id, created_day): 重新分析的发言 (同一 trace id) 在不同日期各保留一行，
+   同一天重复归档时以热表中较新的一行为准
+3. 归档与汇总分别按 --archive-days / --rollup-days 过期 (0 = 永久保留)
+每一天的汇总与搬迁在同一个事务中完成，中途中断后重跑不会重复或遗漏
+
+使用方式:
+  python scripts/faq_log_retention.py                     # 默认: 热表保留 30 天，归档保留 180 天
+  python scripts/faq_log_retention.py --hot-days 7 --archive-days 0
+"""
+
+import argparse
+from datetime import date, datetime, timedelta
+from llm_usage import USAGE_COLUMNS, ensure_usage_columns
+
+LOG_TABLE = "log_prompt_execution"
+ARCHIVE_TABLE = "log_prompt_execution_archive"
+DAILY_TABLE = "log_prompt_execution_daily"
+
+# 归档保留的列 (CI 脚本与 Prisma 建出的日志表都包含这些列)
+ARCHIVE_COLUMNS = ("id", "prompt_id", "call_id", "input_variables", "raw_output",
+                   "execution_time_ms", "status", "error_message", "is_dry_run", "created_at") + USAGE_COLUMNS
+
+def ensure_retention_schema(conn, db_type):
+    """创建汇总表、归档表与日志表的 created_at 索引"""
+    cur = conn.cursor()
+    usage_ddl = ",\n".join(f"{c} INTEGER" for c in USAGE_COLUMNS)
+    if db_type == 'postgres':
+        cur.execute(f"""
+            CREATE TABLE IF NOT EXISTS {DAILY_TABLE} (
+                day DATE NOT NULL,
+                prompt_id TEXT NOT NULL,
+                calls INTEGER,
+                errors INTEGER,
+                error_rate DOUBLE PRECISION,
+                p50_ms INTEGER,
+                p95_ms INTEGER,
+                prompt_tokens BIGINT,
+                completion_tokens BIGINT,
+                cached_tokens BIGINT,
+                PRIMARY KEY (day, prompt_id)
+            )
+        """)
+        # 分区表主键必须包含分区键
+        cur.execute(f"""
+            CREATE TABLE IF NOT EXISTS {ARCHIVE_TABLE} (
+                id TEXT NOT NULL,
+                prompt_id TEXT,
+                call_id TEXT,
+                input_variables TEXT,
+                raw_output TEXT,
+                execution_time_ms INTEGER,
+                status TEXT,
+                error_message TEXT,
+                is_dry_run INTEGER,
+                created_at TEXT,
+                {usage_ddl},
+                created_day DATE NOT NULL,
+                PRIMARY KEY (id, created_day)
+            ) PARTITION BY RANGE (created_day)
+        """)
+    else:
+        cur.execute(f"""
+            CREATE TABLE IF NOT EXISTS {DAILY_TABLE} (
+                day TEXT NOT NULL,
+                prompt_id TEXT NOT NULL,
+                calls INTEGER,
+                errors INTEGER,
+                error_rate REAL,
+                p50_ms INTEGER,
+                p95_ms INTEGER,
+                prompt_tokens INTEGER,
+                completion_tokens INTEGER,
+                cached_tokens INTEGER,
+                PRIMARY KEY (day, prompt_id)
+            )
+        """)
+        legacy_archive = _rename_legacy_sqlite_archive(cur)
+        cur.execute(f"""
+            CREATE TABLE IF NOT EXISTS {ARCHIVE_TABLE} (
+                id TEXT NOT NULL,
+                prompt_id TEXT,
+                call_id TEXT,
+                input_variables TEXT,
+                raw_output TEXT,
+                execution_time_ms INTEGER,
+                status TEXT,
+                error_message TEXT,
+                is_dry_run INTEGER,
+                created_at TEXT,
+                {usage_ddl},
+                created_day TEXT NOT NULL,
+                PRIMARY KEY (id, created_day)
+            )
+        """)
+        if legacy_archive:
+            columns = ", ".join(ARCHIVE_COLUMNS + ("created_day",))
+            cur.execute(f"INSERT INTO {ARCHIVE_TABLE} ({columns}) SELECT {columns} FROM {ARCHIVE_TABLE}_old")
+            cur.execute(f"DROP TABLE {ARCHIVE_TABLE}_old")
+            print(f"🔧 {ARCHIVE_TABLE} 主键已改为 (id, created_day)")
+        cur.execute(f"CREATE INDEX IF NOT EXISTS idx_{ARCHIVE_TABLE}_day ON {ARCHIVE_TABLE} (created_day)")
+    cur.execute(f"CREATE INDEX IF NOT EXISTS idx_{LOG_TABLE}_created_at ON {LOG_TABLE} (created_at)")
+    conn.commit()
+    cur.close()
+
+def _rename_legacy_sqlite_archive(cur):
+    """
+    SQLite: 早期的归档表只以 id 为主键 (同一 id 之后的归档被忽略)，
+    改名为 *_old 后由调用方按 (id, created_day) 主键重建并迁移，返回是否需要迁移
+    """
+    cur.execute(f"PRAGMA table_info({ARCHIVE_TABLE})")
+    key = [row[1] for row in sorted(cur.fetchall(), key=lambda row: row[5]) if row[5]]
+    if key != ["id"]:
+        return False
+    cur.execute(f"DROP INDEX IF EXISTS idx_{ARCHIVE_TABLE}_day")
+    cur.execute(f"ALTER TABLE {ARCHIVE_TABLE} RENAME TO {ARCHIVE_TABLE}_old")
+    return True
+
+def percentile(sorted_values, q):
+    """线性插值分位数 (与 PostgreSQL percentile_cont 一致)"""
+    if not sorted_values:
+        return None
+    pos = (len(sorted_values) - 1) * q
+    lower = int(pos)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (pos - lower)
+
+def _day_range(day):
+    """当天的 created_at 区间 [day, day+1)，字符串比较同时适用于 TEXT (ISO) 与 TIMESTAMP 列"""
+    return day.isoformat(), (day + timedelta(days=1)).isoformat()
+
+def days_to_close(conn, db_type, cutoff):
+    """热表中早于 cutoff 的日期 (升序)"""
+    p = '%s' if db_type == 'postgres' else '?'
+    day_expr = "LEFT(created_at::text, 10)" if db_type == 'postgres' else "SUBSTR(created_at, 1, 10)"
+    cur = conn.cursor()
+    cur.execute(f"SELECT DISTINCT {day_expr} FROM {LOG_TABLE} WHERE created_at < {p} ORDER BY 1",
+                (cutoff.isoformat(),))
+    days = [date.fromisoformat(row[0]) for row in cur.fetchall() if row[0]]
+    cur.close()
+    return days
+
+def rollup_day(cur, db_type, day):
+    """
+    汇总一天的日志 (热表 + 已归档部分，迟到的记录重算时结果仍完整)，返回汇总的 prompt_id 数
+    同一 id 同时出现在热表与归档中时只计一次 (以热表中较新的一行为准，随后归档时同样覆盖旧行)
+    """
+    p = '%s' if db_type == 'postgres' else '?'
+    start, end = _day_range(day)
+    fields = "id, prompt_id, status, execution_time_ms, " + ", ".join(USAGE_COLUMNS)
+    cur.execute(f"SELECT {fields} FROM {LOG_TABLE} WHERE created_at >= {p} AND created_at < {p}", (start, end))
+    latest = {row[0]: row[1:] for row in cur.fetchall()}
+    cur.execute(f"SELECT {fields} FROM {ARCHIVE_TABLE} WHERE created_day = {p}", (start,))
+    for row in cur.fetchall():
+        latest.setdefault(row[0], row[1:])
+
+    groups = {}
+    for prompt_id, status, ms, *usage in latest.values():
+        g = groups.setdefault(prompt_id, {"calls": 0, "errors": 0, "times": [], "usage": [0] * len(USAGE_COLUMNS)})
+        g["calls"] += 1
+        g["errors"] += status == "error"
+        if ms is not None:
+            g["times"].append(ms)
+        for i, value in enumerate(usage):
+            g["usage"][i] += value or 0
+
+    rows = []
+    for prompt_id, g in groups.items():
+        times = sorted(g["times"])
+        p50, p95 = percentile(times, 0.5), percentile(times, 0.95)
+        rows.append((start, prompt_id, g["calls"], g["errors"], g["errors"] / g["calls"],
+                     round(p50) if p50 is not None else None,
+                     round(p95) if p95 is not None else None, *g["usage"]))
+    if rows:
+        columns = "day, prompt_id, calls, errors, error_rate, p50_ms, p95_ms, " + ", ".join(USAGE_COLUMNS)
+        updates = ", ".join(f"{c} = EXCLUDED.{c}" for c in columns.split(", ")[2:])
+        cur.executemany(f"""
+            INSERT INTO {DAILY_TABLE} ({columns})
+            VALUES ({", ".join([p] * (7 + len(USAGE_COLUMNS)))})
+            ON CONFLICT (day, prompt_id) DO UPDATE SET {updates}
+        """, rows)
+    return len(rows)
+
+def _ensure_partition(cur, day):
+    """PostgreSQL: 创建 day 所在月份的归档分区"""
+    month = day.replace(day=1)
+    next_month = (month + timedelta(days=32)).replace(day=1)
+    cur.execute(f"""
+        CREATE TABLE IF NOT EXISTS {ARCHIVE_TABLE}_{month:%Y%m}
+        PARTITION OF {ARCHIVE_TABLE} FOR VALUES FROM ('{month}') TO ('{next_month}')
+    """)
+
+def archive_day(cur, db_type, day):
+    """把一天的原始日志移入归档表 (同一天已归档的同 id 行被热表中的新行覆盖)，返回写入归档的行数"""
+    start, end = _day_range(day)
+    columns = ", ".join(ARCHIVE_COLUMNS)
+    updates = ", ".join(f"{c} = EXCLUDED.{c}" for c in ARCHIVE_COLUMNS[1:])
+    if db_type == 'postgres':
+        _ensure_partition(cur, day)
+        select = ", ".join(
+            "created_at::text" if c == "created_at" else "is_dry_run::int" if c == "is_dry_run" else c
+            for c in ARCHIVE_COLUMNS
+        )
+        cur.execute(f"""
+            INSERT INTO {ARCHIVE_TABLE} ({columns}, created_day)
+            SELECT {select}, %s::date FROM {LOG_TABLE}
+            WHERE created_at >= %s AND created_at < %s
+            ON CONFLICT (id, created_day) DO UPDATE SET {updates}
+        """, (start, start, end))
+        archived = max(cur.rowcount, 0)
+        cur.execute(f"DELETE FROM {LOG_TABLE} WHERE created_at >= %s AND created_at < %s", (start, end))
+    else:
+        cur.execute(f"""
+            INSERT INTO {ARCHIVE_TABLE} ({columns}, created_day)
+            SELECT {columns}, ? FROM {LOG_TABLE}
+            WHERE created_at >= ? AND created_at < ?
+            ON CONFLICT (id, created_day) DO UPDATE SET {updates}
+        """, (start, start, end))
+        archived = max(cur.rowcount, 0)
+        cur.execute(f"DELETE FROM {LOG_TABLE} WHERE created_at >= ? AND created_at < ?", (start, end))
+    return archived
+
+def expire_archive(conn, db_type, cutoff):
+    """删除早于 cutoff 的归档 (PostgreSQL 只 DROP 整月都已过期的分区)，返回删除的分区数或行数"""
+    cur = conn.cursor()
+    if db_type == 'postgres':
+        cur.execute("""
+            SELECT c.relname FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            JOIN pg_class parent ON parent.oid = i.inhparent
+            WHERE parent.relname = %s
+        """, (ARCHIVE_TABLE,))
+        dropped = 0
+        for (name,) in cur.fetchall():
+            month = datetime.strptime(name.rsplit("_", 1)[1], "%Y%m").date()
+            next_month = (month + timedelta(days=32)).replace(day=1)
+            if next_month <= cutoff:
+                cur.execute(f"DROP TABLE IF EXISTS {name}")
+                dropped += 1
+        result = dropped
+    else:
+        cur.execute(f"DELETE FROM {ARCHIVE_TABLE} WHERE created_day < ?", (cutoff.isoformat(),))
+        result = max(cur.rowcount, 0)
+    conn.commit()
+    cur.close()
+    return result
+
+def expire_rollups(conn, db_type, cutoff):
+    """删除早于 cutoff 的日汇总，返回删除行数"""
+    p = '%s' if db_type == 'postgres' else '?'
+    cur = conn.cursor()
+    cur.execute(f"DELETE FROM {DAILY_TABLE} WHERE day < {p}", (cutoff.isoformat(),))
+    count = max(cur.rowcount, 0)
+    conn.commit()
+    cur.close()
+    return count
+
+def apply_retention(conn, db_type, hot_days=30, archive_days=180, rollup_days=0):
+    """按天汇总并归档超过 hot_days 的日志，再执行过期，返回统计 dict"""
+    today = date.today()
+    stats = {"days": 0, "archived": 0, "rollups": 0, "expired_archive": 0, "expired_rollups": 0}
+    cur = conn.cursor()
+    for day in days_to_close(conn, db_type, today - timedelta(days=hot_days)):
+        try:
+            stats["rollups"] += rollup_day(cur, db_type, day)
+            stats["archived"] += archive_day(cur, db_type, day)
+            conn.commit()
+            stats["days"] += 1
+        except Exception:
+            conn.rollback()
+            raise
+    cur.close()
+    if archive_days:
+        stats["expired_archive"] = expire_archive(conn, db_type, today - timedelta(days=archive_days))
+    if rollup_days:
+        stats["expired_rollups"] = expire_rollups(conn, db_type, today - timedelta(days=rollup_days))
+    return stats
+
+def main():
+    from analyze_faq_ci import DATABASE_URL, get_db_connection
+
+    parser = argparse.ArgumentParser(description="log_prompt_execution 日汇总、归档与过期")
+    parser.add_argument("--hot-days", type=int, default=30, help="热表保留原始日志的天数 (默认 30)")
+    parser.add_argument("--archive-days", type=int, default=180, help="归档保留天数 (默认 180, 0=永久)")
+    parser.add_argument("--rollup-days", type=int, default=0, help="日汇总保留天数 (默认 0=永久)")
+    args = parser.parse_args()
+
+    db = get_db_connection(DATABASE_URL, max_connections=1)
+    db_type = db.db_type
+    with db.connection() as conn:
+        if db_type == 'postgres':
+            # 维护任务: 首次建索引与大量搬迁不受 CI 的 60 秒语句超时限制
+            cur = conn.cursor()
+            cur.execute("SET statement_timeout = 0")
+            cur.close()
+        ensure_usage_columns(conn, db_type)
+        ensure_retention_schema(conn, db_type)
+        stats = apply_retention(conn, db_type, max(1, args.hot_days), args.archive_days, args.rollup_days)
+    db.close()
+    expired = "分区" if db_type == 'postgres' else "行"
+    print(f"🗃️ 日志保留: 归档 {stats['days']} 天 / {stats['archived']} 行 | 日汇总 {stats['rollups']} 条 | "
+          f"过期归档 {stats['expired_archive']} {expired} | 过期汇总 {stats['expired_rollups']} 条")
+
+if __name__ == "__main__":
+    main()
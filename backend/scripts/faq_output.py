@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+"""
+LLM 分类输出的解析与修复 (各分析脚本共用)
+直接 json.loads 时，```json 代码块、JSON 前后的说明文字、"11. 付款方式" 这类序号前缀、
+"价格资询" 这类错别字都会被当成错误，已付费的调用白白浪费。这里按顺序尝试:
+1. 严格 JSON，category 与闭集完全一致 (clean)
+2. 去掉代码块标记，从说明文字中截取第一个 JSON 值，修正中文引号与尾随逗号
+3. category 清洗序号/引号后按包含关系、编辑距离匹配 CATEGORIES (唯一最近的分类)
+4. 没有可解析的 JSON (如被 max_tokens 截断) 时按 "category": "..." 片段或正文中唯一出现的分类名识别
+第 2~4 步成功记为 repaired；仍无法解析时抛出 OutputParseError，由调用方决定是否做一次格式修复重试
+解析结果按 (Prompt 版本, 请求类型) 统计，运行结束时累加写入 biz_faq_parse_stats (按天)
+"""
+
+import re
+import json
+from datetime import date
+from faq_prompts import CATEGORIES
+
+PARSE_STATS_TABLE = "biz_faq_parse_stats"
+PARSE_OUTCOMES = ("clean", "repaired", "unparsed", "recovered", "failed")
+
+FENCE_PATTERN = re.compile(r"```(?:json|JSON)?\s*(.*?)```", re.S)
+TRAILING_COMMA_PATTERN = re.compile(r",\s*([}\]])")
+CATEGORY_FIELD_PATTERN = re.compile(r'"?category"?\s*[:：]\s*"?([^",，}\n]+)')
+CONFIDENCE_FIELD_PATTERN = re.compile(r'"?confidence"?\s*[:：]\s*"?([0-9.]+|high|medium|low|高|中|低)', re.I)
+CATEGORY_PREFIX_PATTERN = re.compile(r"^\s*\d+\s*[\.、．:：)）]?\s*")
+CATEGORY_STRIP_CHARS = " \t\r\n\"'“”‘’「」【】《》[]()（）。.,，:："
+
+CONFIDENCE_WORDS = {"high": 0.9, "高": 0.9, "medium": 0.6, "中": 0.6, "low": 0.3, "低": 0.3}
+
+class OutputParseError(ValueError):
+    """输出无法解析 (raw_output 保存原始回复，便于记录日志)"""
+
+    def __init__(self, message, raw_output=""):
+        super().__init__(message)
+        self.raw_output = raw_output
+
+def edit_distance(a, b):
+    """Levenshtein 距离"""
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        previous = current
+    return previous[-1]
+
+def match_category(name):
+    """
+    把模型输出的分类名映射到 CATEGORIES，返回 (分类或 None, 是否经过修复)
+    包含关系 ("价格咨询类"、旧分类 "其他") 或编辑距离不超过 1 (四字分类) 且唯一最近时视为匹配
+    """
+    if not isinstance(name, str):
+        return None, False
+    if name in CATEGORIES:
+        return name, False
+    clean = CATEGORY_PREFIX_PATTERN.sub("", name.strip()).strip(CATEGORY_STRIP_CHARS)
+    if clean in CATEGORIES:
+        return clean, True
+    if len(clean) < 2:
+        return None, False
+    contained = [c for c in CATEGORIES if c in clean or clean in c]
+    if len(contained) == 1:
+        return contained[0], True
+    distances = sorted((edit_distance(clean, c), c) for c in CATEGORIES)
+    best, category = distances[0]
+    if best <= max(1, len(category) // 4) and (len(distances) == 1 or distances[1][0] > best):
+        return category, True
+    return None, False
+
+def extract_json(text, expect=dict):
+    """
+    从回复中取出第一个 expect 类型 (dict / list) 的 JSON 值，返回 (值, 是否经过修复)
+    找不到时抛出 OutputParseError
+    """
+    text = (text or "").strip()
+    try:
+        value = json.loads(text)
+        if isinstance(value, expect):
+            return value, False
+    except ValueError:
+        pass
+    fence = FENCE_PATTERN.search(text)
+    candidates = [fence.group(1).strip()] if fence else []
+    candidates.append(text)
+    opener = "{" if expect is dict else "["
+    decoder = json.JSONDecoder()
+    for candidate in candidates:
+        for variant in (candidate, TRAILING_COMMA_PATTERN.sub(r"\1", candidate.replace("“", '"').replace("”", '"'))):
+            start = variant.find(opener)
+            while start != -1:
+                try:
+                    value, _ = decoder.raw_decode(variant, start)
+                    if isinstance(value, expect):
+                        return value, True
+                except ValueError:
+                    pass
+                start = variant.find(opener, start + 1)
+    raise OutputParseError(f"回复中没有可解析的 JSON {'对象' if expect is dict else '数组'}", text)
+
+def _confidence_value(value):
+    if isinstance(value, str):
+        value = CONFIDENCE_WORDS.get(value.strip().lower(), value)
+    try:
+        return min(1.0, max(0.0, float(value)))
+    except (TypeError, ValueError):
+        return None
+
+def parse_classification(raw_output):
+    """
+    解析单句分类输出，返回 (category, confidence 或 None, 是否经过修复)
+    无法得到闭集内的分类时抛出 OutputParseError
+    """
+    try:
+        result, repaired = extract_json(raw_output)
+    except OutputParseError:
+        result, repaired = None, True
+    if result is not None:
+        category, fixed = match_category(result.get("category"))
+        if category is None:
+            raise OutputParseError(f"分类不在闭集中: {result.get('category')!r}", raw_output)
+        return category, _confidence_value(result.get("confidence")), repaired or fixed
+
+    # 没有完整 JSON (截断或纯文本回复): 按字段片段识别，否则取正文中唯一出现的分类名
+    text = raw_output or ""
+    field = CATEGORY_FIELD_PATTERN.search(text)
+    category = match_category(field.group(1))[0] if field else None
+    if category is None:
+        mentioned = {c for c in CATEGORIES if c in text}
+        if len(mentioned) != 1:
+            raise OutputParseError("回复中没有可识别的分类", raw_output)
+        category = mentioned.pop()
+    confidence = CONFIDENCE_FIELD_PATTERN.search(text)
+    return category, _confidence_value(confidence.group(1)) if confidence else None, True
+
+def parse_category(raw_output):
+    """解析单句分类输出，返回闭集内的 category (无法解析时抛出 OutputParseError)"""
+    return parse_classification(raw_output)[0]
+
+def parse_batch_output(raw_output, size):
+    """
+    解析批量输出的 JSON 数组，返回 ({index: category}, 是否经过修复)
+    分类无法匹配闭集的条目不返回 (由调用方回退到逐句调用)，数组无法解析时抛出 OutputParseError
+    """
+    items, repaired = extract_json(raw_output, expect=list)
+    categories = {}
+    for item in items:
+        if not isinstance(item, dict):
+            continue
+        try:
+            index = int(item.get("index"))
+        except (TypeError, ValueError):
+            continue
+        category, fixed = match_category(item.get("category"))
+        if 0 <= index < size and category is not None:
+            categories[index] = category
+            repaired = repaired or fixed
+    return categories, repaired
+
+def ensure_parse_stats_schema(conn, db_type):
+    """创建解析统计表 (每天 × Prompt 版本 × 请求类型 一行)"""
+    cur = conn.cursor()
+    counters = ",\n".join(f"{outcome} INTEGER DEFAULT 0" for outcome in PARSE_OUTCOMES)
+    day_type = "DATE" if db_type == 'postgres' else "TEXT"
+    cur.execute(f"""
+        CREATE TABLE IF NOT EXISTS {PARSE_STATS_TABLE} (
+            day {day_type} NOT NULL,
+            prompt_version TEXT NOT NULL,
+            variant TEXT NOT NULL,
+            {counters},
+            PRIMARY KEY (day, prompt_version, variant)
+        )
+    """)
+    conn.commit()
+    cur.close()
+
+PARSE_STATS_UPSERT_SQL = f"""
+    INSERT INTO {PARSE_STATS_TABLE} (day, prompt_version, variant, {", ".join(PARSE_OUTCOMES)})
+    VALUES (%s, %s, %s, {", ".join(["%s"] * len(PARSE_OUTCOMES))})
+    ON CONFLICT (day, prompt_version, variant) DO UPDATE SET
+    {", ".join(f"{o} = {PARSE_STATS_TABLE}.{o} + EXCLUDED.{o}" for o in PARSE_OUTCOMES)}
+"""
+
+class ParseStats:
+    """
+    按 (Prompt 版本, 请求类型) 统计解析结果
+    只统计 API 的实际回复 (缓存命中不计)
+    首次回复: clean 直接解析 | repaired 修复后解析 | unparsed 无法解析 (单句做格式修复重试，批量回退逐句调用)
+    格式修复重试: recovered 重试后解析成功 | failed 仍无法解析
+    """
+
+    def __init__(self, prompt_version):
+        self.prompt_version = prompt_version
+        self.counts = {}
+
+    def add(self, variant, outcome):
+        counts = self.counts.setdefault(variant, dict.fromkeys(PARSE_OUTCOMES, 0))
+        counts[outcome] += 1
+
+    def save(self, conn, placeholder="%s"):
+        """累加写入 biz_faq_parse_stats (运行结束时调用一次；SQLite 连接传 placeholder="?")"""
+        if not self.counts:
+            return
+        cur = conn.cursor()
+        rows = [(date.today().isoformat(), self.prompt_version, variant) + tuple(c[o] for o in PARSE_OUTCOMES)
+                for variant, c in self.counts.items()]
+        cur.executemany(PARSE_STATS_UPSERT_SQL.replace("%s", placeholder), rows)
+        conn.commit()
+        cur.close()
+
+    def summary(self):
+        if not self.counts:
+            return "无"
+        parts = []
+        for variant, c in sorted(self.counts.items()):
+            total = c["clean"] + c["repaired"] + c["unparsed"]
+            rate = c["unparsed"] / total if total else 0
+            parts.append(f"{variant}: 直接 {c['clean']} | 修复 {c['repaired']} | 无法解析 {c['unparsed']} ({rate:.1%}) | "
+                         f"重试成功 {c['recovered']} | 最终失败 {c['failed']}")
+        return f"{self.prompt_version} " + "; ".join(parts)
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+规则预分类器 (Rule-based Pre-classifier)
+在调用 LLM 之前，用 Aho-Corasick 多模式匹配识别高置信度的客户发言:
+- 只命中一个业务分类的强特征短语，且带有疑问标记 → 直接判定为该分类
+  ("多少钱"、"什么时候来" 这类短语自身含疑问词，只有位于句末 (后面只有语气词/标点) 才算提问，
+  短语之外的疑问标记照常计算；"我不管多少钱都要装" 不会被判为价格咨询)
+- 带否定或陈述语气 ("知道"、"都可以"、"不用" 等) 的发言不做分类判定
+- 没有疑问标记、也不涉及任何业务话题 → 直接判定为 "非问题"
+其余 (多分类冲突 / 指代不明) 一律交给 LLM，保证规则判定的精度
+"""
+
+from collections import deque
+
+RULES_PROMPT_ID = "faq_v3_rules"
+
+# 业务分类强特征短语 (出现即可确定话题)
+CATEGORY_KEYWORDS = {
+    "价格咨询": ["多少钱", "怎么收费", "收费标准", "报价", "费用多少", "价格多少", "贵不贵",
+               "什么价", "价位", "多少一平", "一平多少", "一平米多少", "多少一米"],
+    "服务范围": ["能不能做", "做不做", "能做吗", "可以做吗", "能修吗", "能不能修", "修不修",
+               "能不能处理", "管不管"],
+    "上门时间": ["什么时候能来", "什么时候来", "几点来", "几点到", "多久能到", "什么时候上门",
+               "哪天来", "今天能来", "明天能来", "今天可以来", "明天可以来", "什么时候过来"],
+    "质保期": ["保修几年", "质保几年", "保几年", "质保多久", "保修多久", "保修期", "质保期",
+             "保多久", "保多长时间"],
+    "服务人员": ["是不是外包", "外包的吗", "自己的师傅", "师傅专业吗", "师傅有证", "有没有证"],
+    "施工流程": ["怎么施工", "施工流程", "施工步骤", "要不要砸", "需要砸", "要砸吗", "砸不砸"],
+    "联系方式": ["电话多少", "加个微信", "微信多少", "留个电话", "怎么联系", "你电话", "微信号"],
+    "公司资质": ["有资质吗", "什么公司", "正规公司", "有没有资质", "营业执照", "是正规的吗", "正规吗"],
+    "材料品牌": ["什么材料", "什么牌子", "哪个牌子", "什么品牌", "用的什么料", "哪个品牌"],
+    "施工周期": ["要做几天", "做几天", "多久完工", "几天完工", "工期多久", "工期多长",
+               "多久能做完", "几天能做完", "几天能弄完"],
+    "付款方式": ["怎么付款", "能分期", "可以分期", "付定金", "先付钱", "怎么付钱", "先交钱",
+               "付全款", "交定金"],
+    "优惠活动": ["有优惠", "有没有优惠", "打折", "有折扣", "优惠活动", "便宜点", "能便宜"],
+}
+
+# 疑问标记: 没有任何疑问标记的发言不会被规则判定为业务问题
+QUESTION_MARKERS = ["吗", "呢", "？", "?", "多少", "几", "什么", "怎么", "哪", "多久", "多长",
+                    "是不是", "有没有", "能不能", "可不可以", "要不要", "会不会", "行不行", "啥",
+                    "咋", "问一下", "问问", "请问"]
+
+# 陈述 / 否定语气: 命中时即使有业务短语也交给 LLM
+STATEMENT_CUES = ["知道", "都行", "都可以", "都要", "都好", "不管", "无论", "不用", "不需要", "不想",
+                  "问过", "说过", "无所谓", "没关系"]
+
+# 句末的语气词与标点 (判断短语是否位于句末时忽略)
+TRAILING_CHARS = "啊呀哈呢吗嘛么的了？?。.!！~～ "
+
+# 业务话题词 (宽泛): 涉及这些词的发言即使没有疑问标记，也交给 LLM 判断
+TOPIC_WORDS = ["钱", "价", "费", "贵", "便宜", "优惠", "折", "保", "师傅", "人员", "外包", "材料",
+               "牌", "品牌", "资质", "公司", "正规", "时间", "时候", "上门", "过来", "来看", "天",
+               "工期", "施工", "做", "修", "砸", "付", "定金", "分期", "微信", "电话", "联系", "号码"]
+
+class AhoCorasick:
+    """Aho-Corasick 自动机: 一次扫描找出文本中所有命中的模式串"""
+
+    def __init__(self):
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [[]]
+
+    def add(self, word, payload):
+        """payload 与模式串长度一起保存 (find_spans 据此还原命中位置)"""
+        node = 0
+        for ch in word:
+            if ch not in self.goto[node]:
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append([])
+                self.goto[node][ch] = len(self.goto) - 1
+            node = self.goto[node][ch]
+        self.output[node].append((len(word), payload))
+
+    def build(self):
+        """BFS 构建失败指针 (第一层节点指向根)，并合并后缀节点的输出"""
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, child in self.goto[node].items():
+                queue.append(child)
+                f = self.fail[node]
+                while f and ch not in self.goto[f]:
+                    f = self.fail[f]
+                self.fail[child] = self.goto[f].get(ch, 0)
+                self.output[child] = self.output[child] + self.output[self.fail[child]]
+        return self
+
+    def find_spans(self, text):
+        """返回所有命中 [(start, end, payload)]，end 不含 (可能重复)"""
+        node = 0
+        hits = []
+        for i, ch in enumerate(text):
+            while node and ch not in self.goto[node]:
+                node = self.fail[node]
+            node = self.goto[node].get(ch, 0)
+            hits.extend((i + 1 - length, i + 1, payload) for length, payload in self.output[node])
+        return hits
+
+    def find_all(self, text):
+        """返回所有命中模式的 payload 列表 (可能重复)"""
+        return [payload for _, _, payload in self.find_spans(text)]
+
+class PreClassifier:
+    """规则预分类器，decide() 返回分类名或 None (None 表示交给 LLM)"""
+
+    def __init__(self):
+        self.automaton = AhoCorasick()
+        for category, keywords in CATEGORY_KEYWORDS.items():
+            for word in keywords:
+                self.automaton.add(word, ("category", category))
+        for word in QUESTION_MARKERS:
+            self.automaton.add(word, ("question", word))
+        for word in TOPIC_WORDS:
+            self.automaton.add(word, ("topic", word))
+        for word in STATEMENT_CUES:
+            self.automaton.add(word, ("statement", word))
+        self.automaton.build()
+
+        self.stats = {"total": 0, "decided": 0, "non_question": 0}
+
+    @staticmethod
+    def _asks(text, hits):
+        """
+        是否在提问: 业务短语之外有疑问标记，或含疑问词的业务短语位于句末
+        ("多少钱" 中的 "多少" 不单独算疑问标记)
+        """
+        keyword_spans = [(start, end) for start, end, (kind, _) in hits if kind == "category"]
+        tail = len(text.rstrip(TRAILING_CHARS))
+        for start, end, (kind, _) in hits:
+            if kind != "question":
+                continue
+            inside = [(ks, ke) for ks, ke in keyword_spans if ks <= start and end <= ke]
+            if not inside or any(ke == tail for _, ke in inside):
+                return True
+        return False
+
+    def decide(self, text):
+        """高置信度时返回分类名，否则返回 None"""
+        self.stats["total"] += 1
+        hits = self.automaton.find_spans(text)
+        kinds = {payload[0] for _, _, payload in hits}
+        categories = {value for _, _, (kind, value) in hits if kind == "category"}
+
+        category = None
+        if len(categories) == 1:
+            if "statement" not in kinds and self._asks(text, hits):
+                category = categories.pop()
+        elif not categories and "question" not in kinds and "topic" not in kinds:
+            category = "非问题"
+            self.stats["non_question"] += 1
+
+        if category:
+            self.stats["decided"] += 1
+        return category
+
+    def summary(self):
+        """规则判定占比 (即节省的 LLM 调用比例)"""
+        total = self.stats["total"]
+        rate = self.stats["decided"] / total * 100 if total else 0
+        return (f"规则判定 {self.stats['decided']}/{total} 句 ({rate:.1f}% 免调用 LLM) | "
+                f"其中非问题 {self.stats['non_question']} 句")
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""
+已处理通话记录水位表 (biz_faq_processed)
+每个通话分析完成后写入一行 (transcript_id, prompt_version, content_hash, processed_at, status)，
+增量模式用主键索引做反连接 (LEFT JOIN ... IS NULL) 排除已处理记录，
+不再对日志表的全部 faq_trace_ 行做正则解析，启动耗时不随日志量增长
+
+发言级断点 (biz_faq_checkpoint): 每句客户发言分类完成 (或失败) 后记录一行，
+运行中断后重跑只处理尚未分类的发言；通话全部发言完成后才写入水位并清除断点。
+同一句发言连续失败 MAX_UTTERANCE_FAILURES 次后不再重试，通话以 partial 状态完成
+"""
+
+import json
+import hashlib
+from datetime import datetime
+
+PROCESSED_TABLE = "biz_faq_processed"
+CHECKPOINT_TABLE = "biz_faq_checkpoint"
+MAX_UTTERANCE_FAILURES = 3
+
+def ensure_processed_schema(conn, db_type):
+    """创建水位表，主键 (transcript_id, prompt_version) 即反连接使用的索引"""
+    cur = conn.cursor()
+    if db_type == 'postgres':
+        cur.execute(f"""
+            CREATE TABLE IF NOT EXISTS {PROCESSED_TABLE} (
+                transcript_id TEXT NOT NULL,
+                prompt_version TEXT NOT NULL,
+                content_hash TEXT,
+                processed_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+                status TEXT,
+                PRIMARY KEY (transcript_id, prompt_version)
+            )
+        """)
+        cur.execute(f"""
+            CREATE TABLE IF NOT EXISTS {CHECKPOINT_TABLE} (
+                transcript_id TEXT NOT NULL,
+                prompt_version TEXT NOT NULL,
+                utterance_ts BIGINT NOT NULL,
+                category TEXT,
+                failures INTEGER DEFAULT 0,
+                updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+                PRIMARY KEY (transcript_id, prompt_version, utterance_ts)
+            )
+        """)
+    else:
+        cur.execute(f"""
+            CREATE TABLE IF NOT EXISTS {PROCESSED_TABLE} (
+                transcript_id TEXT NOT NULL,
+                prompt_version TEXT NOT NULL,
+                content_hash TEXT,
+                processed_at TEXT,
+                status TEXT,
+                PRIMARY KEY (transcript_id, prompt_version)
+            )
+        """)
+        cur.execute(f"""
+            CREATE TABLE IF NOT EXISTS {CHECKPOINT_TABLE} (
+                transcript_id TEXT NOT NULL,
+                prompt_version TEXT NOT NULL,
+                utterance_ts INTEGER NOT NULL,
+                category TEXT,
+                failures INTEGER DEFAULT 0,
+                updated_at TEXT,
+                PRIMARY KEY (transcript_id, prompt_version, utterance_ts)
+            )
+        """)
+    conn.commit()
+    cur.close()
+
+def content_hash(content):
+    """通话内容摘要，便于发现转写内容在处理后又被更新的记录 (PostgreSQL JSON 列返回已解析的对象)"""
+    if not isinstance(content, str):
+        content = json.dumps(content, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+MARK_PROCESSED_SQL = f"""
+    INSERT INTO {PROCESSED_TABLE}
+    (transcript_id, prompt_version, content_hash, processed_at, status)
+    VALUES (%s, %s, %s, %s, %s)
+    ON CONFLICT (transcript_id, prompt_version) DO UPDATE SET
+        content_hash = EXCLUDED.content_hash,
+        processed_at = EXCLUDED.processed_at,
+        status = EXCLUDED.status
+"""
+
+def mark_processed(writer, transcript_id, prompt_version, digest, status):
+    """记录通话已处理 (经后台写入线程，排在该通话的日志与 FAQ 之后落库)"""
+    writer.submit(MARK_PROCESSED_SQL, (transcript_id, prompt_version, digest, writer.db.now(), status), transcript_id)
+
+CHECKPOINT_SQL = f"""
+    INSERT INTO {CHECKPOINT_TABLE}
+    (transcript_id, prompt_version, utterance_ts, category, failures, updated_at)
+    VALUES (%s, %s, %s, %s, 0, %s)
+    ON CONFLICT (transcript_id, prompt_version, utterance_ts) DO UPDATE SET
+        category = EXCLUDED.category,
+        updated_at = EXCLUDED.updated_at
+"""
+
+CHECKPOINT_FAILURE_SQL = f"""
+    INSERT INTO {CHECKPOINT_TABLE}
+    (transcript_id, prompt_version, utterance_ts, category, failures, updated_at)
+    VALUES (%s, %s, %s, NULL, 1, %s)
+    ON CONFLICT (transcript_id, prompt_version, utterance_ts) DO UPDATE SET
+        failures = {CHECKPOINT_TABLE}.failures + 1,
+        updated_at = EXCLUDED.updated_at
+"""
+
+CLEAR_CHECKPOINTS_SQL = f"DELETE FROM {CHECKPOINT_TABLE} WHERE transcript_id = %s AND prompt_version = %s"
+
+def save_checkpoint(writer, transcript_id, prompt_version, timestamp, category):
+    """记录一句发言的分类结果 (经后台写入线程)"""
+    writer.submit(CHECKPOINT_SQL, (transcript_id, prompt_version, timestamp, category, writer.db.now()), transcript_id)
+
+def record_failure(writer, transcript_id, prompt_version, timestamp):
+    """记录一句发言分类失败 (累计失败次数)"""
+    writer.submit(CHECKPOINT_FAILURE_SQL, (transcript_id, prompt_version, timestamp, writer.db.now()), transcript_id)
+
+def clear_checkpoints(writer, transcript_id, prompt_version):
+    """通话完成后删除断点 (排在水位之后落库)"""
+    writer.submit(CLEAR_CHECKPOINTS_SQL, (transcript_id, prompt_version), transcript_id)
+
+def load_checkpoints(db, cur, transcript_ids, prompt_version):
+    """读取一批通话的断点，返回 {transcript_id: {utterance_ts: (category, failures)}}"""
+    if not transcript_ids:
+        return {}
+    placeholders = ", ".join(["%s"] * len(transcript_ids))
+    db.execute(cur, f"""
+        SELECT transcript_id, utterance_ts, category, failures FROM {CHECKPOINT_TABLE}
+        WHERE prompt_version = %s AND transcript_id IN ({placeholders})
+    """, (prompt_version, *transcript_ids))
+    checkpoints = {}
+    for row in cur.fetchall():
+        checkpoints.setdefault(row['transcript_id'], {})[row['utterance_ts']] = (row['category'], row['failures'] or 0)
+    return checkpoints
+
+def backfill_processed(conn, db_type, prompt_version, prompt_ids):
+    """
+    一次性迁移: 水位表为空时，从日志表的 trace_id 中解析出历史上已处理的通话写入水位表
+    (status = 'legacy')，之后的运行不再扫描日志表
+    断点表非空说明已有新版本的运行 (只是通话都还未完成)，此时日志不代表通话已处理，不再迁移
+    """
+    cur = conn.cursor()
+    cur.execute(f"SELECT 1 FROM {PROCESSED_TABLE} LIMIT 1")
+    started = cur.fetchone()
+    if not started:
+        cur.execute(f"SELECT 1 FROM {CHECKPOINT_TABLE} LIMIT 1")
+        started = cur.fetchone()
+    if started:
+        cur.close()
+        return 0
+
+    if db_type == 'postgres':
+        cur.execute(f"""
+            INSERT INTO {PROCESSED_TABLE} (transcript_id, prompt_version, processed_at, status)
+            SELECT DISTINCT tid, %s, NOW(), 'legacy'
+            FROM (
+                SELECT SUBSTRING(id FROM 'faq_trace_([^_]+)_') AS tid
+                FROM log_prompt_execution
+                WHERE id LIKE 'faq_trace_%%' AND prompt_id = ANY(%s)
+            ) legacy
+            WHERE tid IS NOT NULL
+            ON CONFLICT DO NOTHING
+        """, (prompt_version, list(prompt_ids)))
+    else:
+        cur.execute(f"""
+            INSERT OR IGNORE INTO {PROCESSED_TABLE} (transcript_id, prompt_version, processed_at, status)
+            SELECT DISTINCT tid, ?, ?, 'legacy'
+            FROM (
+                SELECT SUBSTR(id, 11, INSTR(SUBSTR(id, 11), '_') - 1) AS tid
+                FROM log_prompt_execution
+                WHERE id LIKE 'faq_trace_%'
+            )
+            WHERE tid != ''
+        """, (prompt_version, datetime.now().isoformat()))
+    count = cur.rowcount
+    conn.commit()
+    cur.close()
+    return max(count, 0)
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+FAQ 分类 Prompt (V3: 结构化闭集)
+静态的分类定义与输出规则放在固定的 system 消息中，变化的上下文和目标发言放在 user 消息末尾，
+使每次请求的前缀完全一致，便于服务端的前缀缓存 (Prefix Cache) 命中
+"""
+
+# 分类列表 (14个封闭式分类)
+CATEGORIES = [
+    "价格咨询", "服务范围", "上门时间", "质保期",
+    "服务人员", "施工流程", "联系方式", "公司资质",
+    "材料品牌", "施工周期", "付款方式", "优惠活动",
+    "其他问题", "非问题"
+]
+
+# 修改 system 消息时递增版本号，便于按版本对比效果
+PROMPT_VERSION = "faq_v3_sys1"
+
+CATEGORY_GUIDE = """## 可选分类（必须从中选择）：
+1. 价格咨询 - 询问费用、报价、价格、多少钱、贵不贵
+2. 服务范围 - 询问能否处理某类问题、是否提供某项服务、能不能做
+3. 上门时间 - 询问什么时候能来、多久到、预约时间、今天/明天可以吗
+4. 质保期 - 询问保修期限、质保多久、售后保障
+5. 服务人员 - 询问师傅资质、是否外包、技术人员信息
+6. 施工流程 - 询问怎么做、施工步骤、工艺方法、要做什么
+7. 联系方式 - 询问电话、微信、如何联系、留个号码
+8. 公司资质 - 询问公司规模、资质证书、是否正规、什么公司
+9. 材料品牌 - 询问使用什么材料、品牌、材料质量
+10. 施工周期 - 询问要做多久、工期、几天能完工
+11. 付款方式 - 询问怎么付款、能否分期、什么时候付
+12. 优惠活动 - 询问有没有优惠、折扣、活动
+13. 其他问题 - 是提问，但不属于以上任何分类（将被系统丢弃，请谨慎选择）
+14. 非问题 - 不是提问（陈述、回应、语气词、拒绝、报号码）"""
+
+FAQ_SYSTEM_PROMPT = f"""你是一个客服对话分类助手。你的任务是判断客户发言是否为提问，并从以下分类中选择一个。
+
+{CATEGORY_GUIDE}
+
+## 输出要求：
+- 只输出 JSON 格式
+- category 必须是上面 14 个分类之一
+- 格式: {{"category": "分类名", "reason": "简短理由"}}"""
+
+FAQ_BATCH_SYSTEM_PROMPT = f"""你是一个客服对话分类助手。你的任务是逐条判断客户发言是否为提问，并为每一条从以下分类中选择一个。
+
+{CATEGORY_GUIDE}
+
+## 输出要求：
+- 只输出 JSON 数组，每条待分类发言对应一个元素
+- category 必须是上面 14 个分类之一
+- 格式: [{{"index": 0, "category": "分类名"}}, {{"index": 1, "category": "分类名"}}]"""
+
+# 上下文升级模式第一阶段: 只带最近几句上下文，要求模型给出把握程度，把握不足时再带完整上下文重问
+FAQ_CONFIDENCE_SYSTEM_PROMPT = f"""你是一个客服对话分类助手。你的任务是判断客户发言是否为提问，并从以下分类中选择一个。
+对话上下文只包含最近几句；如果仅凭这些信息无法确定分类 (例如发言指代前文提到的内容)，请给出较低的 confidence。
+
+{CATEGORY_GUIDE}
+
+## 输出要求：
+- 只输出 JSON 格式
+- category 必须是上面 14 个分类之一
+- confidence 为 0 到 1 之间的数字，表示对分类结果的把握
+- 格式: {{"category": "分类名", "confidence": 0.9, "reason": "简短理由"}}"""
+
+# 低延迟调用配置 (--call-profile fast): 不再生成 reason (流水线从不使用)，输出只有几个 Token
+FAQ_FAST_SYSTEM_PROMPT = f"""你是一个客服对话分类助手。你的任务是判断客户发言是否为提问，并从以下分类中选择一个。
+
+{CATEGORY_GUIDE}
+
+## 输出要求：
+- 只输出 JSON 格式，不要输出理由或其他内容
+- category 必须是上面 14 个分类之一
+- 格式: {{"category": "分类名"}}"""
+
+FAQ_FAST_CONFIDENCE_SYSTEM_PROMPT = f"""你是一个客服对话分类助手。你的任务是判断客户发言是否为提问，并从以下分类中选择一个。
+对话上下文只包含最近几句；如果仅凭这些信息无法确定分类 (例如发言指代前文提到的内容)，请给出较低的 confidence。
+
+{CATEGORY_GUIDE}
+
+## 输出要求：
+- 只输出 JSON 格式，不要输出理由或其他内容
+- category 必须是上面 14 个分类之一
+- confidence 为 0 到 1 之间的数字，表示对分类结果的把握
+- 格式: {{"category": "分类名", "confidence": 0.9}}"""
+
+def build_user_prompt(history_str, text):
+    """单句模式 user 消息: 对话上下文 + 当前客户发言"""
+    return f"""## 对话上下文：
+{history_str}
+
+## 当前客户发言：
+"{text}\""""
+
+def build_batch_user_prompt(history_str, texts):
+    """批量模式 user 消息: 共享上下文 + 编号的待分类发言"""
+    targets = "\n".join(f'[{i}] "{text}"' for i, text in enumerate(texts))
+    return f"""## 对话上下文：
+{history_str}
+
+## 待分类的客户发言（共 {len(texts)} 条，编号对应上下文中的客户发言）：
+{targets}"""
+
+def build_repair_prompt(confidence=False):
+    """格式修复重试的追加 user 消息: 上一条回复无法解析时，只要求按格式重新输出 (不重复上下文)"""
+    schema = '{"category": "分类名", "confidence": 0.9}' if confidence else '{"category": "分类名"}'
+    return f"""上一条回复无法解析。请只输出 JSON，不要输出其他内容。
+格式: {schema}
+category 必须是以下之一: {"、".join(CATEGORIES)}"""
+
+def build_messages(user_prompt, batch=False, confidence=False, fast=False):
+    """
+    组装请求消息: 固定 system 前缀 + 变化的 user 内容
+    confidence: 上下文升级模式第一阶段；fast: 不输出 reason 的单句 system 消息 (批量输出本来就没有 reason)
+    """
+    if batch:
+        system_prompt = FAQ_BATCH_SYSTEM_PROMPT
+    elif fast:
+        system_prompt = FAQ_FAST_CONFIDENCE_SYSTEM_PROMPT if confidence else FAQ_FAST_SYSTEM_PROMPT
+    else:
+        system_prompt = FAQ_CONFIDENCE_SYSTEM_PROMPT if confidence else FAQ_SYSTEM_PROMPT
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_prompt},
+    ]
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+通话内容的解析与渲染
+analyze_faq_ci.py 分析时与 faq_log_format 重建 Prompt 时共用同一套规则:
+- 解析 sync_transcripts.content，渲染为 "销售: xxx" / "客户: xxx" 对话行
+- 噪音过滤: 语气词、寒暄、报号码等发言不作为待分类发言，也不进入上下文
+- 待分类发言的上下文区间 (单句 / 上下文升级第一阶段 / 批量) 与对应的 user 消息
+"""
+
+import re
+import json
+from faq_context import ContextWindow
+from faq_prompts import build_user_prompt, build_batch_user_prompt
+
+# 上下文 Token 预算 (估算): 超出时从最早的发言裁剪，语气词等填充发言不进入上下文
+CONTEXT_TOKEN_BUDGET = 400
+# 上下文升级模式 (--escalate) 第一阶段保留的最近非填充发言数
+ESCALATION_CONTEXT_TURNS = 2
+
+def format_timestamp(ms):
+    """毫秒转 MM:SS"""
+    seconds = ms // 1000
+    return f"{seconds // 60:02d}:{seconds % 60:02d}"
+
+def is_valid_safety_check(text):
+    """启发式过滤噪音"""
+    if len(text) < 2:
+        return False
+    
+    clean_text = re.sub(r'[。，！？、\.,;!?\s]', '', text).strip()
+    if len(clean_text) < 2:
+        return False
+    
+    STOPWORDS = {
+        "喂", "喂喂", "哎", "你好", "嗯", "嗯嗯", "嗯啊",
+        "好", "好的", "好吧", "对", "对对", "对的", "行", "行的",
+        "啊", "哦", "噢", "呃", "额", "诶",
+        "是", "是的", "可以", "没问题",
+        "谢谢", "谢谢你", "再见", "拜拜", "不用了", "不需要",
+        "知道了", "明白", "了解", "收到"
+    }
+    if clean_text in STOPWORDS:
+        return False
+        
+    digit_count = sum(1 for c in text if c.isdigit() or c in "零一二三四五六七八九幺")
+    if len(text) > 0 and (digit_count / len(text)) > 0.5:
+        return False
+        
+    return True
+
+def parse_transcript(content):
+    """解析 content (可能是 JSON 字符串或已解析的对象)"""
+    try:
+        if isinstance(content, str):
+            return json.loads(content)
+        return content
+    except:
+        return None
+
+def is_context_line(line):
+    """渲染后的对话行是否进入上下文: 语气词、寒暄、报号码等填充发言 (同客户发言的噪音规则) 不进入"""
+    return is_valid_safety_check(line.split(": ", 1)[-1])
+
+def iter_candidates(transcript_items, budget=CONTEXT_TOKEN_BUDGET):
+    """
+    遍历对话，找出需要分类的客户发言
+    返回 (lines, candidates):
+      lines: 渲染后的对话行 ("销售: xxx")
+      candidates: [{"text", "timestamp", "index", "start", "short_start"}]，index 为该发言在 lines 中的位置，顺序与原对话一致；
+                  start 为上下文起点: 之前的非填充发言按 budget 从最早的一句开始裁剪后剩下的第一句；
+                  short_start 为上下文升级模式第一阶段的起点 (最近 ESCALATION_CONTEXT_TURNS 句)
+    """
+    lines = []
+    candidates = []
+    window = ContextWindow(budget)
+    
+    for item in transcript_items:
+        speaker = item.get("SpeakerId", "")
+        text = item.get("Text", "").strip()
+        timestamp = item.get("BeginTime", 0)
+        
+        if not text:
+            continue
+        
+        line = f"{'销售' if speaker == '1' else '客户'}: {text}"
+        lines.append(line)
+        index = len(lines) - 1
+        
+        if speaker == "2" and len(text) >= 4 and is_valid_safety_check(text):
+            candidates.append({"text": text, "timestamp": timestamp, "index": index,
+                               "start": window.start(index),
+                               "short_start": window.recent_start(ESCALATION_CONTEXT_TURNS, index)})
+        if is_context_line(line):
+            window.push(index, line)
+    
+    return lines, candidates
+
+def render_context(lines, start, end):
+    """上下文区间 [start, end) 内的非填充发言 (日志重建 Prompt 时使用同一规则)"""
+    return "\n".join(line for line in lines[start:end] if is_context_line(line))
+
+def candidate_span(candidate):
+    """单句模式上下文区间 [start, end): 当前发言之前、预算以内的若干句"""
+    return candidate["start"], candidate["index"]
+
+def short_span(candidate):
+    """上下文升级模式第一阶段的上下文区间: 当前发言之前最近几句非填充发言"""
+    return candidate["short_start"], candidate["index"]
+
+def batch_span(group):
+    """批量模式上下文区间: 从首句的上下文起点起，到末句为止"""
+    return group[0]["start"], group[-1]["index"] + 1
+
+def candidate_prompt(lines, candidate):
+    """单句模式 user 消息: 当前发言之前的上下文 + 当前发言"""
+    start, end = candidate_span(candidate)
+    return build_user_prompt(render_context(lines, start, end), candidate["text"])
+
+def batch_prompt(lines, group):
+    """批量模式 user 消息: 共享上下文 + 编号的待分类发言"""
+    start, end = batch_span(group)
+    return build_batch_user_prompt(render_context(lines, start, end), [c["text"] for c in group])
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""
+后台批量写入线程 (Buffered Writer)
+分析循环只把日志 / FAQ 行放入队列，由独立线程按条数或时间批量写库:
+- PostgreSQL: psycopg2 execute_batch，一次往返写入一批
+- SQLite: executemany，整批在同一个事务中提交
+写入线程从连接池借出自己的连接 (与分析循环互不干扰)，退出或收到 SIGTERM 时先清空队列再关闭
+批量失败时逐行重试: 同一分组 (通话) 中有一行写入失败，该分组之后的写入 (断点、水位、队列完成) 一并放弃，
+直到 end_group 标记为止，通话不会被记为已处理，下次运行重新分析
+SQL 按 PostgreSQL 写法提交，由 faq_db 转换为当前方言
+"""
+
+import queue
+import threading
+import time
+
+_STOP = object()
+
+class BufferedWriter:
+    """
+    db: faq_db.Database，写入线程从其连接池借出连接
+    flush_size: 缓冲达到多少行时写库
+    flush_interval: 距上次写库超过多少秒时写库
+    """
+
+    def __init__(self, db, flush_size=200, flush_interval=2.0):
+        self.db = db
+        self.flush_size = max(1, flush_size)
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue()
+        self.stats = {"rows": 0, "flushes": 0, "failed": 0, "dropped": 0}
+        # 有写入失败、尚未收到 end_group 的分组 (仅写入线程访问)
+        self._failed_groups = set()
+        self._ready = threading.Event()
+        self._error = None
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="faq-writer", daemon=True)
+        self._thread.start()
+        self._ready.wait()
+        if self._error:
+            raise self._error
+
+    def submit(self, sql, params, group=None):
+        """
+        提交一行写入 (非阻塞)
+        group: 所属分组 (通话 ID)，组内有一行写入失败时，之后同组的写入都不再执行
+        """
+        if self._closed:
+            raise RuntimeError("BufferedWriter 已关闭")
+        self.queue.put((sql, params, group))
+
+    def end_group(self, group):
+        """分组的写入已全部提交: 之后同组的写入 (例如重新分析同一通话) 不再受之前失败的影响"""
+        if self._closed:
+            raise RuntimeError("BufferedWriter 已关闭")
+        self.queue.put((None, None, group))
+
+    def flush(self):
+        """阻塞直到当前队列中的行全部写入"""
+        done = threading.Event()
+        self.queue.put(done)
+        done.wait()
+
+    def close(self):
+        """写完剩余数据后停止线程 (可重复调用)"""
+        if self._closed:
+            return
+        self._closed = True
+        self.queue.put(_STOP)
+        self._thread.join()
+
+    def _run(self):
+        try:
+            conn = self.db.getconn()
+        except Exception as e:
+            self._error = e
+            self._ready.set()
+            return
+        self._ready.set()
+
+        buffer = []
+        last_flush = time.monotonic()
+        running = True
+        while running:
+            timeout = max(0.0, self.flush_interval - (time.monotonic() - last_flush))
+            try:
+                item = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+
+            waiters = []
+            if item is _STOP:
+                running = False
+            elif isinstance(item, threading.Event):
+                waiters.append(item)
+            elif item is not None:
+                buffer.append(item)
+
+            due = time.monotonic() - last_flush >= self.flush_interval
+            if buffer and (len(buffer) >= self.flush_size or due or waiters or not running):
+                self._write(conn, buffer)
+                buffer = []
+            if due or waiters or not running:
+                last_flush = time.monotonic()
+            for event in waiters:
+                event.set()
+
+        self.db.putconn(conn)
+
+    def _write(self, conn, rows):
+        """按原顺序把连续的同一条 SQL 合并成一批执行，整批一个事务"""
+        if any(sql is not None and group in self._failed_groups for sql, _, group in rows):
+            # 缓冲中有已失败分组的后续写入: 逐行处理以便按顺序放弃
+            self._write_rows(conn, rows)
+            return
+
+        runs = []
+        for sql, params, group in rows:
+            if sql is None:
+                continue
+            if runs and runs[-1][0] == sql:
+                runs[-1][1].append(params)
+            else:
+                runs.append((sql, [params]))
+
+        cur = conn.cursor()
+        try:
+            for sql, batch in runs:
+                self.db.executemany(cur, sql, batch, page_size=self.flush_size)
+            conn.commit()
+            self.stats["rows"] += sum(1 for sql, _, _ in rows if sql is not None)
+            self.stats["flushes"] += 1
+            for sql, _, group in rows:
+                if sql is None:
+                    self._failed_groups.discard(group)
+        except Exception as e:
+            conn.rollback()
+            print(f"⚠️ 批量写入失败，改为逐行写入: {e}")
+            self._write_rows(conn, rows)
+        finally:
+            cur.close()
+
+    def _write_rows(self, conn, rows):
+        """批量失败时逐行重试，跳过有问题的行；分组内有行失败时放弃该分组之后的写入"""
+        cur = conn.cursor()
+        for sql, params, group in rows:
+            if sql is None:
+                self._failed_groups.discard(group)
+                continue
+            if group is not None and group in self._failed_groups:
+                self.stats["dropped"] += 1
+                continue
+            try:
+                self.db.execute(cur, sql, params)
+                conn.commit()
+                self.stats["rows"] += 1
+            except Exception as e:
+                conn.rollback()
+                self.stats["failed"] += 1
+                if group is None:
+                    print(f"❌ 写入失败 (已跳过): {e}")
+                else:
+                    self._failed_groups.add(group)
+                    print(f"❌ 写入失败 (已跳过，{str(group)[:20]}... 的后续写入一并放弃，下次运行重新分析): {e}")
+        cur.close()
+
+    def summary(self):
+        s = self.stats
+        avg = s["rows"] / s["flushes"] if s["flushes"] else 0
+        return (f"写入 {s['rows']} 行 | 批次 {s['flushes']} 次 (平均 {avg:.0f} 行/批) | 失败 {s['failed']} 行 | "
+                f"放弃 {s['dropped']} 行 (所属通话有写入失败)")
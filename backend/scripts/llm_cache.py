@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+LLM 响应缓存 (Content-Addressed Cache)
+- Key = sha256(model + messages + 调用参数)，同一 Prompt 不会重复调用 API
+- 存储在当前数据库的 cache_llm_response 表 (PostgreSQL / SQLite 均可)
+- 支持按条数 (LRU) 和按天数淘汰，运行期间统计命中/未命中
+- 异步调用方 (analyze_faq_ci.py) 在线程中用连接池的连接 fetch()，写入经 BufferedWriter 排队，
+  不在事件循环线程上阻塞等待数据库往返
+"""
+
+import json
+import time
+import hashlib
+
+class LLMResponseCache:
+    """基于数据库表的 LLM 响应缓存，时间字段统一使用 epoch 秒，兼容两种方言"""
+
+    TABLE = "cache_llm_response"
+    # PostgreSQL 写法 (经 faq_db / BufferedWriter 转换方言)，已存在则保留原记录
+    PUT_SQL = f"""
+        INSERT INTO {TABLE} (cache_key, model, response, created_at, last_hit_at, hit_count)
+        VALUES (%s, %s, %s, %s, %s, 0)
+        ON CONFLICT (cache_key) DO NOTHING
+    """
+
+    def __init__(self, conn, db_type, max_entries=200000, max_age_days=30, autocommit=True):
+        self.conn = conn
+        self.autocommit = autocommit  # False 时写入随调用方的批量事务一起提交
+        self.db_type = db_type
+        self.placeholder = '%s' if db_type == 'postgres' else '?'
+        self.max_entries = max_entries
+        self.max_age_days = max_age_days
+        self.hits = 0
+        self.misses = 0
+        self._pending_hits = {}
+
+    def ensure_schema(self):
+        """创建缓存表与淘汰用索引"""
+        cur = self.conn.cursor()
+        cur.execute(f"""
+            CREATE TABLE IF NOT EXISTS {self.TABLE} (
+                cache_key TEXT PRIMARY KEY,
+                model TEXT,
+                response TEXT,
+                created_at BIGINT,
+                last_hit_at BIGINT,
+                hit_count INTEGER DEFAULT 0
+            )
+        """)
+        cur.execute(f"CREATE INDEX IF NOT EXISTS idx_{self.TABLE}_last_hit ON {self.TABLE} (last_hit_at)")
+        self.conn.commit()
+        cur.close()
+
+    @staticmethod
+    def make_key(model, messages, params):
+        """对 model + messages + 参数做规范化序列化后取 sha256"""
+        payload = json.dumps(
+            {"model": model, "messages": messages, "params": params},
+            ensure_ascii=False, sort_keys=True, separators=(",", ":")
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def fetch(self, key, conn=None):
+        """只查询不计数 (conn 为空时使用 self.conn；可在其他线程中传入连接池借出的连接)"""
+        cur = (conn or self.conn).cursor()
+        cur.execute(f"SELECT response FROM {self.TABLE} WHERE cache_key = {self.placeholder}", (key,))
+        row = cur.fetchone()
+        cur.close()
+        return row[0] if row is not None else None
+
+    def record(self, key, response):
+        """统计一次查询结果 (命中记录延迟到 flush() 批量更新，避免每次命中都写库)"""
+        if response is None:
+            self.misses += 1
+            return
+        self.hits += 1
+        self._pending_hits[key] = self._pending_hits.get(key, 0) + 1
+
+    def get(self, key):
+        """查询缓存，命中返回原始输出文本，否则返回 None"""
+        response = self.fetch(key)
+        self.record(key, response)
+        return response
+
+    def put(self, key, model, response, writer=None):
+        """写入缓存 (已存在则保留原记录)；传入 writer 时经后台写入线程排队"""
+        now = int(time.time())
+        if writer is not None:
+            writer.submit(self.PUT_SQL, (key, model, response, now, now))
+            return
+        p = self.placeholder
+        cur = self.conn.cursor()
+        if self.db_type == 'postgres':
+            cur.execute(f"""
+                INSERT INTO {self.TABLE} (cache_key, model, response, created_at, last_hit_at, hit_count)
+                VALUES ({p}, {p}, {p}, {p}, {p}, 0)
+                ON CONFLICT (cache_key) DO NOTHING
+            """, (key, model, response, now, now))
+        else:
+            cur.execute(f"""
+                INSERT OR IGNORE INTO {self.TABLE} (cache_key, model, response, created_at, last_hit_at, hit_count)
+                VALUES (?, ?, ?, ?, ?, 0)
+            """, (key, model, response, now, now))
+        if self.autocommit:
+            self.conn.commit()
+        cur.close()
+
+    def flush(self):
+        """批量写回命中次数与最近命中时间 (用于 LRU 淘汰)"""
+        if not self._pending_hits:
+            return
+        p = self.placeholder
+        now = int(time.time())
+        cur = self.conn.cursor()
+        cur.executemany(
+            f"UPDATE {self.TABLE} SET hit_count = hit_count + {p}, last_hit_at = {p} WHERE cache_key = {p}",
+            [(count, now, key) for key, count in self._pending_hits.items()]
+        )
+        self.conn.commit()
+        cur.close()
+        self._pending_hits = {}
+
+    def evict(self):
+        """淘汰过期记录和超出容量的最久未命中记录，返回删除条数"""
+        p = self.placeholder
+        cur = self.conn.cursor()
+        deleted = 0
+        if self.max_age_days:
+            cutoff = int(time.time()) - self.max_age_days * 86400
+            cur.execute(f"DELETE FROM {self.TABLE} WHERE created_at < {p}", (cutoff,))
+            deleted += cur.rowcount
+        if self.max_entries:
+            offset = "OFFSET %s" if self.db_type == 'postgres' else "LIMIT -1 OFFSET ?"
+            cur.execute(f"""
+                DELETE FROM {self.TABLE} WHERE cache_key IN (
+                    SELECT cache_key FROM {self.TABLE} ORDER BY last_hit_at DESC {offset}
+                )
+            """, (self.max_entries,))
+            deleted += cur.rowcount
+        self.conn.commit()
+        cur.close()
+        return deleted
+
+    def summary(self):
+        """命中统计摘要"""
+        total = self.hits + self.misses
+        rate = self.hits / total * 100 if total else 0
+        return f"命中 {self.hits} 次 | 未命中 {self.misses} 次 | 命中率 {rate:.1f}%"
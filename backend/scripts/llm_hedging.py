@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+对冲请求 (Hedged Requests): 削减 LLM 调用的长尾耗时
+单次调用超时为 30 秒，偶发卡住的请求会拖住整个通话的分析，一次运行的墙钟时间由 p99 而不是中位数决定。
+- 记录最近 window 次主请求的耗时，滚动计算 p95 作为对冲延迟 (不低于 min_delay)
+- 主请求超过对冲延迟仍未返回时，发出一个相同的对冲请求，先返回有效结果的一方胜出，另一方被取消
+- 额外花费上限: 对冲请求数不超过已发出主请求数的 max_ratio (达到上限后只等待主请求)
+- 被取消的主请求无法得知实际耗时，节省的时间按 "同样超过对冲延迟、最终由主请求返回" 的平均耗时估算
+  (尚无样本时按请求超时计算)
+只包住单次 API 请求: 调用方在限流器取得额度之后调用 run()，排队与重试退避不计入耗时样本
+仅用于 asyncio (analyze_faq_ci.py)
+"""
+
+import time
+import asyncio
+from collections import deque
+
+def percentile(values, p):
+    """values 的 p 分位数 (0~1，最近秩法)，空时返回 None"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+class RequestHedger:
+    """
+    max_ratio: 对冲请求数 / 主请求数 的上限
+    window: 计算 p95 的最近主请求耗时样本数；min_samples 个样本之前不对冲
+    timeout: 单次请求超时 (秒)，用于估算被取消的主请求耗时
+    """
+
+    def __init__(self, max_ratio=0.1, window=200, min_samples=20, min_delay=1.0, timeout=30.0):
+        self.max_ratio = max_ratio
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        self.timeout = timeout
+        self.latencies = deque(maxlen=window)
+        # 运行期间每次调用的实际耗时 (含对冲效果)，用于汇总分位数
+        self.observed = deque(maxlen=100000)
+        self.slow_primaries = deque(maxlen=window)
+        self.stats = {"calls": 0, "hedged": 0, "hedge_wins": 0, "capped": 0, "saved": 0.0}
+
+    def delay(self):
+        """当前对冲延迟 (秒)，样本不足时返回 None (不对冲)"""
+        if not self.latencies or len(self.latencies) < self.min_samples:
+            return None
+        return max(self.min_delay, percentile(self.latencies, 0.95))
+
+    def _budget_left(self):
+        return self.stats["hedged"] < self.max_ratio * self.stats["calls"]
+
+    def _estimated_primary(self):
+        """被取消的主请求的估算耗时"""
+        if self.slow_primaries:
+            return sum(self.slow_primaries) / len(self.slow_primaries)
+        return self.timeout
+
+    async def run(self, make_call, valid=None, make_hedge=None):
+        """
+        执行 make_call() (返回协程)，超过对冲延迟时并行发出对冲请求 make_hedge() (默认同 make_call)
+        make_hedge 负责对冲请求自己的限流额度等前置步骤
+        valid(result) 为 False 的结果不算胜出 (等待另一方)；双方都失败时抛出主请求的异常
+        """
+        self.stats["calls"] += 1
+        start = time.monotonic()
+        primary = asyncio.ensure_future(make_call())
+        tasks = [primary]
+        try:
+            delay = self.delay()
+            if delay is not None:
+                done, _ = await asyncio.wait({primary}, timeout=delay)
+                if not done and not self._budget_left():
+                    self.stats["capped"] += 1
+                    delay = None
+            if delay is None or primary.done():
+                try:
+                    return await primary
+                finally:
+                    self._record_primary(primary, start, delay)
+
+            self.stats["hedged"] += 1
+            hedge = asyncio.ensure_future((make_hedge or make_call)())
+            tasks.append(hedge)
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None and (valid is None or valid(task.result())):
+                        self._record_winner(task is hedge, start)
+                        return task.result()
+            # 双方都没有有效结果: 与未对冲时一样交给调用方处理主请求的结果
+            self._record_primary(primary, start, delay)
+            return primary.result()
+        finally:
+            # 输家 (以及外部取消时仍在进行的请求) 立即取消
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    def _record_primary(self, primary, start, delay):
+        elapsed = time.monotonic() - start
+        self.observed.append(elapsed)
+        if primary.cancelled() or primary.exception() is not None:
+            return
+        self.latencies.append(elapsed)
+        if delay is not None and elapsed > delay:
+            self.slow_primaries.append(elapsed)
+
+    def _record_winner(self, hedge_won, start):
+        elapsed = time.monotonic() - start
+        self.observed.append(elapsed)
+        if not hedge_won:
+            self.latencies.append(elapsed)
+            self.slow_primaries.append(elapsed)
+            return
+        self.stats["hedge_wins"] += 1
+        self.stats["saved"] += max(0.0, self._estimated_primary() - elapsed)
+
+    def summary(self):
+        s = self.stats
+        if not s["calls"]:
+            return "无"
+        observed = list(self.observed)
+        p50, p95, p99 = (percentile(observed, p) or 0 for p in (0.5, 0.95, 0.99))
+        delay = self.delay()
+        return (f"对冲 {s['hedged']}/{s['calls']} 次 ({s['hedged'] / s['calls']:.1%}) | 对冲请求胜出 {s['hedge_wins']} 次 | "
+                f"预算用尽 {s['capped']} 次 | 估算节省尾部耗时 {s['saved']:.1f}s | "
+                f"耗时 P50 {p50:.2f}s / P95 {p95:.2f}s / P99 {p99:.2f}s | "
+                f"当前对冲延迟 {f'{delay:.2f}s' if delay is not None else '样本不足'}")
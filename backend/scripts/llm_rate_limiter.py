@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+"""
+LLM 客户端限流器 (Adaptive Rate Limiter)
+- 请求速率预算 (RPS) + Token 速率预算 (TPM)
+- AIMD 自适应: 成功时线性加速，遇到 429/超时时成倍降速
+- 可重试错误使用带抖动的指数退避，避免丢弃调用
+同时支持同步 (analyze_faq_local.py) 和 asyncio (analyze_faq_ci.py) 调用方式
+"""
+
+import time
+import random
+import asyncio
+import threading
+
+try:
+    import openai
+    RETRYABLE_ERRORS = (
+        openai.RateLimitError,
+        openai.APITimeoutError,
+        openai.APIConnectionError,
+        openai.InternalServerError,
+    )
+    THROTTLE_ERRORS = (openai.RateLimitError, openai.APITimeoutError)
+except ImportError:
+    RETRYABLE_ERRORS = ()
+    THROTTLE_ERRORS = ()
+
+def is_retryable(error):
+    """判断错误是否值得重试 (429 / 超时 / 连接错误 / 5xx)"""
+    if isinstance(error, RETRYABLE_ERRORS) or isinstance(error, (TimeoutError, asyncio.TimeoutError)):
+        return True
+    status = getattr(error, "status_code", None)
+    return status == 429 or (status is not None and status >= 500)
+
+def is_throttle(error):
+    """判断错误是否说明服务端已过载 (需要降速)"""
+    if isinstance(error, THROTTLE_ERRORS) or isinstance(error, (TimeoutError, asyncio.TimeoutError)):
+        return True
+    return getattr(error, "status_code", None) == 429
+
+def retry_after_seconds(error):
+    """读取 429 响应中的 Retry-After 头 (秒)，没有则返回 None"""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+def estimate_tokens(text):
+    """粗略估算 Token 数: 中文约 1 字 1 Token，保守按字符数计算"""
+    return len(text)
+
+class AdaptiveRateLimiter:
+    """
+    线程安全的自适应限流器
+
+    rps: 初始请求速率 (次/秒)，AIMD 在 [min_rps, max_rps] 之间调整
+    tpm: 每分钟 Token 预算 (0 = 不限制)
+    """
+
+    def __init__(self, rps=5.0, tpm=0, min_rps=0.5, max_rps=50.0,
+                 increase_step=0.5, decrease_factor=0.5,
+                 max_retries=5, base_delay=1.0, max_delay=30.0):
+        self.rate = float(rps)
+        self.tpm = tpm
+        self.min_rps = min_rps
+        self.max_rps = max(max_rps, rps)
+        self.increase_step = increase_step
+        self.decrease_factor = decrease_factor
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+        self._lock = threading.Lock()
+        self._next_request_at = time.monotonic()
+        self._token_balance = float(tpm)
+        self._token_updated_at = time.monotonic()
+        self._success_streak = 0
+        self._last_decrease_at = 0.0
+
+        # 统计
+        self.stats = {"requests": 0, "retries": 0, "throttled": 0, "given_up": 0}
+
+    def _reserve(self, tokens):
+        """预留一次请求额度，返回需要等待的秒数"""
+        with self._lock:
+            now = time.monotonic()
+            self.stats["requests"] += 1
+
+            # RPS: 按速率排队 (GCRA)
+            start_at = max(now, self._next_request_at)
+            self._next_request_at = start_at + 1.0 / self.rate
+            wait = start_at - now
+
+            # TPM: 令牌桶，允许余额为负 (由后续请求等待补齐)
+            if self.tpm:
+                refill = self.tpm / 60.0
+                elapsed = now - self._token_updated_at
+                self._token_balance = min(self.tpm, self._token_balance + elapsed * refill)
+                self._token_updated_at = now
+                self._token_balance -= tokens
+                if self._token_balance < 0:
+                    wait = max(wait, -self._token_balance / refill)
+            return wait
+
+    def acquire(self, tokens=0):
+        """同步获取额度 (阻塞等待)"""
+        wait = self._reserve(tokens)
+        if wait > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self, tokens=0):
+        """异步获取额度"""
+        wait = self._reserve(tokens)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def settle(self, estimated, actual):
+        """用 response.usage 的实际 Token 数修正预估值"""
+        if not self.tpm or actual is None:
+            return
+        with self._lock:
+            self._token_balance += estimated - actual
+
+    def on_success(self):
+        """加性增: 每成功约 1 秒的请求量，速率 +increase_step"""
+        with self._lock:
+            self._success_streak += 1
+            if self._success_streak >= self.rate:
+                self._success_streak = 0
+                self.rate = min(self.max_rps, self.rate + self.increase_step)
+
+    def on_throttle(self):
+        """乘性减: 遇到限流/超时时速率减半 (1 秒内同一波并发只减一次)"""
+        with self._lock:
+            self.stats["throttled"] += 1
+            self._success_streak = 0
+            now = time.monotonic()
+            if now - self._last_decrease_at < 1.0:
+                return
+            self._last_decrease_at = now
+            self.rate = max(self.min_rps, self.rate * self.decrease_factor)
+            self._next_request_at = max(self._next_request_at, now + 1.0 / self.rate)
+
+    def backoff_delay(self, attempt, error=None):
+        """带抖动的指数退避 (Full Jitter)，优先遵守 Retry-After"""
+        retry_after = retry_after_seconds(error) if error is not None else None
+        if retry_after is not None:
+            return min(self.max_delay, retry_after) + random.uniform(0, self.base_delay)
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+    def _handle_error(self, error, attempt):
+        """处理一次失败，返回退避秒数；不可重试或重试耗尽时重新抛出"""
+        if not is_retryable(error) or attempt >= self.max_retries:
+            if is_retryable(error):
+                with self._lock:
+                    self.stats["given_up"] += 1
+            raise error
+        if is_throttle(error):
+            self.on_throttle()
+        with self._lock:
+            self.stats["retries"] += 1
+        return self.backoff_delay(attempt, error)
+
+    def call(self, fn, tokens=0, before=None):
+        """
+        同步调用 fn()，自动限流 + 重试
+        before: 每次尝试获取额度之前调用 (如检查运行预算)，抛出的异常直接向上传递，
+        被拒绝的尝试不占用额度、不计入请求次数
+        """
+        attempt = 0
+        while True:
+            if before:
+                before()
+            self.acquire(tokens)
+            try:
+                result = fn()
+            except Exception as e:
+                time.sleep(self._handle_error(e, attempt))
+                attempt += 1
+                continue
+            self.on_success()
+            self._settle_usage(result, tokens)
+            return result
+
+    async def call_async(self, fn, tokens=0, before=None):
+        """异步调用 await fn()，自动限流 + 重试 (before 同 call)"""
+        attempt = 0
+        while True:
+            if before:
+                before()
+            await self.acquire_async(tokens)
+            try:
+                result = await fn()
+            except Exception as e:
+                await asyncio.sleep(self._handle_error(e, attempt))
+                attempt += 1
+                continue
+            self.on_success()
+            self._settle_usage(result, tokens)
+            return result
+
+    def _settle_usage(self, response, tokens):
+        usage = getattr(response, "usage", None)
+        self.settle(tokens, getattr(usage, "total_tokens", None) if usage else None)
+
+    def summary(self):
+        """运行结束时的统计摘要"""
+        s = self.stats
+        return (f"请求 {s['requests']} 次 | 重试 {s['retries']} 次 | 限流 {s['throttled']} 次 | "
+                f"放弃 {s['given_up']} 次 | 当前速率 {self.rate:.1f} req/s")
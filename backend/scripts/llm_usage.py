@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+LLM Token 用量统计
+- 从 response.usage 读取 prompt / completion / 前缀缓存命中 (cached) Token 数
+- 为 log_prompt_execution 补充用量列，按调用记录
+- 汇总每次运行的总用量，用于评估 Prompt 精简与前缀缓存的实际收益
+"""
+
+USAGE_COLUMNS = ("prompt_tokens", "completion_tokens", "cached_tokens")
+
+def extract_usage(response):
+    """读取 response.usage，返回 {"prompt_tokens", "completion_tokens", "cached_tokens"} 或 None"""
+    usage = getattr(response, "usage", None)
+    if usage is None:
+        return None
+    details = getattr(usage, "prompt_tokens_details", None)
+    return {
+        "prompt_tokens": getattr(usage, "prompt_tokens", None),
+        "completion_tokens": getattr(usage, "completion_tokens", None),
+        "cached_tokens": getattr(details, "cached_tokens", None) if details else None,
+    }
+
+def split_usage(usage, parts):
+    """把一次批量请求的用量平摊到多条日志 (余数计入第一条)"""
+    if not usage or parts <= 1:
+        return [usage] * max(parts, 1)
+    result = []
+    for i in range(parts):
+        share = {}
+        for key, value in usage.items():
+            if value is None:
+                share[key] = None
+            else:
+                share[key] = value // parts + (value % parts if i == 0 else 0)
+        result.append(share)
+    return result
+
+def merge_usage(first, second):
+    """合并两次调用的用量 (格式修复重试计入原调用的日志)"""
+    if not first or not second:
+        return first or second
+    return {key: None if first.get(key) is None and second.get(key) is None
+            else (first.get(key) or 0) + (second.get(key) or 0)
+            for key in USAGE_COLUMNS}
+
+def usage_values(usage):
+    """按 USAGE_COLUMNS 顺序返回列值 (缓存命中等无用量时为 NULL)"""
+    usage = usage or {}
+    return tuple(usage.get(column) for column in USAGE_COLUMNS)
+
+def ensure_usage_columns(conn, db_type, table="log_prompt_execution"):
+    """为日志表补充 Token 用量列 (已存在则跳过)"""
+    cur = conn.cursor()
+    if db_type == 'postgres':
+        for column in USAGE_COLUMNS:
+            cur.execute(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS {column} INTEGER")
+    else:
+        cur.execute(f"PRAGMA table_info({table})")
+        existing = {row[1] for row in cur.fetchall()}
+        for column in USAGE_COLUMNS:
+            if column not in existing:
+                cur.execute(f"ALTER TABLE {table} ADD COLUMN {column} INTEGER")
+    conn.commit()
+    cur.close()
+
+class UsageTracker:
+    """累计一次运行中实际发往 API 的 Token 用量"""
+
+    def __init__(self):
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cached_tokens = 0
+
+    def add(self, usage):
+        self.calls += 1
+        if not usage:
+            return
+        self.prompt_tokens += usage.get("prompt_tokens") or 0
+        self.completion_tokens += usage.get("completion_tokens") or 0
+        self.cached_tokens += usage.get("cached_tokens") or 0
+
+    def summary(self):
+        """用量摘要: 总量、单次平均与前缀缓存命中比例"""
+        avg_prompt = self.prompt_tokens / self.calls if self.calls else 0
+        cached_rate = self.cached_tokens / self.prompt_tokens * 100 if self.prompt_tokens else 0
+        return (f"API 调用 {self.calls} 次 | 输入 {self.prompt_tokens} (平均 {avg_prompt:.0f}/次) | "
+                f"输出 {self.completion_tokens} | 前缀缓存命中 {self.cached_tokens} ({cached_rate:.1f}%)")
@@ -8,6 +8,8 @@
 4. 生成统计报告
 """
 
+import os
+import sys
 import json
 import time
 import psycopg2
@@ -15,6 +17,9 @@ from openai import OpenAI
 from concurrent.futures import ThreadPoolExecutor
 from tqdm import tqdm
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts"))
+from faq_output import extract_json, OutputParseError
+
 # 配置
 HUNYUAN_API_KEY = "sk-t5eMk6ZZSLu3CJlYpMmsPVNQQMcBrjY4N2uxhkfkMP3PgKv0"
 HUNYUAN_BASE_URL = "https://api.hunyuan.cloud.tencent.com/v1"
@@ -134,15 +139,10 @@ def analyze_transcript(row):
         # 解析结果
         questions = []
         try:
-            json_str = result
-            if "```json" in result:
-                json_str = result.split("```json")[1].split("```")[0]
-            elif "```" in result:
-                json_str = result.split("```")[1].split("```")[0]
-            
-            parsed = json.loads(json_str.strip())
+            # 代码块与前后说明文字由 faq_output 统一处理
+            parsed, _ = extract_json(result)
             questions = parsed.get("questions", [])
-        except:
+        except OutputParseError:
             pass
             
         return {
@@ -0,0 +1,148 @@
+"""
+对比 analyze_faq_ci.py 的调用配置: standard (category + reason) vs fast (只输出 category、限制 max_tokens、JSON 模式)
+以及 fast + 流式提前结束
+
+从 log_prompt_execution 随机抽取已成功分类的单句调用，按日志重建 user 消息，
+每条样本依次用各配置串行调用 (避免并发影响耗时)，统计:
+- 耗时 (平均 / P50 / P95) 与输出 Token
+- 输出无法解析的比例
+- 与 standard 本次结果、与日志中原结果的一致率
+
+使用方式 (在 backend 目录下):
+  python tests/benchmark_call_profile.py --samples 50
+  python tests/benchmark_call_profile.py --samples 50 --no-json-mode   # 接口不支持 response_format 时
+"""
+
+import os
+import sys
+import time
+import asyncio
+import argparse
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts"))
+
+from openai import AsyncOpenAI
+from faq_prompts import build_messages
+from faq_output import parse_category, OutputParseError
+from faq_log_format import decode_input, reconstruct_prompt
+from faq_transcript import parse_transcript, iter_candidates
+from llm_usage import extract_usage
+import analyze_faq_ci as ci
+
+# 配置名: (fast, stream)
+PROFILES = {
+    "standard": (False, False),
+    "fast": (True, False),
+    "fast+stream": (True, True),
+}
+
+def load_samples(db, conn, size):
+    """抽取单句模式的成功调用，返回 [(user 消息, 日志中的分类)]"""
+    cur = conn.cursor()
+    cur.execute(f"""
+        SELECT input_variables, raw_output FROM log_prompt_execution
+        WHERE prompt_id = 'faq_v3_ci' AND status = 'success'
+        ORDER BY RANDOM() LIMIT {size * 5}
+    """)
+    rows = cur.fetchall()
+    samples = []
+    transcripts = {}
+    for input_variables, raw_output in rows:
+        record = decode_input(input_variables)
+        # 只取紧凑格式的单句完整上下文调用 (批量与升级第一阶段的 system 消息不同)
+        if "target" not in record or record.get("stage") == 1:
+            continue
+        tid = record["tid"]
+        if tid not in transcripts:
+            cur.execute(f"SELECT content FROM sync_transcripts WHERE id = {db.placeholder}", (tid,))
+            row = cur.fetchone()
+            items = parse_transcript(row[0]) if row else None
+            transcripts[tid] = iter_candidates(items)[0] if items else None
+        if transcripts[tid] is None:
+            continue
+        try:
+            logged = parse_category(raw_output)
+        except OutputParseError:
+            continue
+        samples.append((reconstruct_prompt(record, transcripts[tid]), logged))
+        if len(samples) >= size:
+            break
+    cur.close()
+    return samples
+
+async def run_profile(client, prompt, fast, stream, json_mode, stats):
+    """按配置调用一次，返回 (分类或 None, 耗时秒, 输出 Token 或 None)"""
+    params = ci.call_params(SimpleNamespace(fast=fast, json_mode=json_mode))
+    messages = build_messages(prompt, fast=fast)
+    start = time.time()
+    response = await ci.request_completion(client, messages, params, stream, stats)
+    elapsed = time.time() - start
+    usage = extract_usage(response) or {}
+    try:
+        category = parse_category(response.choices[0].message.content.strip())
+    except OutputParseError:
+        category = None
+    return category, elapsed, usage.get("completion_tokens")
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] if values else 0
+
+async def benchmark(samples, json_mode):
+    client = AsyncOpenAI(api_key=ci.HUNYUAN_API_KEY, base_url=ci.HUNYUAN_BASE_URL, max_retries=2)
+    results = {name: [] for name in PROFILES}
+    stream_stats = ci.new_stream_stats()
+    try:
+        for i, (prompt, logged) in enumerate(samples):
+            for name, (fast, stream) in PROFILES.items():
+                try:
+                    results[name].append(await run_profile(client, prompt, fast, stream, json_mode, stream_stats))
+                except Exception as e:
+                    print(f"  ❌ [{name}] {e}")
+                    results[name].append((None, None, None))
+            print(f"[{i + 1}/{len(samples)}] " + " | ".join(
+                f"{name}: {results[name][-1][0]}" for name in PROFILES) + f" | 日志: {logged}")
+    finally:
+        await client.close()
+    return results, stream_stats
+
+def report(samples, results, stream_stats):
+    logged = [s[1] for s in samples]
+    baseline = [r[0] for r in results["standard"]]
+    print("-" * 50)
+    print(f"{'配置':<12} {'平均':>7} {'P50':>7} {'P95':>7} {'输出Token':>9} {'解析失败':>8} {'同standard':>10} {'同日志':>8}")
+    for name, rows in results.items():
+        times = [r[1] for r in rows if r[1] is not None]
+        tokens = [r[2] for r in rows if r[2] is not None]
+        failed = sum(r[0] is None for r in rows)
+        same_base = sum(r[0] is not None and r[0] == b for r, b in zip(rows, baseline))
+        same_log = sum(r[0] == l for r, l in zip(rows, logged))
+        n = len(rows) or 1
+        print(f"{name:<12} {sum(times) / max(len(times), 1):>6.2f}s {percentile(times, 0.5):>6.2f}s "
+              f"{percentile(times, 0.95):>6.2f}s {sum(tokens) / len(tokens) if tokens else 0:>9.1f} "
+              f"{failed / n:>8.1%} {same_base / n:>10.1%} {same_log / n:>8.1%}")
+    print(f"流式请求 {stream_stats['streamed']} 次，提前结束 {stream_stats['stopped_early']} 次 (提前结束的请求没有 Token 用量)")
+
+def main():
+    parser = argparse.ArgumentParser(description="对比 standard / fast 调用配置的耗时与准确性")
+    parser.add_argument("--samples", type=int, default=30, help="样本数 (默认 30)")
+    parser.add_argument("--no-json-mode", action="store_true", help="fast 配置不请求 JSON 模式")
+    args = parser.parse_args()
+
+    if not ci.HUNYUAN_API_KEY:
+        print("❌ 错误: 需要设置 HUNYUAN_API_KEY 环境变量")
+        return
+    db = ci.get_db_connection(ci.DATABASE_URL, max_connections=1)
+    with db.connection() as conn:
+        samples = load_samples(db, conn, args.samples)
+    db.close()
+    if not samples:
+        print("❌ 没有可用的单句调用日志")
+        return
+    print(f"🚀 样本 {len(samples)} 条，配置: {', '.join(PROFILES)}")
+    results, stream_stats = asyncio.run(benchmark(samples, not args.no_json_mode))
+    report(samples, results, stream_stats)
+
+if __name__ == "__main__":
+    main()
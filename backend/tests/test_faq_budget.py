@@ -0,0 +1,116 @@
+"""
+运行预算与熔断 (faq_budget) 的离线测试
+
+使用方式 (在 backend 目录下):
+  python -m pytest tests/test_faq_budget.py
+"""
+
+import os
+import sys
+import asyncio
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts"))
+
+from faq_budget import RunBudget, BudgetExhausted
+from llm_rate_limiter import AdaptiveRateLimiter
+
+class ServerError(Exception):
+    status_code = 503
+
+class RunBudgetTest(unittest.TestCase):
+    def test_unlimited(self):
+        budget = RunBudget()
+        self.assertFalse(budget.enabled)
+        for _ in range(100):
+            budget.start_call()
+        self.assertTrue(budget.admit())
+
+    def test_call_limit_is_hard(self):
+        budget = RunBudget(max_calls=2)
+        budget.start_call()
+        budget.start_call()
+        with self.assertRaises(BudgetExhausted):
+            budget.start_call()
+        self.assertEqual(budget.calls, 2)
+        self.assertTrue(budget.exhausted)
+        self.assertFalse(budget.admit())
+        self.assertEqual(budget.stats["skipped"], 1)
+
+    def test_token_limit_uses_estimate_without_usage(self):
+        budget = RunBudget(max_tokens=100)
+        budget.start_call()
+        budget.record_success({"prompt_tokens": 40, "completion_tokens": 10})
+        budget.start_call()
+        budget.record_success(None, estimated_tokens=60)
+        self.assertEqual(budget.tokens, 110)
+        with self.assertRaises(BudgetExhausted):
+            budget.start_call()
+
+    def test_admission_reserves_in_flight_transcripts(self):
+        budget = RunBudget(max_calls=10)
+        with budget.transcript():
+            for _ in range(4):
+                budget.start_call()
+        # 平均每个通话 4 次调用: 进行中的通话已用 1 次 (预留 3)，新通话再预留 4
+        with budget.transcript():
+            budget.start_call()
+            self.assertFalse(budget.admit())
+        self.assertTrue(budget.closed)
+        self.assertFalse(budget.exhausted)
+        # 停止准入不影响进行中通话的调用
+        budget.start_call()
+
+    def test_breaker_trips_on_consecutive_failures(self):
+        budget = RunBudget(max_failures=3)
+        budget.record_failure()
+        budget.record_failure()
+        budget.record_success()
+        budget.record_failure()
+        budget.record_failure()
+        self.assertFalse(budget.exhausted)
+        budget.record_failure()
+        self.assertTrue(budget.exhausted)
+        self.assertIn("熔断", budget.stop_reason)
+        with self.assertRaises(BudgetExhausted):
+            budget.start_call()
+
+    def test_limiter_retries_are_counted(self):
+        # 与 analyze_faq_ci 相同: start_call 在限流器每次尝试获取额度之前调用
+        budget = RunBudget(max_calls=3)
+        limiter = AdaptiveRateLimiter(rps=1000, base_delay=0.0)
+
+        async def attempt():
+            raise ServerError()
+
+        with self.assertRaises(BudgetExhausted):
+            asyncio.run(limiter.call_async(attempt, before=budget.start_call))
+        self.assertEqual(budget.calls, 3)
+        self.assertEqual(limiter.stats["retries"], 3)
+        # 被预算拒绝的第 4 次尝试没有发出请求
+        self.assertEqual(limiter.stats["requests"], 3)
+
+class AnalyzeBatchBudgetTest(unittest.TestCase):
+    def test_exhausted_budget_defers_group_without_fallback(self):
+        import analyze_faq_ci as ci
+
+        group = [{"text": f"第{i}句", "timestamp": i * 1000, "index": i, "start": 0} for i in range(3)]
+        lines = [f"客户: 第{i}句" for i in range(3)]
+        ctx = SimpleNamespace(parse_stats=None)
+
+        async def exhausted(*args, **kwargs):
+            raise BudgetExhausted("API 调用达到 1 次")
+
+        async def unexpected(*args, **kwargs):
+            raise AssertionError("预算用尽后不应回退逐句调用")
+
+        with mock.patch.object(ci, "cached_completion", exhausted), \
+                mock.patch.object(ci, "analyze_utterance", unexpected):
+            results = asyncio.run(ci.analyze_batch(ctx, "t1", None, lines, group))
+        self.assertEqual(results, [None, None, None])
+        self.assertTrue(all(c["failed"] and c["failures"] == 0 for c in group))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,110 @@
+"""
+工作队列与租约 (faq_claims) 的离线测试 (临时 SQLite 文件)
+
+使用方式 (在 backend 目录下):
+  python -m pytest tests/test_faq_claims.py
+"""
+
+import os
+import sys
+import time
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts"))
+
+from faq_db import Database
+from faq_processed import ensure_processed_schema, PROCESSED_TABLE
+from faq_claims import WorkQueue, ensure_queue_schema, QUEUE_TABLE, MAX_ATTEMPTS, COMPLETE_SQL, RETRY_SQL
+
+CANDIDATES_SQL = f"""
+    SELECT t.id FROM sync_transcripts t
+    WHERE NOT EXISTS (SELECT 1 FROM {QUEUE_TABLE} q WHERE q.transcript_id = t.id)
+    ORDER BY t.id
+"""
+
+class WorkQueueTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.db = Database(os.path.join(self.tmp.name, "t.db"), max_connections=2, sqlite_tuned=False)
+        self.conn = self.db.getconn()
+        self.conn.execute("CREATE TABLE sync_transcripts (id TEXT PRIMARY KEY)")
+        self.conn.executemany("INSERT INTO sync_transcripts VALUES (?)", [("t1",), ("t2",), ("t3",)])
+        ensure_processed_schema(self.conn, "sqlite")
+        ensure_queue_schema(self.conn, "sqlite")
+        self.a = WorkQueue(self.db, "v1", worker_id="a")
+        self.b = WorkQueue(self.db, "v1", worker_id="b")
+
+    def tearDown(self):
+        self.db.putconn(self.conn)
+        self.db.close()
+        self.tmp.cleanup()
+
+    def attempts(self):
+        rows = self.conn.execute(f"SELECT transcript_id, worker_id, attempts FROM {QUEUE_TABLE} ORDER BY 1")
+        return [tuple(row) for row in rows.fetchall()]
+
+    def expire_leases(self):
+        past = (datetime.now() - timedelta(seconds=1)).isoformat()
+        self.conn.execute(f"UPDATE {QUEUE_TABLE} SET lease_until = ?", (past,))
+        self.conn.commit()
+
+    def test_enqueue_is_idempotent(self):
+        self.assertEqual(self.a.enqueue(self.conn, CANDIDATES_SQL), 3)
+        self.assertEqual(self.b.enqueue(self.conn, CANDIDATES_SQL), 0)
+
+    def test_workers_claim_disjoint_rows(self):
+        self.a.enqueue(self.conn, CANDIDATES_SQL)
+        self.assertEqual(self.a.claim(self.conn, 2), ["t1", "t2"])
+        self.assertEqual(self.b.claim(self.conn, 2), ["t3"])
+        self.assertEqual(self.b.claim(self.conn, 2), [])
+        self.assertEqual(self.attempts(), [("t1", "a", 1), ("t2", "a", 1), ("t3", "b", 1)])
+
+    def test_expired_lease_is_reclaimed_and_counted(self):
+        self.a.enqueue(self.conn, CANDIDATES_SQL)
+        self.a.claim(self.conn, 1)
+        self.assertEqual(self.a.heartbeat(self.conn), 1)
+        self.expire_leases()
+        self.assertEqual(self.b.claim(self.conn, 1), ["t1"])
+        self.assertEqual(self.attempts()[0], ("t1", "b", 2))
+
+    def test_stalled_worker_stops_renewing(self):
+        self.a.enqueue(self.conn, CANDIDATES_SQL)
+        self.a.claim(self.conn, 1)
+        # 超过一个租约时长没有进展 (分析循环卡死): 心跳不续期，租约过期后其他进程接手
+        self.a.last_progress = time.monotonic() - self.a.lease_seconds - 1
+        self.assertEqual(self.a.heartbeat(self.conn), 0)
+        self.assertEqual(self.a.stats["stalled"], 1)
+        self.expire_leases()
+        self.assertEqual(self.b.claim(self.conn, 1), ["t1"])
+        # 进展恢复后只为仍持有的行续期 (已被接手的行不受影响)
+        self.a.progress()
+        self.assertEqual(self.a.heartbeat(self.conn), 0)
+        self.assertEqual(self.attempts()[0], ("t1", "b", 2))
+
+    def test_rows_over_max_attempts_are_not_claimed(self):
+        self.a.enqueue(self.conn, CANDIDATES_SQL)
+        for _ in range(MAX_ATTEMPTS):
+            self.assertIn("t1", self.a.claim(self.conn, 3))
+            self.expire_leases()
+        self.assertEqual(self.b.claim(self.conn, 3), [])
+
+    def test_release_and_retry_do_not_count_attempts(self):
+        self.a.enqueue(self.conn, CANDIDATES_SQL)
+        self.a.claim(self.conn, 3)
+        self.db.execute(self.conn.cursor(), RETRY_SQL, ("t3", "v1"))
+        self.assertEqual(self.a.release(self.conn), 2)
+        self.assertEqual(self.attempts(), [("t1", None, 0), ("t2", None, 0), ("t3", None, 0)])
+
+    def test_processed_rows_are_purged_and_completed_rows_removed(self):
+        self.a.enqueue(self.conn, CANDIDATES_SQL)
+        self.conn.execute(f"INSERT INTO {PROCESSED_TABLE} (transcript_id, prompt_version) VALUES ('t1', 'v1')")
+        self.db.execute(self.conn.cursor(), COMPLETE_SQL, ("t2", "v1"))
+        self.conn.commit()
+        self.assertEqual(self.a.claim(self.conn, 3), ["t3"])
+        self.a.discard(self.conn, ["t3"])
+        self.assertEqual(self.attempts(), [])
+
+if __name__ == "__main__":
+    unittest.main()
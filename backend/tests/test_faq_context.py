@@ -0,0 +1,66 @@
+"""
+上下文窗口与指代判定 (faq_context) 的离线测试
+
+使用方式 (在 backend 目录下):
+  python -m pytest tests/test_faq_context.py
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts"))
+
+from faq_context import ContextWindow, looks_referential
+
+# 典型的客户发言: 前 10 句离开上下文无法判断
+REFERENTIAL = ["那怎么弄呢", "这个多少钱", "这种防水能用多久", "刚才说的那个材料贵不贵", "多久呢",
+               "然后呢", "为什么啊", "那你们几点到", "它能管几年", "贵吗"]
+SELF_CONTAINED = ["你们报价多少", "卫生间漏水了怎么办", "防水一平米多少钱", "你们是正规公司吧有资质吗",
+                  "质保期是多久", "师傅明天上午能来吗", "我这边想问一下", "你们那个材料是什么牌子",
+                  "楼下说漏了", "要不要砸砖", "需要多长时间", "上门检测收费吗", "可以分期付款吗",
+                  "那明天上午来吧", "前面的墙也要做吗", "好的我知道了", "我家是老房子", "有没有优惠",
+                  "能开发票吗", "多少钱"]
+
+class LooksReferentialTest(unittest.TestCase):
+    def test_referential(self):
+        for text in REFERENTIAL:
+            with self.subTest(text=text):
+                self.assertTrue(looks_referential(text))
+
+    def test_self_contained(self):
+        # 句中的 "那个"、句首的 "我这边"、完整的短问句都不算指代
+        for text in SELF_CONTAINED:
+            with self.subTest(text=text):
+                self.assertFalse(looks_referential(text))
+
+    def test_punctuation_is_ignored(self):
+        self.assertTrue(looks_referential("那，怎么弄呢？"))
+        self.assertTrue(looks_referential("多久呢啊？"))
+
+class ContextWindowTest(unittest.TestCase):
+    def test_trims_oldest_lines_over_budget(self):
+        window = ContextWindow(budget=10)
+        for i in range(5):
+            window.push(i, "销售: " + "好" * 4)
+        self.assertLessEqual(window.tokens, 10)
+        self.assertEqual(window.start(99), window.turns[0][0])
+        self.assertEqual(window.lines()[-1], "销售: 好好好好")
+        self.assertGreater(window.start(99), 0)
+
+    def test_keeps_latest_line_even_if_over_budget(self):
+        window = ContextWindow(budget=1)
+        window.push(0, "销售: " + "很长的一段介绍" * 10)
+        self.assertEqual(window.start(99), 0)
+
+    def test_recent_start(self):
+        window = ContextWindow(budget=1000)
+        self.assertEqual(window.recent_start(2, 7), 7)
+        for i in (1, 3, 6):
+            window.push(i, f"客户: 第{i}句")
+        self.assertEqual(window.recent_start(2, 9), 3)
+        self.assertEqual(window.recent_start(10, 9), 1)
+        self.assertEqual(window.recent_start(0, 9), 9)
+
+if __name__ == "__main__":
+    unittest.main()
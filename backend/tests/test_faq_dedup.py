@@ -0,0 +1,72 @@
+"""
+近似去重 (faq_dedup: MinHash + LSH) 的离线测试
+
+使用方式 (在 backend 目录下):
+  python -m pytest tests/test_faq_dedup.py
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts"))
+
+from faq_dedup import normalize_text, context_signature, shingles, MinHasher, NearDuplicateIndex
+
+class NormalizeTest(unittest.TestCase):
+    def test_normalize_text(self):
+        self.assertEqual(normalize_text("那，你们ＡＢＣ防水嗯多少钱啊？"), "你们abc防水多少钱")
+
+    def test_context_signature(self):
+        # 独立成句的发言与上下文无关；指代或过短的发言以上一句为签名
+        self.assertEqual(context_signature("你们防水多少钱一平", "销售: 您好"), "")
+        self.assertEqual(context_signature("这个贵吗", "销售: 材料是进口的"), normalize_text("销售: 材料是进口的"))
+        self.assertEqual(context_signature("贵吗", None), "")
+
+    def test_shingles(self):
+        self.assertEqual(shingles("价格"), {"价格"})
+        self.assertEqual(shingles("多少钱"), {"多少", "少钱"})
+
+class MinHasherTest(unittest.TestCase):
+    def test_signature_is_deterministic(self):
+        grams = shingles("你们防水多少钱一平")
+        self.assertEqual(MinHasher().signature(grams), MinHasher().signature(grams))
+        self.assertEqual(len(MinHasher(bands=8, rows=2).signature(grams)), 16)
+
+    def test_similarity_tracks_jaccard(self):
+        hasher = MinHasher(bands=32, rows=4)
+        a = hasher.signature(shingles("你们防水一平米大概多少钱"))
+        b = hasher.signature(shingles("你们防水一平米大概要多少钱"))
+        c = hasher.signature(shingles("师傅明天上午几点能到"))
+        self.assertEqual(MinHasher.similarity(a, a), 1.0)
+        self.assertGreater(MinHasher.similarity(a, b), 0.6)
+        self.assertLess(MinHasher.similarity(a, c), 0.2)
+
+class NearDuplicateIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.index = NearDuplicateIndex(threshold=0.6)
+
+    def test_exact_and_near_hits(self):
+        entry, key = self.index.lookup("你们防水一平米大概多少钱")
+        self.assertIsNone(entry)
+        self.index.add(key, "rep")
+        self.assertEqual(self.index.lookup("你们防水一平米，大概多少钱啊？")[0], "rep")
+        self.assertEqual(self.index.lookup("嗯你们防水一平米大概要多少钱")[0], "rep")
+        self.assertIsNone(self.index.lookup("师傅明天上午几点能到")[0])
+        self.assertEqual(self.index.stats, {"lookups": 4, "exact_hits": 1, "near_hits": 1, "groups": 1})
+
+    def test_context_signature_separates_groups(self):
+        _, key = self.index.lookup("这个贵吗", "材料是进口的")
+        self.index.add(key, "rep", "材料是进口的")
+        self.assertEqual(self.index.lookup("这个贵吗", "材料是进口的")[0], "rep")
+        self.assertIsNone(self.index.lookup("这个贵吗", "上门检测收费")[0])
+
+    def test_reset_keeps_stats(self):
+        _, key = self.index.lookup("你们防水一平米大概多少钱")
+        self.index.add(key, "rep")
+        self.index.reset()
+        self.assertIsNone(self.index.lookup("你们防水一平米大概多少钱")[0])
+        self.assertEqual(self.index.stats["groups"], 1)
+
+if __name__ == "__main__":
+    unittest.main()
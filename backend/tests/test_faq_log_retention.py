@@ -0,0 +1,112 @@
+"""
+日志保留策略 (faq_log_retention) 的离线测试 (内存 SQLite)
+
+使用方式 (在 backend 目录下):
+  python -m pytest tests/test_faq_log_retention.py
+"""
+
+import os
+import sys
+import sqlite3
+import unittest
+from datetime import date
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts"))
+
+from llm_usage import ensure_usage_columns
+from faq_log_retention import (ensure_retention_schema, percentile, rollup_day, archive_day,
+                               ARCHIVE_TABLE, DAILY_TABLE)
+
+LOG_TABLE_SQL = """
+    CREATE TABLE log_prompt_execution (
+        id TEXT PRIMARY KEY, prompt_id TEXT, call_id TEXT, input_variables TEXT, raw_output TEXT,
+        execution_time_ms INTEGER, status TEXT, error_message TEXT, is_dry_run INTEGER DEFAULT 0,
+        created_at TEXT
+    )
+"""
+
+DAY = date(2024, 1, 1)
+
+class RetentionTest(unittest.TestCase):
+    def setUp(self):
+        self.conn = sqlite3.connect(":memory:")
+        self.conn.execute(LOG_TABLE_SQL)
+        ensure_usage_columns(self.conn, "sqlite")
+        ensure_retention_schema(self.conn, "sqlite")
+        self.cur = self.conn.cursor()
+
+    def tearDown(self):
+        self.conn.close()
+
+    def log(self, trace_id, created_at, ms=100, status="success", output="{}"):
+        self.cur.execute("""
+            INSERT OR REPLACE INTO log_prompt_execution
+            (id, prompt_id, input_variables, raw_output, execution_time_ms, status, created_at, prompt_tokens)
+            VALUES (?, 'faq_v3_ci', '{}', ?, ?, ?, ?, 10)
+        """, (trace_id, output, ms, status, created_at))
+
+    def close_day(self, day=DAY):
+        rollups = rollup_day(self.cur, "sqlite", day)
+        archived = archive_day(self.cur, "sqlite", day)
+        self.conn.commit()
+        return rollups, archived
+
+    def daily(self):
+        self.cur.execute(f"SELECT day, calls, errors, p50_ms, prompt_tokens FROM {DAILY_TABLE}")
+        return self.cur.fetchall()
+
+    def test_percentile_matches_percentile_cont(self):
+        self.assertIsNone(percentile([], 0.5))
+        self.assertEqual(percentile([10], 0.95), 10)
+        self.assertEqual(percentile([10, 20, 30, 40], 0.5), 25)
+        self.assertAlmostEqual(percentile([10, 20, 30, 40], 0.95), 38.5)
+
+    def test_close_day_rolls_up_and_moves_rows(self):
+        self.log("a", "2024-01-01T10:00:00", ms=100)
+        self.log("b", "2024-01-01T11:00:00", ms=300, status="error")
+        self.log("c", "2024-01-02T09:00:00")
+        self.assertEqual(self.close_day(), (1, 2))
+        self.assertEqual(self.daily(), [("2024-01-01", 2, 1, 200, 20)])
+        self.cur.execute("SELECT id FROM log_prompt_execution")
+        self.assertEqual(self.cur.fetchall(), [("c",)])
+
+    def test_late_row_with_archived_id_is_counted_once_and_replaces_archive(self):
+        self.log("a", "2024-01-01T10:00:00", output='{"v":1}')
+        self.close_day()
+        # 同一 trace id 重新写入同一天 (迟到 / 重新分析)
+        self.log("a", "2024-01-01T12:00:00", output='{"v":2}')
+        self.assertEqual(self.close_day(), (1, 1))
+        self.assertEqual(self.daily(), [("2024-01-01", 1, 0, 100, 10)])
+        self.cur.execute(f"SELECT id, raw_output FROM {ARCHIVE_TABLE}")
+        self.assertEqual(self.cur.fetchall(), [("a", '{"v":2}')])
+        self.cur.execute("SELECT COUNT(*) FROM log_prompt_execution")
+        self.assertEqual(self.cur.fetchone(), (0,))
+
+    def test_same_id_on_another_day_keeps_both_archive_rows(self):
+        self.log("a", "2024-01-01T10:00:00")
+        self.close_day()
+        self.log("a", "2024-01-05T10:00:00")
+        self.assertEqual(self.close_day(date(2024, 1, 5)), (1, 1))
+        self.cur.execute(f"SELECT created_day FROM {ARCHIVE_TABLE} ORDER BY created_day")
+        self.assertEqual(self.cur.fetchall(), [("2024-01-01",), ("2024-01-05",)])
+
+    def test_legacy_archive_key_is_migrated(self):
+        self.log("a", "2024-01-01T10:00:00")
+        self.close_day()
+        columns = [row[1] for row in self.conn.execute(f"PRAGMA table_info({ARCHIVE_TABLE})")]
+        # 模拟早期以 id 为主键的归档表
+        self.conn.execute(f"ALTER TABLE {ARCHIVE_TABLE} RENAME TO archive_copy")
+        self.conn.execute(f"CREATE TABLE {ARCHIVE_TABLE} ({columns[0]} TEXT PRIMARY KEY, "
+                          + ", ".join(columns[1:]) + ")")
+        self.conn.execute(f"INSERT INTO {ARCHIVE_TABLE} SELECT * FROM archive_copy")
+        self.conn.execute("DROP TABLE archive_copy")
+        ensure_retention_schema(self.conn, "sqlite")
+        key = [row[1] for row in self.conn.execute(f"PRAGMA table_info({ARCHIVE_TABLE})") if row[5]]
+        self.assertEqual(sorted(key), ["created_day", "id"])
+        self.log("a", "2024-01-05T10:00:00")
+        self.close_day(date(2024, 1, 5))
+        self.cur.execute(f"SELECT COUNT(*) FROM {ARCHIVE_TABLE}")
+        self.assertEqual(self.cur.fetchone(), (2,))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,58 @@
+"""
+log_prompt_execution 写入语句的离线测试 (内存 SQLite)
+
+使用方式 (在 backend 目录下):
+  python -m pytest tests/test_faq_log_upsert.py
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts"))
+
+from faq_db import Database
+from llm_usage import ensure_usage_columns
+from analyze_faq_ci import LOG_UPSERT_SQL, LOG_INSERT_SQL
+
+LOG_TABLE_SQL = """
+    CREATE TABLE log_prompt_execution (
+        id TEXT PRIMARY KEY, prompt_id TEXT, call_id TEXT, input_variables TEXT, raw_output TEXT,
+        execution_time_ms INTEGER, status TEXT, error_message TEXT, is_dry_run INTEGER DEFAULT 0,
+        created_at TEXT
+    )
+"""
+
+def log_row(prompt_id, input_variables, raw_output, status="success"):
+    return ("faq_trace_t0_1000", prompt_id, "c1", input_variables, raw_output,
+            10, status, None, False, "2024-01-01T00:00:00", 1, 2, 0)
+
+class LogUpsertTest(unittest.TestCase):
+    def setUp(self):
+        self.db = Database(":memory:", max_connections=1, sqlite_tuned=False)
+        self.conn = self.db.getconn()
+        self.conn.execute(LOG_TABLE_SQL)
+        ensure_usage_columns(self.conn, "sqlite")
+        self.cur = self.conn.cursor()
+
+    def tearDown(self):
+        self.db.putconn(self.conn)
+        self.db.close()
+
+    def fetch(self):
+        self.cur.execute("SELECT prompt_id, input_variables, raw_output, status FROM log_prompt_execution")
+        return [tuple(row) for row in self.cur.fetchall()]
+
+    def test_rerun_in_another_mode_replaces_stage_label(self):
+        # 第一次由 LLM 分类，--force 重跑时同一发言由规则判定: prompt_id 与输入记录都应更新
+        self.db.execute(self.cur, LOG_UPSERT_SQL, log_row("faq_v3_ci", '{"fmt":1}', '{"category":"价格咨询"}'))
+        self.db.execute(self.cur, LOG_UPSERT_SQL, log_row("faq_v3_rules", "这个多少钱", '{"category":"价格咨询"}'))
+        self.assertEqual(self.fetch(), [("faq_v3_rules", "这个多少钱", '{"category":"价格咨询"}', "success")])
+
+    def test_error_does_not_overwrite_success(self):
+        self.db.execute(self.cur, LOG_UPSERT_SQL, log_row("faq_v3_ci", '{"fmt":1}', '{"category":"价格咨询"}'))
+        self.db.execute(self.cur, LOG_INSERT_SQL, log_row("faq_v3_ci", '{"fmt":1}', "", status="error"))
+        self.assertEqual(self.fetch(), [("faq_v3_ci", '{"fmt":1}', '{"category":"价格咨询"}', "success")])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,121 @@
+"""
+LLM 分类输出解析与修复 (faq_output) 的离线测试
+
+使用方式 (在 backend 目录下):
+  python -m pytest tests/test_faq_output.py
+"""
+
+import os
+import sys
+import sqlite3
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts"))
+
+from faq_output import (extract_json, match_category, parse_classification, parse_batch_output, edit_distance,
+                        OutputParseError, ParseStats, ensure_parse_stats_schema, PARSE_STATS_TABLE)
+
+class ExtractJsonTest(unittest.TestCase):
+    def test_strict_json_is_clean(self):
+        self.assertEqual(extract_json('{"category": "质保期"}'), ({"category": "质保期"}, False))
+
+    def test_repairs(self):
+        cases = [
+            '```json\n{"category": "质保期"}\n```',            # 代码块
+            '分类结果如下：{"category": "质保期"} 以上。',       # 前后说明文字
+            '{“category”: “质保期”,}',                          # 中文引号 + 尾随逗号
+            '{"category": "质保期"} {"category": "价格咨询"}',  # 多个值取第一个
+        ]
+        for text in cases:
+            with self.subTest(text=text):
+                self.assertEqual(extract_json(text), ({"category": "质保期"}, True))
+
+    def test_expect_list(self):
+        self.assertEqual(extract_json('结果: [{"index": 0}]', expect=list), ([{"index": 0}], True))
+        with self.assertRaises(OutputParseError):
+            extract_json('{"index": 0}', expect=list)
+
+    def test_unparseable_keeps_raw_output(self):
+        with self.assertRaises(OutputParseError) as caught:
+            extract_json('{"category": "质保')
+        self.assertEqual(caught.exception.raw_output, '{"category": "质保')
+
+class MatchCategoryTest(unittest.TestCase):
+    def test_exact(self):
+        self.assertEqual(match_category("非问题"), ("非问题", False))
+
+    def test_repaired(self):
+        cases = {
+            "11. 付款方式": "付款方式",   # 序号前缀
+            "「价格咨询」": "价格咨询",   # 引号
+            "价格资询": "价格咨询",       # 错别字 (编辑距离 1)
+            "价格咨询类": "价格咨询",     # 包含关系
+            "其他": "其他问题",           # 旧分类名
+        }
+        for name, category in cases.items():
+            with self.subTest(name=name):
+                self.assertEqual(match_category(name), (category, True))
+
+    def test_unmatched(self):
+        for name in [None, 3, "", "不知道", "好"]:
+            with self.subTest(name=name):
+                self.assertEqual(match_category(name), (None, False))
+
+    def test_edit_distance(self):
+        self.assertEqual(edit_distance("价格咨询", "价格资询"), 1)
+        self.assertEqual(edit_distance("", "abc"), 3)
+
+class ParseClassificationTest(unittest.TestCase):
+    def test_clean(self):
+        self.assertEqual(parse_classification('{"category": "质保期", "confidence": 0.95}'), ("质保期", 0.95, False))
+
+    def test_confidence_words_and_bounds(self):
+        self.assertEqual(parse_classification('{"category": "质保期", "confidence": "高"}')[1], 0.9)
+        self.assertEqual(parse_classification('{"category": "质保期", "confidence": 3}')[1], 1.0)
+        self.assertIsNone(parse_classification('{"category": "质保期", "confidence": "很确定"}')[1])
+
+    def test_truncated_output_uses_category_field(self):
+        # max_tokens 截断: 没有完整 JSON
+        self.assertEqual(parse_classification('{"category": "价格咨询", "reason": "客户问'), ("价格咨询", None, True))
+        self.assertEqual(parse_classification('{"category": "上门时间", "confidence": 0.8'), ("上门时间", 0.8, True))
+
+    def test_plain_text_with_single_category(self):
+        self.assertEqual(parse_classification("客户在问质保期"), ("质保期", None, True))
+
+    def test_failures(self):
+        for text in ['{"category": "不知道"}', "无法判断", "价格咨询还是付款方式", ""]:
+            with self.subTest(text=text):
+                with self.assertRaises(OutputParseError):
+                    parse_classification(text)
+
+class ParseBatchOutputTest(unittest.TestCase):
+    def test_skips_invalid_entries(self):
+        raw = ('[{"index": 0, "category": "价格咨询"}, {"index": 1, "category": "乱写"}, '
+               '{"index": 5, "category": "质保期"}, {"index": "x"}, 3, {"index": "2", "category": "非问题"}]')
+        self.assertEqual(parse_batch_output(raw, 3), ({0: "价格咨询", 2: "非问题"}, False))
+
+    def test_repaired_entries(self):
+        self.assertEqual(parse_batch_output('```\n[{"index": 0, "category": "价格资询"}]\n```', 1),
+                         ({0: "价格咨询"}, True))
+
+    def test_not_an_array(self):
+        with self.assertRaises(OutputParseError):
+            parse_batch_output('{"index": 0, "category": "价格咨询"}', 1)
+
+class ParseStatsTest(unittest.TestCase):
+    def test_save_accumulates(self):
+        conn = sqlite3.connect(":memory:")
+        ensure_parse_stats_schema(conn, "sqlite")
+        for _ in range(2):
+            stats = ParseStats("v1")
+            stats.add("single", "clean")
+            stats.add("single", "unparsed")
+            stats.add("batch", "repaired")
+            stats.save(conn, "?")
+        rows = conn.execute(f"SELECT variant, clean, repaired, unparsed FROM {PARSE_STATS_TABLE} ORDER BY variant")
+        self.assertEqual(rows.fetchall(), [("batch", 0, 2, 0), ("single", 2, 0, 2)])
+        self.assertIn("无法解析 1 (50.0%)", stats.summary())
+        conn.close()
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,68 @@
+"""
+规则预分类器 (faq_preclassifier) 的离线测试
+
+使用方式 (在 backend 目录下):
+  python -m pytest tests/test_faq_preclassifier.py
+  python tests/test_faq_preclassifier.py
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts"))
+
+from faq_preclassifier import PreClassifier, AhoCorasick
+
+class AhoCorasickTest(unittest.TestCase):
+    def test_find_spans_returns_positions_of_overlapping_patterns(self):
+        automaton = AhoCorasick()
+        automaton.add("多少", "q")
+        automaton.add("多少钱", "k")
+        automaton.build()
+        self.assertEqual(sorted(automaton.find_spans("这个多少钱")), [(2, 4, "q"), (2, 5, "k")])
+        self.assertEqual(sorted(automaton.find_all("多少钱多少")), ["k", "q", "q"])
+
+class PreClassifierTest(unittest.TestCase):
+    def setUp(self):
+        self.classifier = PreClassifier()
+
+    def test_questions_are_classified(self):
+        cases = {
+            "这个多少钱": "价格咨询",
+            "多少钱啊？": "价格咨询",
+            "你们报价多少": "价格咨询",
+            "你们什么时候来": "上门时间",
+            "保修多久呢": "质保期",
+            "师傅是不是外包的": "服务人员",
+            "你们是正规公司吗": "公司资质",
+        }
+        for text, category in cases.items():
+            with self.subTest(text=text):
+                self.assertEqual(self.classifier.decide(text), category)
+
+    def test_statements_containing_question_words_go_to_llm(self):
+        # 业务短语自身含疑问词 ("多少钱" 含 "多少")，不能因此把陈述判为提问
+        for text in ["我不管多少钱都要装", "我知道多少钱了", "你们什么时候来都可以",
+                     "我上次问过保修多久了不用再说", "防水多少钱一平"]:
+            with self.subTest(text=text):
+                self.assertIsNone(self.classifier.decide(text))
+
+    def test_non_questions(self):
+        for text in ["好的谢谢", "嗯嗯"]:
+            with self.subTest(text=text):
+                self.assertEqual(self.classifier.decide(text), "非问题")
+
+    def test_ambiguous_turns_go_to_llm(self):
+        # 多个分类冲突 / 只有话题没有提问
+        for text in ["多少钱能分期吗", "报价发我一下"]:
+            with self.subTest(text=text):
+                self.assertIsNone(self.classifier.decide(text))
+
+    def test_stats(self):
+        for text in ["这个多少钱", "好的谢谢", "我知道多少钱了"]:
+            self.classifier.decide(text)
+        self.assertEqual(self.classifier.stats, {"total": 3, "decided": 2, "non_question": 1})
+
+if __name__ == "__main__":
+    unittest.main()
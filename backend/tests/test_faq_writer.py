@@ -0,0 +1,81 @@
+"""
+后台批量写入线程 (faq_writer) 的离线测试 (临时 SQLite 文件)
+
+使用方式 (在 backend 目录下):
+  python -m pytest tests/test_faq_writer.py
+"""
+
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts"))
+
+from faq_db import Database
+from faq_writer import BufferedWriter
+
+ITEM_SQL = "INSERT INTO items (tid, value) VALUES (%s, %s)"
+MARK_SQL = "INSERT INTO processed (tid) VALUES (%s)"
+
+class BufferedWriterTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.db = Database(os.path.join(self.tmp.name, "t.db"), max_connections=2, sqlite_tuned=False)
+        with self.db.connection() as conn:
+            conn.execute("CREATE TABLE items (tid TEXT, value INTEGER NOT NULL)")
+            conn.execute("CREATE TABLE processed (tid TEXT PRIMARY KEY)")
+        self.writer = BufferedWriter(self.db, flush_size=100, flush_interval=60)
+
+    def tearDown(self):
+        self.writer.close()
+        self.db.close()
+        self.tmp.cleanup()
+
+    def query(self, sql):
+        with self.db.connection() as conn:
+            return [tuple(row) for row in conn.execute(sql).fetchall()]
+
+    def test_batch_write(self):
+        for i in range(3):
+            self.writer.submit(ITEM_SQL, ("t1", i), "t1")
+        self.writer.submit(MARK_SQL, ("t1",), "t1")
+        self.writer.flush()
+        self.assertEqual(self.query("SELECT COUNT(*) FROM items"), [(3,)])
+        self.assertEqual(self.query("SELECT tid FROM processed"), [("t1",)])
+        self.assertEqual(self.writer.stats["flushes"], 1)
+
+    def test_failed_row_drops_later_writes_of_same_group(self):
+        self.writer.submit(ITEM_SQL, ("t1", 1), "t1")
+        self.writer.submit(ITEM_SQL, ("t1", None), "t1")  # NOT NULL 约束失败
+        self.writer.submit(ITEM_SQL, ("t2", 2), "t2")
+        self.writer.submit(MARK_SQL, ("t1",), "t1")
+        self.writer.submit(MARK_SQL, ("t2",), "t2")
+        self.writer.flush()
+        # 之后的分块里同组的写入同样放弃
+        self.writer.submit(MARK_SQL, ("t1",), "t1")
+        self.writer.flush()
+        self.assertEqual(self.query("SELECT tid FROM processed"), [("t2",)])
+        self.assertEqual(self.writer.stats["failed"], 1)
+        self.assertEqual(self.writer.stats["dropped"], 2)
+
+    def test_end_group_resets_failure(self):
+        self.writer.submit(ITEM_SQL, ("t1", None), "t1")
+        self.writer.end_group("t1")
+        self.writer.flush()
+        # 重新分析同一通话: 不受上次失败影响
+        self.writer.submit(ITEM_SQL, ("t1", 1), "t1")
+        self.writer.submit(MARK_SQL, ("t1",), "t1")
+        self.writer.end_group("t1")
+        self.writer.flush()
+        self.assertEqual(self.query("SELECT tid FROM processed"), [("t1",)])
+
+    def test_rows_without_group_are_skipped_individually(self):
+        self.writer.submit(ITEM_SQL, ("a", None))
+        self.writer.submit(ITEM_SQL, ("b", 1))
+        self.writer.flush()
+        self.assertEqual(self.query("SELECT tid FROM items"), [("b",)])
+        self.assertEqual(self.writer.stats["dropped"], 0)
+
+if __name__ == "__main__":
+    unittest.main()
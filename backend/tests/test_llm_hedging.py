@@ -0,0 +1,105 @@
+"""
+对冲请求 (llm_hedging) 的离线测试
+
+使用方式 (在 backend 目录下):
+  python -m pytest tests/test_llm_hedging.py
+"""
+
+import os
+import sys
+import asyncio
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts"))
+
+from llm_hedging import RequestHedger, percentile
+from llm_rate_limiter import AdaptiveRateLimiter
+
+def warmed_hedger(latency=0.01, samples=20, **kwargs):
+    """已有 samples 个耗时样本的对冲器 (对冲延迟 = latency)"""
+    kwargs.setdefault("max_ratio", 1.0)
+    hedger = RequestHedger(min_samples=samples, min_delay=latency, **kwargs)
+    hedger.latencies.extend([latency] * samples)
+    hedger.stats["calls"] = samples
+    return hedger
+
+class FakeRequests:
+    """按顺序返回预设的 (耗时, 结果或异常)，记录发出的请求与被取消的请求"""
+
+    def __init__(self, *plans):
+        self.plans = list(plans)
+        self.started = 0
+        self.cancelled = 0
+
+    async def __call__(self):
+        delay, result = self.plans[self.started]
+        self.started += 1
+        try:
+            await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+class RequestHedgerTest(unittest.TestCase):
+    def test_percentile(self):
+        self.assertIsNone(percentile([], 0.95))
+        self.assertEqual(percentile(list(range(1, 101)), 0.95), 96)
+
+    def test_no_hedge_before_min_samples(self):
+        hedger = RequestHedger(min_samples=5, min_delay=0.0)
+        requests = FakeRequests((0.02, "ok"))
+        self.assertIsNone(hedger.delay())
+        self.assertEqual(asyncio.run(hedger.run(requests)), "ok")
+        self.assertEqual((requests.started, hedger.stats["hedged"]), (1, 0))
+        self.assertEqual(len(hedger.latencies), 1)
+
+    def test_slow_primary_is_hedged_and_cancelled(self):
+        hedger = warmed_hedger()
+        requests = FakeRequests((1.0, "slow"), (0.01, "fast"))
+        self.assertEqual(asyncio.run(hedger.run(requests)), "fast")
+        self.assertEqual(requests.cancelled, 1)
+        self.assertEqual((hedger.stats["hedged"], hedger.stats["hedge_wins"]), (1, 1))
+        # 对冲胜出时被取消的主请求耗时未知，不进入样本
+        self.assertEqual(len(hedger.latencies), 20)
+
+    def test_invalid_result_does_not_win(self):
+        hedger = warmed_hedger()
+        requests = FakeRequests((0.05, "valid"), (0.01, "garbage"))
+        result = asyncio.run(hedger.run(requests, valid=lambda r: r == "valid"))
+        self.assertEqual(result, "valid")
+        self.assertEqual(hedger.stats["hedge_wins"], 0)
+
+    def test_both_fail_raises_primary_error(self):
+        hedger = warmed_hedger()
+        requests = FakeRequests((0.03, ValueError("primary")), (0.01, ValueError("hedge")))
+        with self.assertRaisesRegex(ValueError, "primary"):
+            asyncio.run(hedger.run(requests))
+
+    def test_hedge_rate_is_capped(self):
+        hedger = warmed_hedger(max_ratio=0.0)
+        requests = FakeRequests((0.03, "ok"))
+        self.assertEqual(asyncio.run(hedger.run(requests)), "ok")
+        self.assertEqual((requests.started, hedger.stats["capped"]), (1, 1))
+
+    def test_hedge_uses_its_own_factory(self):
+        hedger = warmed_hedger()
+        primary = FakeRequests((1.0, "slow"))
+        hedge = FakeRequests((0.01, "hedge"))
+        self.assertEqual(asyncio.run(hedger.run(primary, make_hedge=hedge)), "hedge")
+        self.assertEqual((primary.started, hedge.started), (1, 1))
+
+    def test_latency_excludes_limiter_queueing(self):
+        # 与 analyze_faq_ci 相同的组合: limiter 放行后才进入对冲器，排队时间不计入样本
+        hedger = RequestHedger(min_samples=1)
+        limiter = AdaptiveRateLimiter(rps=1000, tpm=60)
+        limiter._reserve(60)  # 耗尽 Token 额度: 下一次请求约排队 0.2 秒
+        requests = FakeRequests((0.01, "ok"))
+        result = asyncio.run(limiter.call_async(lambda: hedger.run(requests), tokens=0.2))
+        self.assertEqual(result, "ok")
+        self.assertLess(hedger.latencies[0], 0.1)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,111 @@
+"""
+自适应限流器 (llm_rate_limiter) 的离线测试
+
+使用方式 (在 backend 目录下):
+  python -m pytest tests/test_llm_rate_limiter.py
+"""
+
+import os
+import sys
+import asyncio
+import unittest
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts"))
+
+from llm_rate_limiter import AdaptiveRateLimiter, is_retryable, is_throttle, retry_after_seconds
+
+class StatusError(Exception):
+    def __init__(self, status_code, headers=None):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+        self.response = SimpleNamespace(headers=headers or {})
+
+class ErrorClassificationTest(unittest.TestCase):
+    def test_retryable(self):
+        self.assertTrue(is_retryable(StatusError(429)))
+        self.assertTrue(is_retryable(StatusError(503)))
+        self.assertTrue(is_retryable(asyncio.TimeoutError()))
+        self.assertFalse(is_retryable(StatusError(400)))
+        self.assertFalse(is_retryable(ValueError()))
+
+    def test_throttle(self):
+        self.assertTrue(is_throttle(StatusError(429)))
+        self.assertFalse(is_throttle(StatusError(503)))
+
+    def test_retry_after(self):
+        self.assertEqual(retry_after_seconds(StatusError(429, {"retry-after": "2"})), 2.0)
+        self.assertIsNone(retry_after_seconds(StatusError(429)))
+        self.assertIsNone(retry_after_seconds(ValueError()))
+
+class AdaptiveRateLimiterTest(unittest.TestCase):
+    def limiter(self, **kwargs):
+        kwargs.setdefault("base_delay", 0.0)
+        return AdaptiveRateLimiter(rps=1000, **kwargs)
+
+    def test_gcra_spacing(self):
+        limiter = AdaptiveRateLimiter(rps=10)
+        waits = [limiter._reserve(0) for _ in range(3)]
+        self.assertAlmostEqual(waits[1] - waits[0], 0.1, places=2)
+        self.assertAlmostEqual(waits[2] - waits[1], 0.1, places=2)
+
+    def test_token_budget_waits_for_refill(self):
+        limiter = AdaptiveRateLimiter(rps=1000, tpm=600)
+        self.assertLess(limiter._reserve(600), 0.01)
+        # 余额为 0 后再要 10 Token: 每秒补 10 个，约等 1 秒
+        self.assertAlmostEqual(limiter._reserve(10), 1.0, places=1)
+
+    def test_aimd(self):
+        limiter = AdaptiveRateLimiter(rps=2, increase_step=1, min_rps=0.5)
+        limiter.on_success()
+        limiter.on_success()
+        self.assertEqual(limiter.rate, 3)
+        limiter.on_throttle()
+        self.assertEqual(limiter.rate, 1.5)
+        limiter.on_throttle()  # 1 秒内同一波只减一次
+        self.assertEqual(limiter.rate, 1.5)
+        self.assertEqual(limiter.stats["throttled"], 2)
+
+    def test_call_retries_then_succeeds(self):
+        limiter = self.limiter()
+        attempts = []
+
+        def flaky():
+            attempts.append(1)
+            if len(attempts) < 3:
+                raise StatusError(503)
+            return "ok"
+
+        self.assertEqual(limiter.call(flaky), "ok")
+        self.assertEqual(limiter.stats["requests"], 3)
+        self.assertEqual(limiter.stats["retries"], 2)
+
+    def test_rejected_attempt_is_not_counted(self):
+        limiter = self.limiter()
+
+        def reject():
+            raise RuntimeError("budget")
+
+        with self.assertRaises(RuntimeError):
+            limiter.call(lambda: "ok", before=reject)
+        self.assertEqual(limiter.stats["requests"], 0)
+
+    def test_non_retryable_error_is_raised_immediately(self):
+        limiter = self.limiter()
+        with self.assertRaises(StatusError):
+            limiter.call(lambda: (_ for _ in ()).throw(StatusError(400)))
+        self.assertEqual(limiter.stats["retries"], 0)
+
+    def test_call_async_gives_up_after_max_retries(self):
+        limiter = self.limiter(max_retries=2)
+
+        async def always_throttled():
+            raise StatusError(429)
+
+        with self.assertRaises(StatusError):
+            asyncio.run(limiter.call_async(always_throttled))
+        self.assertEqual(limiter.stats["requests"], 3)
+        self.assertEqual(limiter.stats["given_up"], 1)
+
+if __name__ == "__main__":
+    unittest.main()